@@ -16,7 +16,7 @@ from configdb.hardware.models import (
     Site, Enclosure, GenericMode, ModeType, GenericModeGroup, Telescope, Instrument, Camera, CameraType,
     OpticalElementGroup, OpticalElement, InstrumentType, InstrumentCategory, ConfigurationType, ConfigurationTypeProperties
 )
-from configdb.hardware.validator import OCSValidator
+from configdb.hardware.validator import check_schema
 
 
 class ProperJSONField(forms.JSONField):
@@ -60,7 +60,7 @@ class GenericModeGroupAdminForm(forms.ModelForm):
     def clean(self):
         if 'validation_schema' in self.cleaned_data:
             try:
-                OCSValidator(self.cleaned_data['validation_schema'])
+                check_schema(self.cleaned_data['validation_schema'])
             except Exception as e:
                 raise ValidationError(f"Invalid cerberus validation_schema: {repr(e)}")
 
@@ -89,7 +89,7 @@ class InstrumentTypeAdminForm(forms.ModelForm):
     def clean(self):
         if 'validation_schema' in self.cleaned_data:
             try:
-                OCSValidator(self.cleaned_data['validation_schema'])
+                check_schema(self.cleaned_data['validation_schema'])
             except Exception as e:
                 raise ValidationError(f"Invalid cerberus validation_schema: {repr(e)}")
 
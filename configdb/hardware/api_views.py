@@ -1,16 +1,31 @@
+import hashlib
+
+from django.conf import settings
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets, filters
 import django_filters
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.schemas.openapi import AutoSchema
 
 from configdb.hardware import serializers
+from configdb.hardware.snapshot import is_snapshot_request, get_snapshot, SNAPSHOT_PARAMETERS
+from configdb.hardware.history import parse_as_of, get_historic_queryset
+from configdb.hardware.fast_serializers import FastSerializer, is_supported
 from .models import (
     Site, Enclosure, Telescope, OpticalElementGroup, Instrument, Camera, OpticalElement,
     CameraType, GenericMode, GenericModeGroup, InstrumentType, ModeType, ConfigurationType,
-    InstrumentCategory, ConfigurationTypeProperties
+    InstrumentCategory, ConfigurationTypeProperties, ConfigurationGeneration
 )
 
 
+# Query parameters that can be given along with as_of
+HISTORIC_PARAMETERS = SNAPSHOT_PARAMETERS + ('as_of', 'fields', 'exclude', 'depth')
+
+
 class CustomViewSchema(AutoSchema):
     """
     Class to generate OpenAPI schema from views
@@ -29,6 +44,111 @@ class CustomViewSchema(AutoSchema):
 class FilterableViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
 
+    def get_configuration_generation(self):
+        if not hasattr(self, '_configuration_generation'):
+            self._configuration_generation = ConfigurationGeneration.current()
+        return self._configuration_generation
+
+    def is_conditional_request(self, request):
+        # The browsable API pages differ per user, so only the data formats support conditional requests
+        return request.method in ('GET', 'HEAD') and request.accepted_renderer.format != 'api'
+
+    def get_etag(self, request):
+        """ The response for a url only changes when the configuration generation does, so the etag is
+            computed from the generation rather than from the response body
+        """
+        representation = f'{request.get_full_path()}:{request.accepted_media_type}'
+        digest = hashlib.md5(representation.encode()).hexdigest()
+        return quote_etag(f'{self.get_configuration_generation().generation}-{digest}')
+
+    def get_not_modified_response(self, request):
+        if not self.is_conditional_request(request):
+            return None
+        last_modified = int(self.get_configuration_generation().modified.timestamp())
+        return get_conditional_response(request, etag=self.get_etag(request), last_modified=last_modified)
+
+    def use_fast_serializer(self, request):
+        """ Read requests for the data formats can be serialized by the fast serializers, which produce the same
+            data. They are used if the FAST_SERIALIZATION setting is on, or the serializer=fast parameter is given.
+        """
+        if request.method not in ('GET', 'HEAD') or request.accepted_renderer.format == 'api':
+            return False
+        requested = request.query_params.get('serializer', '')
+        if requested not in ('fast', 'standard'):
+            requested = 'fast' if settings.FAST_SERIALIZATION else 'standard'
+        return requested == 'fast' and is_supported(self.get_serializer_class())
+
+    def get_as_of(self):
+        """ The time a read request asked for the configuration as of, or None for the current configuration.
+            Historic configurations are reconstructed in memory, so they cannot be filtered or ordered.
+        """
+        if not hasattr(self, '_as_of'):
+            self._as_of = None
+            as_of = self.request.query_params.get('as_of')
+            if as_of and self.request.method in ('GET', 'HEAD'):
+                try:
+                    self._as_of = parse_as_of(as_of)
+                except (ValueError, OverflowError):
+                    raise ValidationError({'as_of': ['The as_of parameter must be a parseable timestamp']})
+                unsupported = set(self.request.query_params) - set(HISTORIC_PARAMETERS)
+                if unsupported:
+                    raise ValidationError({
+                        'as_of': [f'The as_of parameter cannot be combined with {", ".join(sorted(unsupported))}']
+                    })
+        return self._as_of
+
+    def filter_queryset(self, queryset):
+        if self.get_as_of() is not None:
+            return queryset
+        return super().filter_queryset(queryset)
+
+    def get_object(self):
+        if self.get_as_of() is None:
+            return super().get_object()
+        lookup_value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        for instance in self.get_queryset():
+            if str(instance.pk) == lookup_value:
+                self.check_object_permissions(self.request, instance)
+                return instance
+        raise Http404
+
+    def get_queryset(self):
+        """ Prefetches of nested serializers that were left out with the fields, exclude or depth parameters are pruned
+        """
+        as_of = self.get_as_of()
+        if as_of is not None:
+            return get_historic_queryset(self.queryset.model, as_of)
+        queryset = super().get_queryset()
+        fieldset = serializers.SparseFieldset.from_request(self.request)
+        if fieldset is None or not queryset._prefetch_related_lookups:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        lookups = []
+        for lookup in queryset._prefetch_related_lookups:
+            lookup = fieldset.prune_lookup(serializer_class, lookup)
+            if lookup and lookup not in lookups:
+                lookups.append(lookup)
+        return queryset.prefetch_related(None).prefetch_related(*lookups)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.use_fast_serializer(self.request):
+            kwargs.setdefault('context', self.get_serializer_context())
+            return FastSerializer(self.get_serializer_class(), *args, **kwargs)
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_not_modified_response(request) or super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_not_modified_response(request) or super().retrieve(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.is_conditional_request(request) and response.status_code in (200, 304):
+            response['ETag'] = self.get_etag(request)
+            response['Last-Modified'] = http_date(self.get_configuration_generation().modified.timestamp())
+        return response
+
 
 class SiteViewSet(FilterableViewSet):
     schema = CustomViewSchema(tags=['Sites'])
@@ -37,12 +157,32 @@ class SiteViewSet(FilterableViewSet):
         'enclosure_set__telescope_set__instrument_set__autoguider_camera__optical_element_groups__optical_elements',
         'enclosure_set__telescope_set__instrument_set__science_cameras__optical_element_groups',
         'enclosure_set__telescope_set__instrument_set__science_cameras__optical_element_groups__optical_elements',
+        'enclosure_set__telescope_set__instrument_set__autoguider_camera__camera_type',
+        'enclosure_set__telescope_set__instrument_set__autoguider_camera__optical_element_groups__default',
+        'enclosure_set__telescope_set__instrument_set__science_cameras__camera_type',
+        'enclosure_set__telescope_set__instrument_set__science_cameras__optical_element_groups__default',
         'enclosure_set__telescope_set__instrument_set__instrument_type__mode_types',
         'enclosure_set__telescope_set__instrument_set__instrument_type__mode_types__modes',
+        'enclosure_set__telescope_set__instrument_set__instrument_type__mode_types__default',
+        'enclosure_set__telescope_set__instrument_set__instrument_type__configurationtypeproperties_set__configuration_type',
     )
     serializer_class = serializers.SiteSerializer
     filter_fields = ('name', 'code')
 
+    def list(self, request, *args, **kwargs):
+        # The full site tree is served from a snapshot that is only rebuilt when the configuration changes
+        if not is_snapshot_request(request):
+            return super().list(request, *args, **kwargs)
+        not_modified = self.get_not_modified_response(request)
+        if not_modified:
+            return not_modified
+        data = get_snapshot('sites', request, self.get_configuration_generation().generation,
+                            lambda: self.get_serializer(self.get_queryset(), many=True).data)
+        page = self.paginate_queryset(data)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(data)
+
 
 class EnclosureViewSet(FilterableViewSet):
     schema = CustomViewSchema(tags=['Enclosures'])
@@ -51,8 +191,14 @@ class EnclosureViewSet(FilterableViewSet):
         'telescope_set__instrument_set__autoguider_camera__optical_element_groups__optical_elements',
         'telescope_set__instrument_set__science_cameras__optical_element_groups',
         'telescope_set__instrument_set__science_cameras__optical_element_groups__optical_elements',
+        'telescope_set__instrument_set__autoguider_camera__camera_type',
+        'telescope_set__instrument_set__autoguider_camera__optical_element_groups__default',
+        'telescope_set__instrument_set__science_cameras__camera_type',
+        'telescope_set__instrument_set__science_cameras__optical_element_groups__default',
         'telescope_set__instrument_set__instrument_type__mode_types',
         'telescope_set__instrument_set__instrument_type__mode_types__modes',
+        'telescope_set__instrument_set__instrument_type__mode_types__default',
+        'telescope_set__instrument_set__instrument_type__configurationtypeproperties_set__configuration_type',
     )
 
     serializer_class = serializers.EnclosureSerializer
@@ -66,8 +212,14 @@ class TelescopeViewSet(FilterableViewSet):
         'instrument_set__autoguider_camera__optical_element_groups__optical_elements',
         'instrument_set__science_cameras__optical_element_groups',
         'instrument_set__science_cameras__optical_element_groups__optical_elements',
+        'instrument_set__autoguider_camera__camera_type',
+        'instrument_set__autoguider_camera__optical_element_groups__default',
+        'instrument_set__science_cameras__camera_type',
+        'instrument_set__science_cameras__optical_element_groups__default',
         'instrument_set__instrument_type__mode_types',
         'instrument_set__instrument_type__mode_types__modes',
+        'instrument_set__instrument_type__mode_types__default',
+        'instrument_set__instrument_type__configurationtypeproperties_set__configuration_type',
     )
     serializer_class = serializers.TelescopeSerializer
     filter_fields = ('name', 'code', 'lat', 'long', 'horizon',
@@ -104,8 +256,14 @@ class InstrumentViewSet(FilterableViewSet):
         'autoguider_camera__optical_element_groups__optical_elements',
         'science_cameras__optical_element_groups',
         'science_cameras__optical_element_groups__optical_elements',
+        'autoguider_camera__camera_type',
+        'autoguider_camera__optical_element_groups__default',
+        'science_cameras__camera_type',
+        'science_cameras__optical_element_groups__default',
         'instrument_type__mode_types',
-        'instrument_type__mode_types__modes'
+        'instrument_type__mode_types__modes',
+        'instrument_type__mode_types__default',
+        'instrument_type__configurationtypeproperties_set__configuration_type'
     ).distinct()
     serializer_class = serializers.InstrumentSerializer
     filter_backends = (DjangoFilterBackend, filters.OrderingFilter,)
@@ -124,7 +282,11 @@ class InstrumentTypeViewSet(FilterableViewSet):
                                {'name': 'code', 'description': 'Instrument type code'},
                                {'name': 'instrument_category', 'description': 'Instrument category name'}]
     schema = CustomViewSchema(tags=['Instrument Types'])
-    queryset = InstrumentType.objects.all()
+    queryset = InstrumentType.objects.all().prefetch_related(
+        'mode_types__modes',
+        'mode_types__default',
+        'configurationtypeproperties_set__configuration_type'
+    )
     serializer_class = serializers.InstrumentTypeSerializer
     filter_fields = ('name', 'code', 'instrument_category')
 
@@ -133,7 +295,8 @@ class CameraViewSet(FilterableViewSet):
     schema = CustomViewSchema(tags=['Cameras'])
     queryset = Camera.objects.all().select_related('camera_type').prefetch_related(
         'optical_element_groups',
-        'optical_element_groups__optical_elements'
+        'optical_element_groups__optical_elements',
+        'optical_element_groups__default'
     )
     serializer_class = serializers.CameraSerializer
     filter_fields = ('code', 'camera_type')
@@ -141,7 +304,7 @@ class CameraViewSet(FilterableViewSet):
 
 class OpticalElementGroupViewSet(FilterableViewSet):
     schema = CustomViewSchema(tags=['Optical Element Groups'])
-    queryset = OpticalElementGroup.objects.all().prefetch_related('optical_elements').distinct()
+    queryset = OpticalElementGroup.objects.all().select_related('default').prefetch_related('optical_elements').distinct()
     serializer_class = serializers.OpticalElementGroupSerializer
     filter_fields = ('name', 'type', 'optical_elements')
 
@@ -179,7 +342,7 @@ class ConfigurationTypePropertiesViewSet(FilterableViewSet):
 
 class GenericModeGroupViewSet(FilterableViewSet):
     schema = CustomViewSchema(tags=['Generic Mode Groups'])
-    queryset = GenericModeGroup.objects.all()
+    queryset = GenericModeGroup.objects.all().select_related('default').prefetch_related('modes')
     serializer_class = serializers.GenericModeGroupSerializer
 
 
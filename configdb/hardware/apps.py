@@ -10,6 +10,10 @@ class HardwareConfig(AppConfig):
     name = 'configdb.hardware'
 
     def ready(self):
+        # Always keep the configuration generation up to date so caches are invalidated on changes
+        import configdb.hardware.signals.generation  # noqa
+        import configdb.hardware.signals.history  # noqa
+        import configdb.hardware.signals.availability  # noqa
         # Only load the heroic communication signals if heroic settings are set
         if can_submit_to_heroic():
             import configdb.hardware.signals.handlers  # noqa
@@ -1,9 +1,10 @@
+from itertools import groupby
 
 from time_intervals.intervals import Intervals
-from reversion.models import Version
+from django.db.models import Q
 from django.utils import timezone
 
-from configdb.hardware.models import Instrument
+from configdb.hardware.models import Instrument, AvailabilityInterval
 
 
 # This is here for legacy compatibility with old configdb Versions that stored the state as a number
@@ -21,67 +22,130 @@ def state_conversion(version):
     return STATE_MAPPING.get(version.field_dict['state'], version.field_dict['state'])
 
 
-def build_availability_history(instance, initial, state_function, comparator):
-    """ Utility method builds a set of availability windows using the reversion Version set for the object.
-        This generic method takes in the initial value for the field you are using as the "state", as well
-        as a function that retrieves the "state" from the version field_dict, and a value to compare said
-        "state" to to see if you are "in" that "state".
+def is_instrument_version_available(version):
+    return state_conversion(version) == Instrument.SCHEDULABLE
+
+
+def is_telescope_version_available(version):
+    return version.field_dict['active'] is True
+
+
+def intervals_from_versions(versions, available_function):
+    """ Utility method builds a list of (start, end) availability windows from a set of reversion Versions of an
+        object in time order, earliest to latest. The available_function is given each version and returns whether
+        the object was available in it. The end of the last window is None if the object is still available.
     """
-    availability = []
-    versions = Version.objects.get_for_object(instance)
-    current_state = initial
-    current_time = timezone.now()
-    if current_state == comparator:
-        is_in_state = True
-        state_start_time = current_time
-        state_end_time = current_time
-    else:
-        is_in_state = False
-        state_start_time = None
-        state_end_time = None
-    # Versions are in reverse time order, latest to earliest
+    intervals = []
+    start = None
     for version in versions:
-        state = state_function(version)
-        if state == current_state:
-            if is_in_state:
-                state_start_time = version.field_dict['modified']
-        else:
-            if is_in_state:
-                availability.append((state_start_time, state_end_time))
-                is_in_state = False
-            elif state == comparator:
-                is_in_state = True
-                state_start_time = version.field_dict['modified']
-                state_end_time = current_time
-        current_time = version.field_dict['modified']
-        current_state = state
-    # If we've gone through all versions and the last was in_state, then add the last window
-    if is_in_state:
-        availability.append((state_start_time, state_end_time))
-    return availability
+        available = available_function(version)
+        if available and start is None:
+            start = version.field_dict['modified']
+        elif not available and start is not None:
+            intervals.append((start, version.field_dict['modified']))
+            start = None
+    if start is not None:
+        intervals.append((start, None))
+    return intervals
+
+
+def record_availability(version, available_function, **owner):
+    """ Updates the materialized availability intervals of an object with a newly saved version of it, opening
+        a new interval if it became available or closing the open interval if it became unavailable.
+    """
+    available = available_function(version)
+    open_interval = AvailabilityInterval.objects.filter(end__isnull=True, **owner).first()
+    if available and open_interval is None:
+        AvailabilityInterval.objects.create(start=version.field_dict['modified'], **owner)
+    elif not available and open_interval is not None:
+        open_interval.end = version.field_dict['modified']
+        open_interval.save(update_fields=['end'])
+
+
+def _as_tuples(intervals, available, modified, now):
+    """ Turns the materialized intervals of an object, latest first, into (start, end) tuples that end at now if
+        they are ongoing. The current state of the object decides its last interval, since an object that changed
+        without a version being saved, like one created before versions were kept, has intervals that do not match
+        it. An available object with no ongoing interval has been available at least since it was last modified,
+        and an unavailable one has not been available since then.
+    """
+    intervals = [(interval.start, interval.end) for interval in intervals]
+    ongoing = bool(intervals) and intervals[0][1] is None
+    if available and not ongoing:
+        intervals.insert(0, (max(modified, intervals[0][1]) if intervals else modified, None))
+    elif not available and ongoing:
+        intervals[0] = (intervals[0][0], max(intervals[0][0], modified))
+    return [(start, end or now) for start, end in intervals]
+
+
+def _instrument_tuples(instrument, intervals, now):
+    return _as_tuples(intervals, instrument.state == Instrument.SCHEDULABLE, instrument.modified, now)
+
+
+def _telescope_tuples(telescope, intervals, now):
+    return _as_tuples(intervals, telescope.active, telescope.modified, now)
 
 
 def build_instrument_availability_history(instrument):
-    """ Utility method to build a set of availability windows for an instrument given its version history
-        Outputs a list of tuples of (start, end) times for intervals when the instrument is schedulable
+    """ Utility method to get the set of availability windows for an instrument from its materialized intervals
+        Outputs a list of tuples of (start, end) times for intervals when the instrument is schedulable, latest first
     """
-    return build_availability_history(instrument, instrument.state, state_conversion, Instrument.SCHEDULABLE)
+    return _instrument_tuples(instrument, instrument.availability_intervals.all(), timezone.now())
 
 
 def build_telescope_availability_history(telescope):
-    """ Utility method to build a set of availability windows for an telescope given its version history.
+    """ Utility method to get the set of availability windows for a telescope from its materialized intervals.
         A telescope is considered available if it had any instruments in the SCHEDULABLE state during a time interval.
         Outputs a list of tuples of (start, end) times for intervals when the telescope is available.
     """
-    instrument_intervals = []
-    for instrument in telescope.instrument_set.all():
-        instrument_intervals.append(Intervals(build_instrument_availability_history(instrument)))
-    combined_instrument_availability = Intervals().union(instrument_intervals)
-
+    now = timezone.now()
+    intervals = AvailabilityInterval.objects.filter(Q(telescope=telescope) | Q(instrument__telescope=telescope))
+    instrument_intervals = {}
+    telescope_intervals = []
+    for interval in intervals:
+        if interval.telescope_id:
+            telescope_intervals.append(interval)
+        else:
+            instrument_intervals.setdefault(interval.instrument_id, []).append(interval)
+    combined_instrument_availability = Intervals().union([
+        Intervals(_instrument_tuples(instrument, instrument_intervals.get(instrument.id, []), now))
+        for instrument in telescope.instrument_set.all()
+    ])
     # We can also check the telescope active state history and enforce that as well
-    telescope_availability = build_availability_history(
-        telescope, telescope.active, lambda version: version.field_dict['active'], True
-    )
-    telescope_intervals = Intervals(telescope_availability)
+    telescope_availability = Intervals(_telescope_tuples(telescope, telescope_intervals, now))
     # Reverse the intervals so the latest is first
-    return reversed(combined_instrument_availability.intersect([telescope_intervals]).toTupleList())
+    return reversed(combined_instrument_availability.intersect([telescope_availability]).toTupleList())
+
+
+def build_network_availability_history(instruments):
+    """ Utility method to get the availability windows of many instruments and their telescopes at once.
+        All intervals are loaded in a single query and grouped in memory. A telescope is available when any of
+        the given instruments on it are SCHEDULABLE and it is active.
+        Yields tuples of (telescope, telescope windows, list of (instrument, instrument windows)), latest windows first.
+    """
+    now = timezone.now()
+    instruments = list(instruments.select_related('telescope__enclosure__site').order_by('telescope_id', 'code'))
+    telescope_ids = {instrument.telescope_id for instrument in instruments}
+    intervals_by_instrument = {}
+    intervals_by_telescope = {}
+    intervals = AvailabilityInterval.objects.filter(
+        Q(instrument__in=[instrument.id for instrument in instruments]) | Q(telescope__in=telescope_ids)
+    )
+    for interval in intervals:
+        if interval.telescope_id:
+            intervals_by_telescope.setdefault(interval.telescope_id, []).append(interval)
+        else:
+            intervals_by_instrument.setdefault(interval.instrument_id, []).append(interval)
+
+    for _, group in groupby(instruments, key=lambda instrument: instrument.telescope_id):
+        telescope_instruments = [
+            (instrument, _instrument_tuples(instrument, intervals_by_instrument.get(instrument.id, []), now))
+            for instrument in group
+        ]
+        telescope = telescope_instruments[0][0].telescope
+        combined_instrument_availability = Intervals().union([
+            Intervals(instrument_intervals) for _, instrument_intervals in telescope_instruments
+        ])
+        telescope_availability = Intervals(_telescope_tuples(telescope, intervals_by_telescope.get(telescope.id, []), now))
+        telescope_intervals = reversed(combined_instrument_availability.intersect([telescope_availability]).toTupleList())
+        yield telescope, list(telescope_intervals), telescope_instruments
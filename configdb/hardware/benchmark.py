@@ -0,0 +1,241 @@
+''' Performance benchmarks of the configdb endpoints against synthetic networks of a configurable size.
+    Each endpoint is measured for the number of database queries, the wall time and the peak memory it
+    takes to render, and compared against a stored baseline to catch regressions.
+'''
+import json
+import os
+import time
+import tracemalloc
+from statistics import median
+
+import reversion
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from configdb.hardware import urls as hardware_urls
+from configdb.hardware.models import (
+    Site, Enclosure, Telescope, Instrument, Camera, CameraType, GenericMode, GenericModeGroup, OpticalElement,
+    OpticalElementGroup, ModeType, InstrumentType, InstrumentCategory, ConfigurationType, ConfigurationTypeProperties
+)
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+# Number of each component in a generated network. Sites, enclosures per site, telescopes per enclosure,
+# instruments per telescope, science cameras per instrument and optical elements per camera.
+DEFAULT_NETWORK_SIZE = {
+    'sites': 2,
+    'enclosures': 2,
+    'telescopes': 2,
+    'instruments': 2,
+    'cameras': 1,
+    'optical_elements': 4
+}
+
+MODE_TYPES = {
+    'readout': ['default', 'fast'],
+    'guiding': ['OFF', 'ON'],
+    'acquisition': ['OFF', 'WCS']
+}
+
+CONFIGURATION_TYPES = ['EXPOSE', 'REPEAT_EXPOSE', 'BIAS', 'DARK']
+
+# Router basenames of the api endpoints that are benchmarked for their list and detail views
+API_ENDPOINTS = [
+    'site', 'enclosure', 'telescope', 'instrument', 'camera', 'cameratype', 'instrumenttype', 'opticalelementgroup',
+    'opticalelement', 'genericmodegroup', 'genericmode', 'modetype', 'configurationtype',
+    'configurationtypeproperties', 'instrumentcategory'
+]
+
+# Endpoints that are also benchmarked with the fast serializers
+FAST_SERIALIZER_ENDPOINTS = ['site', 'telescope', 'instrument']
+
+# Sparse fieldsets that light clients request, as (name, router basename, query string)
+SPARSE_FIELDSET_REQUESTS = [
+    ('instrument-list-codes', 'instrument', '?fields=code,state'),
+    ('site-list-depth', 'site', '?depth=2'),
+]
+
+HTML_ENDPOINTS = [
+    'index', 'html-site-list', 'html-telescope-list', 'html-camera-list', 'html-instrument-list',
+    'html-opticalelementgroup-list', 'html-genericmodegroup-list'
+]
+
+
+def network_size_key(network_size):
+    return 'x'.join(str(network_size[component]) for component in DEFAULT_NETWORK_SIZE)
+
+
+def generate_network(network_size=None):
+    ''' Creates a synthetic network with the same structure as the init_e2e_data command, scaled up to the given
+        number of each component. Instruments and telescopes are saved in revisions so they have availability history.
+    '''
+    network_size = {**DEFAULT_NETWORK_SIZE, **(network_size or {})}
+    imager_category, _ = InstrumentCategory.objects.get_or_create(code='IMAGE')
+    configuration_types = [
+        ConfigurationType.objects.get_or_create(code=code, defaults={'name': code.title()})[0] for code in CONFIGURATION_TYPES
+    ]
+    mode_groups = {}
+    for mode_type_code, mode_codes in MODE_TYPES.items():
+        mode_type, _ = ModeType.objects.get_or_create(id=mode_type_code)
+        modes = [
+            GenericMode.objects.create(code=code, name=f'{mode_type_code} {code}', validation_schema={})
+            for code in mode_codes
+        ]
+        mode_groups[mode_type] = modes
+
+    camera_type = CameraType.objects.create(code='BENCH-CAM', name='Benchmark Camera', pscale=0.4, size='26x26')
+    instrument_type = InstrumentType.objects.create(code='BENCH-IMAGER', name='Benchmark Imager',
+                                                    instrument_category=imager_category,
+                                                    default_configuration_type=configuration_types[0])
+    for configuration_type in configuration_types:
+        ConfigurationTypeProperties.objects.create(configuration_type=configuration_type, instrument_type=instrument_type)
+    for mode_type, modes in mode_groups.items():
+        mode_group = GenericModeGroup.objects.create(instrument_type=instrument_type, type=mode_type, default=modes[0])
+        mode_group.modes.add(*modes)
+
+    camera_count = 0
+    for site_index in range(network_size['sites']):
+        site = Site.objects.create(code=f's{site_index:02d}', name=f'Site {site_index}', active=True, timezone=0,
+                                   lat=site_index, long=site_index, elevation=0, tz='UTC')
+        for enclosure_index in range(network_size['enclosures']):
+            enclosure = Enclosure.objects.create(code=f'dom{enclosure_index}', name=f'Dome {enclosure_index}',
+                                                 site=site, active=True)
+            for telescope_index in range(network_size['telescopes']):
+                with reversion.create_revision():
+                    telescope = Telescope.objects.create(
+                        code=f'1m0{telescope_index}', name=f'Telescope {telescope_index}', enclosure=enclosure,
+                        active=True, aperture=1.0, lat=site.lat, long=site.long, horizon=15, ha_limit_pos=4.6,
+                        ha_limit_neg=-4.6
+                    )
+                for instrument_index in range(network_size['instruments']):
+                    cameras = []
+                    for _ in range(network_size['cameras']):
+                        camera = Camera.objects.create(code=f'cam{camera_count:04d}', camera_type=camera_type)
+                        optical_element_group = OpticalElementGroup.objects.create(
+                            name=f'Filters {camera_count}', type='filters'
+                        )
+                        optical_elements = [
+                            OpticalElement.objects.get_or_create(code=f'f{element_index}', defaults={'name': f'Filter {element_index}'})[0]
+                            for element_index in range(network_size['optical_elements'])
+                        ]
+                        optical_element_group.optical_elements.add(*optical_elements)
+                        optical_element_group.default = optical_elements[0]
+                        optical_element_group.save()
+                        camera.optical_element_groups.add(optical_element_group)
+                        cameras.append(camera)
+                        camera_count += 1
+                    with reversion.create_revision():
+                        instrument = Instrument.objects.create(
+                            code=f'{telescope.code}-{site.code}-{enclosure.code}-{instrument_index}',
+                            state=Instrument.SCHEDULABLE, telescope=telescope, instrument_type=instrument_type,
+                            autoguider_camera=cameras[0]
+                        )
+                        instrument.science_cameras.add(*cameras)
+    return network_size
+
+
+def get_benchmark_urls():
+    ''' Returns a list of (name, url) of the endpoints to benchmark in the current network
+    '''
+    urls = []
+    models = {basename: viewset.queryset.model for _, viewset, basename in hardware_urls.router.registry}
+    for basename in API_ENDPOINTS:
+        urls.append((f'{basename}-list', reverse(f'{basename}-list')))
+        instance = models[basename].objects.order_by('pk').first()
+        if instance is not None:
+            urls.append((f'{basename}-detail', reverse(f'{basename}-detail', args=(instance.pk,))))
+    for basename in FAST_SERIALIZER_ENDPOINTS:
+        urls.append((f'{basename}-list-fast', reverse(f'{basename}-list') + '?serializer=fast'))
+    for name, basename, query in SPARSE_FIELDSET_REQUESTS:
+        urls.append((name, reverse(f'{basename}-list') + query))
+    instrument = Instrument.objects.select_related('telescope__enclosure__site').order_by('pk').first()
+    if instrument is not None:
+        telescope = instrument.telescope
+        urls.append(('availability-instrument', reverse('availability') + f'?instrument_id={instrument.code}'))
+        urls.append(('availability-telescope', reverse('availability') + f'?site_id={telescope.enclosure.site.code}'
+                     f'&enclosure_id={telescope.enclosure.code}&telescope_id={telescope.code}'))
+    urls.append(('availability-bulk', reverse('availability-bulk')))
+    urls.append(('capabilities', reverse('capabilities')))
+    urls.append(('schemas', reverse('schemas') + '?instrument_type=BENCH-IMAGER'))
+    for name in HTML_ENDPOINTS:
+        urls.append((name, reverse(name)))
+    return urls
+
+
+def _request(client, url):
+    cache.clear()
+    response = client.get(url)
+    # Streaming responses do their work while they are consumed
+    if response.streaming:
+        b''.join(response.streaming_content)
+    if response.status_code != 200:
+        raise ValueError(f'Request to {url} failed with status {response.status_code}')
+
+
+def measure_url(client, url, repeat=3):
+    ''' Requests a url repeat times, with the cache cleared before each request so each one does the full work.
+        Returns the number of queries, the median wall time in milliseconds and the peak memory in kilobytes.
+        Memory is traced in a separate request since tracing slows down the requests that are timed.
+    '''
+    timings = []
+    query_count = 0
+    for _ in range(repeat):
+        # Each request empties the query log when it starts, so it is emptied beforehand to keep the positions
+        # the queries are captured from valid
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            _request(client, url)
+            timings.append((time.perf_counter() - start) * 1000)
+        query_count = len(queries)
+    tracemalloc.start()
+    try:
+        _request(client, url)
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+    return {'queries': query_count, 'time_ms': round(median(timings), 2), 'peak_memory_kb': round(peak_memory, 1)}
+
+
+def run_benchmarks(repeat=3):
+    ''' Measures every benchmarked endpoint of the current network, returning a dict of endpoint name to measurements
+    '''
+    client = Client()
+    return {name: measure_url(client, url, repeat) for name, url in get_benchmark_urls()}
+
+
+def compare_to_baseline(results, baseline, time_tolerance=1.0, memory_tolerance=0.5, time_slack_ms=25):
+    ''' Compares benchmark results against a baseline and returns a list of regressions. Query counts are
+        deterministic so any increase is a regression, while time and memory may grow by the given fraction.
+        Times may also grow by time_slack_ms, so the noise in timing fast endpoints is not reported.
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['queries'] > expected['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries, baseline is {expected["queries"]}')
+        if result['time_ms'] > expected['time_ms'] * (1 + time_tolerance) + time_slack_ms:
+            regressions.append(f'{name}: {result["time_ms"]}ms, baseline is {expected["time_ms"]}ms')
+        if result['peak_memory_kb'] > expected['peak_memory_kb'] * (1 + memory_tolerance):
+            regressions.append(f'{name}: {result["peak_memory_kb"]}KB peak memory, baseline is {expected["peak_memory_kb"]}KB')
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, baseline):
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
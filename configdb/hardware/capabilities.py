@@ -0,0 +1,83 @@
+from django.db.models import Prefetch
+
+from configdb.hardware.models import Instrument, OpticalElementGroup, GenericModeGroup
+
+
+TELESCOPE_FIELDS = (
+    'aperture', 'lat', 'long', 'horizon', 'ha_limit_pos', 'ha_limit_neg', 'zenith_blind_spot', 'slew_rate',
+    'minimum_slew_overhead', 'instrument_change_overhead', 'telescope_front_padding'
+)
+
+INSTRUMENT_TYPE_FIELDS = (
+    'fixed_overhead_per_exposure', 'observation_front_padding', 'config_front_padding', 'acquire_exposure_time',
+    'default_acceptability_threshold', 'allow_self_guiding'
+)
+
+
+def prefetch_capability_instruments(instruments):
+    """ Loads everything needed to build the capabilities of a queryset of instruments along with them, so the
+        capabilities and the HEROIC payloads are built from the same number of queries however many instruments
+        there are
+    """
+    return instruments.select_related('telescope__enclosure__site', 'instrument_type').prefetch_related(
+        Prefetch(
+            'science_cameras__optical_element_groups',
+            queryset=OpticalElementGroup.objects.select_related('default').prefetch_related('optical_elements')
+        ),
+        Prefetch(
+            'instrument_type__mode_types',
+            queryset=GenericModeGroup.objects.select_related('default').prefetch_related('modes')
+        ),
+    )
+
+
+def instrument_to_capabilities(instrument):
+    """ Flattens an instrument, its telescope and its instrument type into a single row of what it can do
+    """
+    telescope = instrument.telescope
+    enclosure = telescope.enclosure
+    site = enclosure.site
+    instrument_type = instrument.instrument_type
+    optical_elements = {}
+    for camera in instrument.science_cameras.all():
+        for optical_element_group in camera.optical_element_groups.all():
+            codes = optical_elements.setdefault(optical_element_group.type, [])
+            codes.extend(optical_element.code for optical_element in optical_element_group.optical_elements.all()
+                         if optical_element.code not in codes)
+    modes = {}
+    if instrument_type is not None:
+        for generic_mode_group in instrument_type.mode_types.all():
+            modes[generic_mode_group.type_id] = [mode.code for mode in generic_mode_group.modes.all()]
+    return {
+        'path': f'{site.code}.{enclosure.code}.{telescope.code}.{instrument.code}',
+        'site': site.code,
+        'enclosure': enclosure.code,
+        'telescope': telescope.code,
+        'instrument': instrument.code,
+        'state': instrument.state,
+        'elevation': site.elevation,
+        **{field: getattr(telescope, field) for field in TELESCOPE_FIELDS},
+        'instrument_type': instrument_type.code if instrument_type else None,
+        'instrument_category': instrument_type.instrument_category_id if instrument_type else None,
+        **{field: getattr(instrument_type, field, None) for field in INSTRUMENT_TYPE_FIELDS},
+        'optical_elements': optical_elements,
+        'modes': modes,
+    }
+
+
+def build_capabilities():
+    """ Builds the capabilities row of every instrument in the network, ordered by their path
+    """
+    instruments = prefetch_capability_instruments(Instrument.objects.all())
+    return sorted((instrument_to_capabilities(instrument) for instrument in instruments), key=lambda row: row['path'])
+
+
+def filter_capabilities(capabilities, site=None, instrument_type=None, instrument_category=None,
+                        states=(Instrument.SCHEDULABLE,)):
+    return [
+        row for row in capabilities
+        if (not site or row['site'] == site)
+        and (not instrument_type or row['instrument_type'] == instrument_type)
+        and (not instrument_category or row['instrument_category'] == instrument_category)
+        and (not states or row['state'] in states)
+    ]
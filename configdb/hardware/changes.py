@@ -0,0 +1,143 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max
+from reversion.models import Version
+
+from configdb.hardware.models import HARDWARE_MODELS, DeletionRecord, ConfigurationGeneration
+
+# Models whose string representations start with the code of their site
+SITE_MODELS = ('site', 'enclosure', 'telescope', 'instrument')
+
+
+def parse_cursor(cursor):
+    """ A cursor is '<revision id>.<deletion record id>' of the latest changes a client has seen. Revisions of
+        hardware models and deletion records get their ids while holding the configuration generation lock, so
+        their ids increase in the order they are committed and no change can appear behind a cursor after it was
+        handed out. Raises a ValueError if the cursor is malformed.
+    """
+    revision_id, deletion_id = (int(part) for part in cursor.split('.'))
+    if revision_id < 0 or deletion_id < 0:
+        raise ValueError(f'Invalid cursor {cursor}')
+    return revision_id, deletion_id
+
+
+def format_cursor(revision_id, deletion_id):
+    return f'{revision_id}.{deletion_id}'
+
+
+def get_current_cursor():
+    """ Cursor pointing at the latest change, for clients that are starting from a full download. Only revisions of
+        hardware models count, since other revisions do not take the generation lock and are not commit ordered.
+    """
+    content_types = get_hardware_content_types()
+    revision_id = Version.objects.filter(
+        content_type_id__in=content_types
+    ).aggregate(latest=Max('revision_id'))['latest'] or 0
+    deletion_id = DeletionRecord.objects.filter(
+        content_type_id__in=content_types
+    ).aggregate(latest=Max('id'))['latest'] or 0
+    return format_cursor(revision_id, deletion_id)
+
+
+def get_hardware_content_types():
+    """ Returns a dict of content type id to model for all hardware models """
+    return {content_type.id: model for model, content_type in ContentType.objects.get_for_models(*HARDWARE_MODELS).items()}
+
+
+def get_changes(cursor):
+    """ Builds the list of hardware objects that were created, updated or deleted after the cursor, along with
+        the cursor to use for the next call. Only the latest version of each changed object is returned, so the
+        work done is proportional to the number of changes rather than the size of the network.
+    """
+    since_revision_id, deletion_id = parse_cursor(cursor)
+    revision_id = since_revision_id
+    content_types = get_hardware_content_types()
+
+    latest_versions = {}
+    versions = Version.objects.filter(
+        revision_id__gt=since_revision_id, content_type_id__in=content_types
+    ).select_related('revision').order_by('revision_id', 'id')
+    for version in versions:
+        latest_versions[(version.content_type_id, version.object_id)] = version
+        revision_id = version.revision_id
+
+    # Objects that already had a version before the cursor were updated rather than created
+    object_ids_by_content_type = {}
+    for content_type_id, object_id in latest_versions:
+        object_ids_by_content_type.setdefault(content_type_id, []).append(object_id)
+    existing = set()
+    for content_type_id, object_ids in object_ids_by_content_type.items():
+        previous_versions = Version.objects.filter(
+            content_type_id=content_type_id, object_id__in=object_ids, revision_id__lte=since_revision_id
+        ).values_list('object_id', flat=True).distinct()
+        existing.update((content_type_id, object_id) for object_id in previous_versions)
+
+    changes = {}
+    for key, version in latest_versions.items():
+        serialized = json.loads(version.serialized_data)[0]
+        changes[key] = {
+            'model': content_types[version.content_type_id]._meta.model_name,
+            'id': serialized['pk'],
+            'action': 'updated' if key in existing else 'created',
+            'repr': version.object_repr,
+            'timestamp': version.revision.date_created,
+            'fields': serialized['fields']
+        }
+
+    deletions = DeletionRecord.objects.filter(id__gt=deletion_id, content_type_id__in=content_types)
+    for deletion in deletions:
+        model = content_types[deletion.content_type_id]
+        changes[(deletion.content_type_id, deletion.object_id)] = {
+            'model': model._meta.model_name,
+            'id': model._meta.pk.to_python(deletion.object_id),
+            'action': 'deleted',
+            'repr': deletion.object_repr,
+            'timestamp': deletion.deleted,
+            'fields': None
+        }
+        deletion_id = deletion.id
+
+    return {
+        'cursor': format_cursor(revision_id, deletion_id),
+        'changes': sorted(changes.values(), key=lambda change: change['timestamp'])
+    }
+
+
+def filter_changes(changes, models=None, site=None):
+    """ Narrows a list of changes down to the given model names and to the objects at a site. Only sites,
+        enclosures, telescopes and instruments belong to a site.
+    """
+    if models:
+        changes = [change for change in changes if change['model'] in models]
+    if site:
+        changes = [
+            change for change in changes
+            if change['model'] in SITE_MODELS and (change['repr'] == site or change['repr'].startswith(f'{site}.'))
+        ]
+    return changes
+
+
+def wait_for_changes(cursor, timeout, models=None, site=None):
+    """ Waits until there are changes after the cursor that match the filters, or until the timeout has passed.
+        Only the configuration generation is read while waiting, and the changes are looked up when it moves.
+        Returns the changes in the same format as get_changes, with a cursor past any changes that were filtered out.
+        Sleeping yields to other requests under the gevent workers.
+    """
+    deadline = time.monotonic() + timeout
+    generation = None
+    while True:
+        current_generation = ConfigurationGeneration.current().generation
+        if current_generation != generation:
+            generation = current_generation
+            changes = get_changes(cursor)
+            cursor = changes['cursor']
+            changes['changes'] = filter_changes(changes['changes'], models, site)
+            if changes['changes']:
+                return changes
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {'cursor': cursor, 'changes': []}
+        time.sleep(min(settings.CHANGES_POLL_INTERVAL, remaining))
@@ -0,0 +1,101 @@
+import json
+import re
+
+from django.db.models import Max, Q
+from reversion.models import Version
+
+from configdb.hardware.changes import parse_cursor, get_current_cursor, get_hardware_content_types
+from configdb.hardware.history import parse_as_of, get_cursor_as_of
+from configdb.hardware.models import DeletionRecord
+
+
+CURSOR_PATTERN = re.compile(r'^\d+\.\d+$')
+# Fields that change on every save, so they are left out of the changed fields
+IGNORED_FIELDS = ('modified',)
+
+
+def resolve_cursor(value):
+    """ A point in the configuration history is either a cursor returned by the changes endpoint or a timestamp.
+        Returns the cursor for it, and raises a ValueError if it is neither.
+    """
+    if value is None:
+        return get_current_cursor()
+    if CURSOR_PATTERN.match(value):
+        parse_cursor(value)
+        return value
+    return get_cursor_as_of(parse_as_of(value))
+
+
+def _version_fields(version):
+    return json.loads(version.serialized_data)[0]['fields']
+
+
+def _latest_versions(version_filter):
+    """ Returns the latest of the versions matching the filter for each object, by (content type id, object id) """
+    latest_ids = Version.objects.filter(version_filter).values('content_type_id', 'object_id').annotate(
+        latest=Max('id')
+    ).values('latest')
+    return {
+        (version.content_type_id, version.object_id): version
+        for version in Version.objects.filter(id__in=latest_ids)
+    }
+
+
+def diff_configuration(from_cursor, to_cursor):
+    """ Computes the objects that were added, removed or changed between two cursors, and the fields that changed
+        on each changed object. Only the versions and deletions between the cursors are loaded, along with the
+        previous version of the objects they touch. Objects are identified by their model and id. Their string
+        representation is only a label, since for some objects, like groups, it is made of codes that can change.
+    """
+    from_revision_id, from_deletion_id = parse_cursor(from_cursor)
+    to_revision_id, to_deletion_id = parse_cursor(to_cursor)
+    if from_revision_id > to_revision_id or from_deletion_id > to_deletion_id:
+        raise ValueError(f'Cursor {from_cursor} is after cursor {to_cursor}')
+    content_types = get_hardware_content_types()
+
+    new_versions = _latest_versions(
+        Q(revision_id__gt=from_revision_id, revision_id__lte=to_revision_id, content_type_id__in=content_types)
+    )
+    deletions = {
+        (deletion.content_type_id, deletion.object_id): deletion
+        for deletion in DeletionRecord.objects.filter(
+            id__gt=from_deletion_id, id__lte=to_deletion_id, content_type_id__in=content_types
+        )
+    }
+    touched = set(new_versions) | set(deletions)
+    object_ids_by_content_type = {}
+    for content_type_id, object_id in touched:
+        object_ids_by_content_type.setdefault(content_type_id, []).append(object_id)
+    old_versions_filter = Q(pk__in=[])
+    for content_type_id, object_ids in object_ids_by_content_type.items():
+        old_versions_filter |= Q(content_type_id=content_type_id, object_id__in=object_ids)
+    old_versions = _latest_versions(old_versions_filter & Q(revision_id__lte=from_revision_id))
+
+    diff = {'from': from_cursor, 'to': to_cursor, 'added': [], 'removed': [], 'changed': []}
+    identities = {}
+    for content_type_id, object_id in touched:
+        model = content_types[content_type_id]
+        identities[(content_type_id, object_id)] = {
+            'model': model._meta.model_name, 'id': model._meta.pk.to_python(object_id)
+        }
+    for key in sorted(touched, key=lambda key: (identities[key]['model'], identities[key]['id'])):
+        identity = identities[key]
+        old_version = old_versions.get(key)
+        if key in deletions:
+            # Objects that were created and deleted between the cursors did not exist at either of them
+            if old_version is not None:
+                diff['removed'].append({**identity, 'label': deletions[key].object_repr})
+        elif old_version is None:
+            new_version = new_versions[key]
+            diff['added'].append({**identity, 'label': new_version.object_repr, 'fields': _version_fields(new_version)})
+        else:
+            new_version = new_versions[key]
+            old_fields = _version_fields(old_version)
+            new_fields = _version_fields(new_version)
+            changed_fields = {
+                field: {'from': old_fields.get(field), 'to': value}
+                for field, value in new_fields.items() if field not in IGNORED_FIELDS and old_fields.get(field) != value
+            }
+            if changed_fields:
+                diff['changed'].append({**identity, 'label': new_version.object_repr, 'fields': changed_fields})
+    return diff
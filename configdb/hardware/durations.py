@@ -0,0 +1,264 @@
+''' Estimates of how long observations take from the overheads stored in the configuration. A batch of requests is
+    flattened into arrays of configurations and instrument configs, and the durations of all of them are computed
+    together with NumPy over overhead tables that are built once per configuration generation.
+
+    The duration of a request is the front padding of its telescope and instrument types, the slews between the
+    targets of its configurations, the instrument changes between its configurations and the duration of each
+    configuration. The duration of a configuration is its front padding, configuration type overhead and acquisition,
+    its instrument configs and the optical element changes between them.
+'''
+import numpy as np
+from django.db.models import Prefetch
+
+from configdb.hardware.models import Instrument, InstrumentType, GenericModeGroup
+
+
+INSTRUMENT_TYPE_OVERHEADS = (
+    'fixed_overhead_per_exposure', 'observation_front_padding', 'config_front_padding', 'acquire_exposure_time'
+)
+TELESCOPE_OVERHEADS = ('telescope_front_padding', 'slew_rate', 'minimum_slew_overhead', 'instrument_change_overhead')
+
+
+class DurationRequestError(ValueError):
+    """ Raised for a request that cannot be estimated, with the errors by field like a validation error """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(str(errors))
+
+
+def build_overhead_tables():
+    """ Builds the overhead tables of every instrument type from a fixed number of queries. Overheads of telescopes
+        are kept by telescope, and each instrument type also gets the largest overheads of the telescopes it is on
+        to estimate requests that are not for a specific telescope.
+    """
+    instrument_types = list(InstrumentType.objects.order_by('code').prefetch_related(
+        'configurationtypeproperties_set', Prefetch('mode_types', queryset=GenericModeGroup.objects.prefetch_related('modes'))
+    ))
+    instruments = Instrument.objects.select_related('telescope__enclosure__site').prefetch_related(
+        'science_cameras__optical_element_groups'
+    )
+    index = {instrument_type.id: position for position, instrument_type in enumerate(instrument_types)}
+    telescopes = {}
+    instrument_type_telescopes = {}
+    element_changes = {}
+    for instrument in instruments:
+        telescope = instrument.telescope
+        overheads = tuple(getattr(telescope, field) for field in TELESCOPE_OVERHEADS)
+        telescopes[str(telescope)] = overheads
+        if instrument.instrument_type_id is None:
+            continue
+        code = instrument_types[index[instrument.instrument_type_id]].code
+        current = instrument_type_telescopes.get(code, (0.0,) * len(TELESCOPE_OVERHEADS))
+        instrument_type_telescopes[code] = tuple(np.maximum(current, overheads).tolist())
+        for camera in instrument.science_cameras.all():
+            for group in camera.optical_element_groups.all():
+                key = (code, group.type)
+                element_changes[key] = max(element_changes.get(key, 0.0), group.element_change_overhead)
+    group_types = sorted({group_type for _, group_type in element_changes})
+    element_change_overheads = np.zeros((len(instrument_types), len(group_types)))
+    for (code, group_type), overhead in element_changes.items():
+        position = next(position for position, instrument_type in enumerate(instrument_types) if instrument_type.code == code)
+        element_change_overheads[position, group_types.index(group_type)] = overhead
+    return {
+        'instrument_types': {instrument_type.code: position for position, instrument_type in enumerate(instrument_types)},
+        'instrument_type_overheads': np.array(
+            [[getattr(instrument_type, field) for field in INSTRUMENT_TYPE_OVERHEADS] for instrument_type in instrument_types]
+        ).reshape(len(instrument_types), len(INSTRUMENT_TYPE_OVERHEADS)),
+        'configuration_types': {
+            (instrument_type.code, properties.configuration_type_id): properties.config_change_overhead
+            for instrument_type in instrument_types for properties in instrument_type.configurationtypeproperties_set.all()
+        },
+        'modes': {
+            (instrument_type.code, group.type_id, mode.code): mode.overhead
+            for instrument_type in instrument_types for group in instrument_type.mode_types.all() for mode in group.modes.all()
+        },
+        'group_types': group_types,
+        # Instrument configs name optical elements by the singular of their group type, like filter for filters
+        'group_type_keys': {
+            **{group_type[:-1]: group_type for group_type in group_types if group_type.endswith('s')},
+            **{group_type: group_type for group_type in group_types}
+        },
+        'element_change_overheads': element_change_overheads,
+        'telescopes': telescopes,
+        'instrument_type_telescopes': instrument_type_telescopes,
+    }
+
+
+def _number(value, field, errors, minimum=0):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        errors.setdefault(field, []).append(f'Must be a number of at least {minimum}')
+        return 0.0
+    return float(value)
+
+
+def _parse_request(request, tables):
+    """ Reads a request into rows of its configurations and instrument configs. Raises a DurationRequestError with
+        every error in the request.
+    """
+    if not isinstance(request, dict) or not isinstance(request.get('configurations'), list) or not request['configurations']:
+        raise DurationRequestError({'configurations': ['A request must have a list of configurations']})
+    errors = {}
+    configurations = []
+    instrument_configs = []
+    for position, configuration in enumerate(request['configurations']):
+        path = f'configurations[{position}]'
+        if not isinstance(configuration, dict):
+            errors.setdefault(path, []).append('Must be an object')
+            continue
+        instrument_type = configuration.get('instrument_type')
+        if instrument_type not in tables['instrument_types']:
+            errors.setdefault(f'{path}.instrument_type', []).append(f'Unknown instrument type {instrument_type}')
+            continue
+        configuration_type_overhead = tables['configuration_types'].get((instrument_type, configuration.get('type')))
+        if configuration_type_overhead is None:
+            errors.setdefault(f'{path}.type', []).append(
+                f'Configuration type {configuration.get("type")} is not available on instrument type {instrument_type}'
+            )
+        acquisition_overhead = 0.0
+        if configuration.get('acquisition_mode') not in (None, 'OFF'):
+            mode_overhead = tables['modes'].get((instrument_type, 'acquisition', configuration['acquisition_mode']))
+            if mode_overhead is None:
+                errors.setdefault(f'{path}.acquisition_mode', []).append(
+                    f'Acquisition mode {configuration["acquisition_mode"]} is not available on instrument type {instrument_type}'
+                )
+            else:
+                acquisition_overhead = mode_overhead + tables['instrument_type_overheads'][tables['instrument_types'][instrument_type], 3]
+        target = configuration.get('target') or {}
+        ra = _number(target.get('ra', 0.0), f'{path}.target.ra', errors, minimum=-360)
+        dec = _number(target.get('dec', 0.0), f'{path}.target.dec', errors, minimum=-90)
+        if not configuration.get('instrument_configs'):
+            errors.setdefault(f'{path}.instrument_configs', []).append('A configuration must have instrument configs')
+        for ic_position, instrument_config in enumerate(configuration.get('instrument_configs') or []):
+            ic_path = f'{path}.instrument_configs[{ic_position}]'
+            if not isinstance(instrument_config, dict):
+                errors.setdefault(ic_path, []).append('Must be an object')
+                continue
+            readout_overhead = 0.0
+            if instrument_config.get('mode') is not None:
+                readout_overhead = tables['modes'].get((instrument_type, 'readout', instrument_config['mode']))
+                if readout_overhead is None:
+                    errors.setdefault(f'{ic_path}.mode', []).append(
+                        f'Readout mode {instrument_config["mode"]} is not available on instrument type {instrument_type}'
+                    )
+                    readout_overhead = 0.0
+            optical_elements = {}
+            requested_elements = instrument_config.get('optical_elements') or {}
+            if not isinstance(requested_elements, dict):
+                errors.setdefault(f'{ic_path}.optical_elements', []).append('Must be an object of type to code')
+                requested_elements = {}
+            for key, code in requested_elements.items():
+                if key in tables['group_type_keys']:
+                    optical_elements[tables['group_type_keys'][key]] = code
+                else:
+                    errors.setdefault(f'{ic_path}.optical_elements', []).append(f'Unknown optical element type {key}')
+            instrument_configs.append((
+                len(configurations),
+                _number(instrument_config.get('exposure_time'), f'{ic_path}.exposure_time', errors),
+                _number(instrument_config.get('exposure_count', 1), f'{ic_path}.exposure_count', errors, minimum=1),
+                readout_overhead,
+                [optical_elements.get(group_type) for group_type in tables['group_types']],
+            ))
+        configurations.append((
+            tables['instrument_types'][instrument_type],
+            (configuration_type_overhead or 0.0) + acquisition_overhead,
+            ra, dec, bool(target),
+        ))
+    telescope = request.get('telescope')
+    if telescope:
+        if telescope not in tables['telescopes']:
+            errors.setdefault('telescope', []).append(f'Unknown telescope {telescope}')
+        telescope_overheads = tables['telescopes'].get(telescope)
+    else:
+        codes = {configuration.get('instrument_type') for configuration in request['configurations'] if isinstance(configuration, dict)}
+        telescope_overheads = tuple(np.max(
+            [tables['instrument_type_telescopes'].get(code, (0.0,) * len(TELESCOPE_OVERHEADS)) for code in codes], axis=0
+        ).tolist()) if codes else None
+    if errors:
+        raise DurationRequestError(errors)
+    return telescope_overheads, configurations, instrument_configs
+
+
+def _angular_separation(ra1, dec1, ra2, dec2):
+    """ Angular separation in arcseconds between arrays of coordinates in degrees """
+    ra1, dec1, ra2, dec2 = (np.radians(values) for values in (ra1, dec1, ra2, dec2))
+    cosine = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))) * 3600.0
+
+
+def compute_durations(requests, tables):
+    """ Computes the duration in seconds of every request in a batch, and of each of its configurations. Each
+        request has an optional telescope and a list of configurations, each with an instrument_type, a configuration
+        type, an optional acquisition_mode and target with ra and dec, and instrument configs with an exposure_time,
+        exposure_count, readout mode and optical elements by group type. Returns a result per request with either its
+        duration and configuration durations or its errors.
+    """
+    results = [None] * len(requests)
+    request_rows = []
+    configuration_rows = []
+    instrument_config_rows = []
+    for position, request in enumerate(requests):
+        try:
+            telescope_overheads, configurations, instrument_configs = _parse_request(request, tables)
+        except DurationRequestError as e:
+            results[position] = {'errors': e.errors}
+            continue
+        offset = len(configuration_rows)
+        instrument_config_rows.extend((offset + row[0],) + row[1:] for row in instrument_configs)
+        configuration_rows.extend((len(request_rows),) + row for row in configurations)
+        request_rows.append((position, telescope_overheads))
+    if not request_rows:
+        return results
+
+    # Instrument configs: each exposure takes its exposure time, the fixed overhead and the readout overhead, and
+    # changing an optical element from the previous instrument config of the configuration takes the group's overhead
+    ic_configuration = np.array([row[0] for row in instrument_config_rows], dtype=int)
+    exposure_time = np.array([row[1] for row in instrument_config_rows])
+    exposure_count = np.array([row[2] for row in instrument_config_rows])
+    readout_overhead = np.array([row[3] for row in instrument_config_rows])
+    configuration_instrument_type = np.array([row[1] for row in configuration_rows], dtype=int)
+    ic_instrument_type = configuration_instrument_type[ic_configuration]
+    instrument_type_overheads = tables['instrument_type_overheads']
+    ic_duration = exposure_count * (exposure_time + instrument_type_overheads[ic_instrument_type, 0] + readout_overhead)
+    if tables['group_types'] and len(instrument_config_rows) > 1:
+        elements = np.array([row[4] for row in instrument_config_rows], dtype=object)
+        changed = (elements[1:] != elements[:-1]) & (elements[1:] != None)  # noqa: E711
+        changed &= (ic_configuration[1:] == ic_configuration[:-1])[:, None]
+        change_overheads = tables['element_change_overheads'][ic_instrument_type[1:]]
+        ic_duration[1:] += (changed * change_overheads).sum(axis=1)
+
+    # Configurations: the front padding, configuration type and acquisition overheads and the instrument configs
+    configuration_request = np.array([row[0] for row in configuration_rows], dtype=int)
+    configuration_duration = (
+        instrument_type_overheads[configuration_instrument_type, 2]
+        + np.array([row[2] for row in configuration_rows])
+        + np.bincount(ic_configuration, weights=ic_duration, minlength=len(configuration_rows))
+    )
+
+    # Requests: the front paddings, the configurations, and the slews and instrument changes between them
+    telescope_overheads = np.array([row[1] for row in request_rows]).reshape(len(request_rows), len(TELESCOPE_OVERHEADS))
+    front_padding = np.zeros(len(request_rows))
+    np.maximum.at(front_padding, configuration_request, instrument_type_overheads[configuration_instrument_type, 1])
+    request_duration = (
+        telescope_overheads[:, 0] + front_padding
+        + np.bincount(configuration_request, weights=configuration_duration, minlength=len(request_rows))
+    )
+    if len(configuration_rows) > 1:
+        next_request = configuration_request[1:]
+        same_request = next_request == configuration_request[:-1]
+        instrument_changes = same_request & (configuration_instrument_type[1:] != configuration_instrument_type[:-1])
+        request_duration += np.bincount(next_request, minlength=len(request_rows),
+                                        weights=instrument_changes * telescope_overheads[next_request, 3])
+        ra = np.array([row[3] for row in configuration_rows])
+        dec = np.array([row[4] for row in configuration_rows])
+        has_target = np.array([row[5] for row in configuration_rows])
+        separation = _angular_separation(ra[:-1], dec[:-1], ra[1:], dec[1:])
+        slews = same_request & has_target[1:] & has_target[:-1] & (separation > 0)
+        slew_duration = np.maximum(telescope_overheads[next_request, 2], separation * telescope_overheads[next_request, 1])
+        request_duration += np.bincount(next_request, weights=slews * slew_duration, minlength=len(request_rows))
+
+    for request_index, (position, _) in enumerate(request_rows):
+        results[position] = {
+            'duration': float(request_duration[request_index]),
+            'configurations': configuration_duration[configuration_request == request_index].tolist(),
+        }
+    return results
@@ -0,0 +1,174 @@
+''' Read-only serialization of hardware objects that produces the same data as the serializers in serializers.py
+    without going through the DRF field machinery for every object. Each serializer class is compiled once into a
+    plan of field names and getters, and hyperlinks are formatted from a reversed url instead of being reversed for
+    every object.
+'''
+from rest_framework import serializers as drf_serializers
+from rest_framework.reverse import reverse
+from rest_framework.fields import is_simple_callable
+from rest_framework.relations import PKOnlyObject
+
+from configdb.hardware import serializers
+
+
+def _default_to_empty_string(data):
+    if 'default' in data and data['default'] is None:
+        data['default'] = ''
+    return data
+
+
+# Serializers that change their data in to_representation, and the function that makes the same change
+REPRESENTATION_CHANGES = {
+    serializers.OpticalElementGroupSerializer: _default_to_empty_string,
+    serializers.GenericModeGroupSerializer: _default_to_empty_string,
+}
+
+# Conversions that are equivalent to the to_representation of the simple field types
+SIMPLE_FIELD_CONVERSIONS = {
+    drf_serializers.CharField: str,
+    drf_serializers.IntegerField: int,
+    drf_serializers.FloatField: float,
+    drf_serializers.BooleanField: bool,
+    drf_serializers.ReadOnlyField: None,
+}
+
+_plans = {}
+
+
+class UnsupportedSerializer(Exception):
+    pass
+
+
+class SerializationContext:
+    ''' Per request state used while serializing, which caches the reversed url of each hyperlinked view
+    '''
+    def __init__(self, request):
+        self.request = request
+        self.url_templates = {}
+
+    def hyperlink(self, view_name, pk):
+        if view_name not in self.url_templates:
+            # Reversed the same way as HyperlinkedRelatedField, which keeps the format parameter of the request
+            url = reverse(view_name, args=('__pk__',), request=self.request)
+            prefix, _, suffix = url.partition('__pk__')
+            self.url_templates[view_name] = (prefix, suffix)
+        prefix, suffix = self.url_templates[view_name]
+        return f'{prefix}{pk}{suffix}'
+
+
+def _get_attribute(instance, source_attrs):
+    for attr in source_attrs:
+        if instance is None:
+            return None
+        instance = getattr(instance, attr)
+        if is_simple_callable(instance):
+            instance = instance()
+    return instance
+
+
+def _representation_change(serializer_class):
+    for cls in serializer_class.__mro__:
+        if cls in REPRESENTATION_CHANGES:
+            return REPRESENTATION_CHANGES[cls]
+        if 'to_representation' in cls.__dict__ and cls.__module__ == serializers.__name__:
+            raise UnsupportedSerializer(f'{serializer_class.__name__} changes its data in to_representation')
+    return None
+
+
+def _compile_field(field, fieldset, path):
+    source_attrs = field.source_attrs
+    if isinstance(field, drf_serializers.ListSerializer):
+        child_plan = get_plan(type(field.child), fieldset, path + (field.field_name,))
+
+        def get_value(instance, context):
+            related = _get_attribute(instance, source_attrs)
+            return [serialize(child_plan, child, context) for child in related.all()]
+    elif isinstance(field, drf_serializers.BaseSerializer):
+        child_plan = get_plan(type(field), fieldset, path + (field.field_name,))
+
+        def get_value(instance, context):
+            related = _get_attribute(instance, source_attrs)
+            return None if related is None else serialize(child_plan, related, context)
+    elif isinstance(field, drf_serializers.HyperlinkedRelatedField) and len(source_attrs) == 1:
+        def get_value(instance, context):
+            pk = instance.serializable_value(source_attrs[0])
+            return None if pk is None else context.hyperlink(field.view_name, pk)
+    elif isinstance(field, drf_serializers.PrimaryKeyRelatedField) and field.pk_field is None and len(source_attrs) == 1:
+        def get_value(instance, context):
+            return instance.serializable_value(source_attrs[0])
+    elif isinstance(field, drf_serializers.SlugRelatedField):
+        def get_value(instance, context):
+            related = _get_attribute(instance, source_attrs)
+            return None if related is None else getattr(related, field.slug_field)
+    elif type(field) in SIMPLE_FIELD_CONVERSIONS:
+        conversion = SIMPLE_FIELD_CONVERSIONS[type(field)]
+
+        def get_value(instance, context):
+            value = _get_attribute(instance, source_attrs)
+            return value if value is None or conversion is None else conversion(value)
+    else:
+        # Anything else still skips the serializer machinery, but converts its value with the field itself
+        def get_value(instance, context):
+            value = field.get_attribute(instance)
+            check_for_none = value.pk if isinstance(value, PKOnlyObject) else value
+            return None if check_for_none is None else field.to_representation(value)
+    return get_value
+
+
+def compile_plan(serializer_class, fieldset=None, path=()):
+    ''' Compiles a serializer class into a list of (field name, getter) for its readable fields, and the function
+        to apply any changes the serializer makes to its data. Only the fields included in the SparseFieldset are
+        compiled, with path being the field names of the nested serializer from the top level serializer.
+        Raises UnsupportedSerializer if the serializer cannot be reproduced.
+    '''
+    representation_change = _representation_change(serializer_class)
+    fields = [
+        (field.field_name, _compile_field(field, fieldset, path))
+        for field in serializer_class().fields.values()
+        if not field.write_only and (
+            fieldset is None or
+            fieldset.includes(path, field.field_name, isinstance(field, drf_serializers.BaseSerializer))
+        )
+    ]
+    return fields, representation_change
+
+
+def get_plan(serializer_class, fieldset=None, path=()):
+    # Plans for sparse fieldsets are compiled per request, since any number of them could be requested
+    if fieldset is not None:
+        return compile_plan(serializer_class, fieldset, path)
+    if serializer_class not in _plans:
+        _plans[serializer_class] = compile_plan(serializer_class)
+    return _plans[serializer_class]
+
+
+def is_supported(serializer_class):
+    try:
+        get_plan(serializer_class)
+    except UnsupportedSerializer:
+        return False
+    return True
+
+
+def serialize(plan, instance, context):
+    fields, representation_change = plan
+    data = {field_name: get_value(instance, context) for field_name, get_value in fields}
+    return representation_change(data) if representation_change else data
+
+
+class FastSerializer:
+    ''' Stands in for the serializer of a read-only request, producing the same data from a compiled plan
+    '''
+    def __init__(self, serializer_class, instance=None, many=False, context=None, **kwargs):
+        self.context = context or {}
+        fieldset = serializers.SparseFieldset.from_request(self.context.get('request'))
+        self.plan = get_plan(serializer_class, fieldset)
+        self.instance = instance
+        self.many = many
+
+    @property
+    def data(self):
+        context = SerializationContext(self.context.get('request'))
+        if self.many:
+            return [serialize(self.plan, instance, context) for instance in self.instance]
+        return serialize(self.plan, self.instance, context)
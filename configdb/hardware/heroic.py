@@ -1,14 +1,24 @@
+from datetime import timedelta
+from threading import local
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from urllib.parse import urljoin
 import requests
+import hashlib
+import json
 import logging
 
-from configdb.hardware.models import Instrument, Telescope, Site
+from configdb.hardware.models import Instrument, Telescope, Site, HeroicMessage, HeroicSyncState
 from configdb.hardware.apps import can_submit_to_heroic
+from configdb.hardware.capabilities import prefetch_capability_instruments
 
 
 logger = logging.getLogger()
 
+# Instruments whose capabilities changed in the current transaction, which are sent once each when it commits
+_queued_capabilities = local()
+
 
 def instrument_status_conversion(state: str):
     ''' Converts instrument state to HEROIC instrument status
@@ -70,11 +80,11 @@ def heroic_operation_modes(instrument: Instrument):
     '''
     operation_modes = {}
     for generic_mode_group in instrument.instrument_type.mode_types.all():
-        operation_modes[generic_mode_group.type.id] = {'options': []}
+        operation_modes[generic_mode_group.type_id] = {'options': []}
         if generic_mode_group.default:
-            operation_modes[generic_mode_group.type.id]['default'] = generic_mode_group.default.code
+            operation_modes[generic_mode_group.type_id]['default'] = generic_mode_group.default.code
         for mode in generic_mode_group.modes.all():
-            operation_modes[generic_mode_group.type.id]['options'].append({
+            operation_modes[generic_mode_group.type_id]['options'].append({
                 'id': mode.code,
                 'name': mode.name,
                 'schedulable': mode.schedulable
@@ -94,6 +104,16 @@ def instrument_to_heroic_instrument_capabilities(instrument: Instrument):
     return capabilities
 
 
+def build_heroic_instrument_capabilities(instruments):
+    ''' Builds the current instrument capabilities of each instrument in a queryset to send to HEROIC
+        Returns a list of (instrument, capabilities) tuples
+    '''
+    return [
+        (instrument, instrument_to_heroic_instrument_capabilities(instrument))
+        for instrument in prefetch_capability_instruments(instruments)
+    ]
+
+
 def telescope_to_heroic_telescope_properties(telescope: Telescope):
     ''' Extracts the current telescope properties of a telescope to send to HEROIC
     '''
@@ -111,59 +131,193 @@ def telescope_to_heroic_telescope_properties(telescope: Telescope):
     return telescope_payload
 
 
+def heroic_sync_key(api_endpoint: str, payload: dict):
+    ''' Identifies the object a HEROIC message is about by the kind of endpoint and the HEROIC id of the object,
+        which is either in the payload or the last part of the endpoint for updates
+    '''
+    kind, _, endpoint_id = api_endpoint.strip('/').partition('/')
+    return f"{kind}:{payload.get('instrument') or payload.get('id') or endpoint_id}"
+
+
+def heroic_payload_hash(payload: dict):
+    return hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def heroic_payload_changed(api_endpoint: str, payload: dict):
+    ''' Returns False if the payload is the same as the last one queued or delivered for the same object
+    '''
+    sync_key = heroic_sync_key(api_endpoint, payload)
+    last_message = HeroicMessage.objects.filter(
+        sync_key=sync_key, attempts__lt=settings.HEROIC_MAX_ATTEMPTS
+    ).order_by('-id').first()
+    if last_message:
+        last_hash = last_message.payload_hash
+    else:
+        last_hash = HeroicSyncState.objects.filter(sync_key=sync_key).values_list('payload_hash', flat=True).first()
+    return last_hash != heroic_payload_hash(payload)
+
+
 def send_to_heroic(api_endpoint: str, payload: dict, update: bool = False):
-    ''' Function to send data to HEROIC API endpoints
+    ''' Function to queue data to send to HEROIC API endpoints. The message is stored in the outbox as part of
+        the current transaction, and delivered later by the heroic_worker management command. Returns the message.
+    '''
+    return HeroicMessage.objects.create(
+        api_endpoint=api_endpoint, payload=payload, update=update,
+        sync_key=heroic_sync_key(api_endpoint, payload), payload_hash=heroic_payload_hash(payload)
+    )
+
+
+def post_to_heroic(api_endpoint: str, payload: dict, update: bool = False, session: requests.Session = None):
+    ''' Function to send data to HEROIC API endpoints, optionally reusing the connections of a session
     '''
+    http = session or requests
     headers = {'Authorization': f'Token {settings.HEROIC_API_TOKEN}'}
     url = urljoin(settings.HEROIC_API_URL, api_endpoint)
     if update:
-        response = requests.patch(url, headers=headers, json=payload)
+        response = http.patch(url, headers=headers, json=payload, timeout=settings.HEROIC_REQUEST_TIMEOUT)
     else:
-        response = requests.post(url, headers=headers, json=payload)
+        response = http.post(url, headers=headers, json=payload, timeout=settings.HEROIC_REQUEST_TIMEOUT)
     logger.warning(response.json())
     response.raise_for_status()
 
 
+def heroic_retry_delay(attempts: int):
+    ''' Exponential backoff for a message that has failed to be delivered the given number of times
+    '''
+    return timedelta(seconds=min(settings.HEROIC_RETRY_DELAY * 2 ** (attempts - 1), settings.HEROIC_MAX_RETRY_DELAY))
+
+
+def heroic_claim_duration():
+    ''' How long a worker has to deliver a message it claimed before other workers may try it, which covers
+        the connect and read timeouts of the request with room to record the result
+    '''
+    return timedelta(seconds=settings.HEROIC_REQUEST_TIMEOUT * 3)
+
+
+def claim_heroic_message():
+    ''' Claims the oldest message that has not failed too often, if it is due. The message is only locked while
+        it is claimed, by moving its next attempt past the time it takes to deliver it. Other workers then find the
+        oldest message is not due and wait rather than deliver later messages before it.
+    '''
+    with transaction.atomic():
+        message = HeroicMessage.objects.select_for_update().filter(attempts__lt=settings.HEROIC_MAX_ATTEMPTS).first()
+        if message is None or message.next_attempt > timezone.now():
+            return None
+        message.next_attempt = timezone.now() + heroic_claim_duration()
+        message.save(update_fields=['next_attempt'])
+    return message
+
+
+def deliver_heroic_messages(batch_size: int = 100):
+    ''' Deliver the queued HEROIC messages in the order they were queued, since later messages can depend on
+        objects created by earlier ones. Delivery stops at the first message that fails or is still waiting to be
+        retried. Messages that have failed HEROIC_MAX_ATTEMPTS times are skipped and left in the outbox.
+        Each message is claimed, sent outside of any transaction and its result committed before the next one, so
+        a worker that dies only sends the message it was delivering again. Returns the number of messages delivered.
+    '''
+    delivered = 0
+    for _ in range(batch_size):
+        message = claim_heroic_message()
+        if message is None:
+            break
+        try:
+            post_to_heroic(message.api_endpoint, message.payload, update=message.update)
+        except Exception as e:
+            message.attempts += 1
+            message.next_attempt = timezone.now() + heroic_retry_delay(message.attempts)
+            message.last_error = repr(e)
+            message.save(update_fields=['attempts', 'next_attempt', 'last_error'])
+            if message.attempts >= settings.HEROIC_MAX_ATTEMPTS:
+                logger.error(f'Giving up on heroic message {message.id} {str(message)}: {repr(e)}')
+            else:
+                logger.warning(f'Failed to deliver heroic message {message.id} {str(message)}, will retry: {repr(e)}')
+            break
+        with transaction.atomic():
+            HeroicSyncState.objects.update_or_create(
+                sync_key=message.sync_key, defaults={'payload_hash': message.payload_hash}
+            )
+            message.delete()
+        delivered += 1
+    return delivered
+
+
+def instrument_to_heroic_instrument(instrument: Instrument):
+    ''' Extracts the payload that creates an instrument in HEROIC
+    '''
+    instrument_payload = {
+        'id': heroic_instrument_id(instrument),
+        'name': f"{instrument.instrument_type.name} - {instrument.code}",
+        'telescope': heroic_telescope_id(instrument.telescope),
+        'available': True
+    }
+    return instrument_payload
+
 
 def create_heroic_instrument(instrument: Instrument):
     ''' Create a new instrument payload and send it to HEROIC
     '''
     if (instrument.telescope.enclosure.site.code not in settings.HEROIC_EXCLUDE_SITES and str(instrument.telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES):
-        instrument_payload = {
-            'id': heroic_instrument_id(instrument),
-            'name': f"{instrument.instrument_type.name} - {instrument.code}",
-            'telescope': heroic_telescope_id(instrument.telescope),
-            'available': True
-        }
         try:
-            send_to_heroic('instruments/', instrument_payload)
+            send_to_heroic('instruments/', instrument_to_heroic_instrument(instrument))
         except Exception as e:
             logger.error(f'Failed to create heroic instrument {str(instrument)}: {repr(e)}')
 
 
 def update_heroic_instrument_capabilities(instrument: Instrument):
-    ''' Send the current instrument capabilities of an instrument to HEROIC
-        if it is not DISABLED and heroic is set up in settings.py
+    ''' Queue the current instrument capabilities of an instrument for HEROIC once the current transaction commits,
+        if heroic is set up in settings.py. The instruments changed in a transaction are collected and their
+        capabilities built together when it commits, so an instrument changed through several of its components
+        is only built and queued once, with its final capabilities. Anything lost between the commit and the
+        queueing is sent by the sync_heroic command.
+    '''
+    if can_submit_to_heroic():
+        _queued_capabilities.instrument_ids = getattr(_queued_capabilities, 'instrument_ids', set()) | {instrument.id}
+        transaction.on_commit(send_queued_heroic_instrument_capabilities)
+
+
+def send_queued_heroic_instrument_capabilities():
+    ''' Builds and queues the capabilities of the instruments collected by update_heroic_instrument_capabilities,
+        with the same number of queries however many there are. Instruments left over from a transaction that was
+        rolled back are sent along with the next one, which is harmless since only changed capabilities are queued.
+    '''
+    instrument_ids = getattr(_queued_capabilities, 'instrument_ids', set())
+    _queued_capabilities.instrument_ids = set()
+    if instrument_ids:
+        instruments = Instrument.objects.filter(id__in=instrument_ids).order_by('id')
+        for instrument, capabilities in build_heroic_instrument_capabilities(instruments):
+            send_heroic_instrument_capabilities(instrument, capabilities)
+
+
+def send_heroic_instrument_capabilities(instrument: Instrument, capabilities: dict = None):
+    ''' Send the current instrument capabilities of an instrument to HEROIC if it is not DISABLED
+        and they have changed since they were last sent. Returns the queued message, if any.
     '''
-    if can_submit_to_heroic() and instrument.state != 'DISABLED' and instrument.telescope.enclosure.site.code not in settings.HEROIC_EXCLUDE_SITES and str(instrument.telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES:
-        capabilities = instrument_to_heroic_instrument_capabilities(instrument)
+    if instrument.state != 'DISABLED' and instrument.telescope.enclosure.site.code not in settings.HEROIC_EXCLUDE_SITES and str(instrument.telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES:
+        capabilities = capabilities or instrument_to_heroic_instrument_capabilities(instrument)
         try:
-            send_to_heroic('instrument-capabilities/', capabilities)
+            if heroic_payload_changed('instrument-capabilities/', capabilities):
+                return send_to_heroic('instrument-capabilities/', capabilities)
         except Exception as e:
             logger.error(f'Failed to create heroic instrument {str(instrument)} capability update: {repr(e)}')
 
 
+def telescope_to_heroic_telescope(telescope: Telescope):
+    ''' Extracts the payload that creates a telescope in HEROIC
+    '''
+    telescope_payload = telescope_to_heroic_telescope_properties(telescope)
+    telescope_payload['id'] = heroic_telescope_id(telescope)
+    telescope_payload['status'] = telescope_status_conversion(telescope)
+    if telescope_payload['status'] != 'SCHEDULABLE':
+        telescope_payload['reason'] = 'Telescope is currently marked as inactive to prevent usage'
+    return telescope_payload
+
+
 def create_heroic_telescope(telescope: Telescope):
     ''' Create a new telescope payload and send it to HEROIC
     '''
     if telescope.enclosure.site.code not in settings.HEROIC_EXCLUDE_SITES and str(telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES:
-        telescope_payload = telescope_to_heroic_telescope_properties(telescope)
-        telescope_payload['id'] = heroic_telescope_id(telescope)
-        telescope_payload['status'] = telescope_status_conversion(telescope)
-        if telescope_payload['status'] != 'SCHEDULABLE':
-            telescope_payload['reason'] = 'Telescope is currently marked as inactive to prevent usage'
         try:
-            send_to_heroic('telescopes/', telescope_payload)
+            send_to_heroic('telescopes/', telescope_to_heroic_telescope(telescope))
         except Exception as e:
             logger.error(f'Failed to create heroic telescope {str(telescope)}: {repr(e)}')
 
@@ -191,14 +345,20 @@ def site_to_heroic_site_properties(site: Site):
     return site_payload
 
 
+def site_to_heroic_site(site: Site):
+    ''' Extracts the payload that creates a site in HEROIC
+    '''
+    site_payload = site_to_heroic_site_properties(site)
+    site_payload['id'] = heroic_site_id(site)
+    return site_payload
+
+
 def create_heroic_site(site: Site):
     ''' Create a new site payload and send it to HEROIC
     '''
     if site.code not in settings.HEROIC_EXCLUDE_SITES:
-        site_payload = site_to_heroic_site_properties(site)
-        site_payload['id'] = heroic_site_id(site)
         try:
-            send_to_heroic('sites/', site_payload)
+            send_to_heroic('sites/', site_to_heroic_site(site))
         except Exception as e:
             logger.error(f'Failed to create heroic site {str(site)}: {repr(e)}')
 
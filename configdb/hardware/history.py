@@ -0,0 +1,210 @@
+''' Reconstruction of the hardware configuration as it was at a point in time from the reversion history.
+    The objects are rebuilt from the latest version of each object at that time and linked to each other through
+    Django's relation caches, so the serializers read the historic relations without querying the database.
+'''
+from collections import OrderedDict
+from threading import Lock
+
+from dateutil.parser import parse
+from django.db.models import Max
+from django.utils import timezone
+from reversion.models import Revision, Version
+
+from configdb.hardware.changes import format_cursor, get_hardware_content_types
+from configdb.hardware.models import DeletionRecord
+
+
+# Number of reconstructed configurations kept in memory, since repeated queries tend to ask for the same times
+HISTORY_CACHE_SIZE = 8
+
+_reconstructions = OrderedDict()
+_reconstructions_lock = Lock()
+
+
+def parse_as_of(value):
+    """ Parses an as_of timestamp, which is taken to be in UTC if it has no timezone. Raises a ValueError if it
+        cannot be parsed.
+    """
+    as_of = parse(value)
+    if as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    return as_of
+
+
+def get_cursor_as_of(as_of):
+    """ Cursor of the latest change made at or before a time. Every time between two changes has the same cursor,
+        so it identifies the configuration at that time.
+    """
+    revision_id = Revision.objects.filter(date_created__lte=as_of).aggregate(latest=Max('id'))['latest'] or 0
+    deletion_id = DeletionRecord.objects.filter(deleted__lte=as_of).aggregate(latest=Max('id'))['latest'] or 0
+    return format_cursor(revision_id, deletion_id)
+
+
+def _as_prefetched(model, instances):
+    # A queryset with its results already filled in is what prefetch_related stores for a relation
+    queryset = model._default_manager.all()
+    queryset._result_cache = sorted(instances, key=lambda instance: instance.pk)
+    queryset._prefetch_done = True
+    return queryset
+
+
+def _parent_fields(model, objects):
+    return [field for field in model._meta.get_fields()
+            if field.many_to_one and field.concrete and field.related_model in objects]
+
+
+def _add_unversioned_parents(objects, m2m_data):
+    """ Adds the current rows of the objects the historic ones point to but that have no version at the time,
+        which are those saved before their model was versioned. These are taken as they are now, since that is
+        the closest thing to their state at the time that is known.
+    """
+    while True:
+        missing = {}
+        for model, instances in objects.items():
+            for field in _parent_fields(model, objects):
+                for instance in instances.values():
+                    pk = getattr(instance, field.attname)
+                    if pk is not None and pk not in objects[field.related_model]:
+                        missing.setdefault(field.related_model, set()).add(pk)
+        found = False
+        for model, pks in missing.items():
+            many_to_many = [field for field in model._meta.many_to_many if field.related_model in objects]
+            for instance in model._default_manager.filter(pk__in=pks).prefetch_related(
+                *(field.name for field in many_to_many)
+            ):
+                m2m_data[(model, instance.pk)] = {
+                    field.attname: [related.pk for related in getattr(instance, field.name).all()]
+                    for field in many_to_many
+                }
+                instance._prefetched_objects_cache = {}
+                objects[model][instance.pk] = instance
+                found = True
+        if not found:
+            return
+
+
+def _drop_orphans(objects):
+    """ Leaves out the historic objects whose required parent did not exist at the time, nor exists now, since
+        they cannot be shown without it
+    """
+    while True:
+        orphans = []
+        for model, instances in objects.items():
+            for field in _parent_fields(model, objects):
+                if field.null:
+                    continue
+                orphans.extend(
+                    (model, pk) for pk, instance in instances.items()
+                    if getattr(instance, field.attname) not in objects[field.related_model]
+                )
+        if not orphans:
+            return
+        for model, pk in orphans:
+            objects[model].pop(pk, None)
+
+
+def _link(objects, m2m_data):
+    """ Fills the relation caches of the historic objects with each other, so reading a relation returns the
+        objects as they were rather than querying the current ones
+    """
+    for model, instances in objects.items():
+        for field in model._meta.get_fields():
+            related_objects = objects.get(field.related_model)
+            if related_objects is None:
+                continue
+            if field.many_to_one and field.concrete:
+                for instance in instances.values():
+                    field.set_cached_value(instance, related_objects.get(getattr(instance, field.attname)))
+            elif field.many_to_many and field.concrete and field.remote_field.through._meta.auto_created:
+                for instance in instances.values():
+                    related = [related_objects[pk] for pk in m2m_data[(model, instance.pk)].get(field.attname, [])
+                               if pk in related_objects]
+                    instance._prefetched_objects_cache[field.name] = _as_prefetched(field.related_model, related)
+            elif field.one_to_many:
+                children = {}
+                for child in related_objects.values():
+                    children.setdefault(getattr(child, field.field.attname), []).append(child)
+                for instance in instances.values():
+                    instance._prefetched_objects_cache[field.get_cache_name()] = _as_prefetched(
+                        field.related_model, children.get(instance.pk, [])
+                    )
+
+
+def reconstruct(cursor):
+    """ Rebuilds every hardware object as it was at a cursor from its latest version at that time, leaving out the
+        objects that were deleted by then. Objects that were never saved in a revision are only included, as they are
+        now, when a historic object points to them, and objects that were deleted before deletions were recorded are
+        left out at every time, since when they were deleted is not known. Returns a dict of model to a dict of primary key to the historic object.
+    """
+    revision_id, deletion_id = (int(part) for part in cursor.split('.'))
+    content_types = get_hardware_content_types()
+    deleted = set()
+    recorded = set()
+    for record_id, content_type_id, object_id in DeletionRecord.objects.filter(
+        content_type_id__in=content_types
+    ).values_list('id', 'content_type_id', 'object_id'):
+        recorded.add((content_type_id, object_id))
+        if record_id <= deletion_id:
+            deleted.add((content_type_id, object_id))
+    latest_version_ids = Version.objects.filter(
+        revision_id__lte=revision_id, content_type_id__in=content_types
+    ).values('content_type_id', 'object_id').annotate(latest=Max('id')).values('latest')
+    versions = [
+        version for version in Version.objects.filter(id__in=latest_version_ids)
+        if (version.content_type_id, version.object_id) not in deleted
+    ]
+    # Objects with neither a row nor a deletion record were deleted before deletions were recorded
+    unrecorded = {}
+    for version in versions:
+        if (version.content_type_id, version.object_id) not in recorded:
+            unrecorded.setdefault(version.content_type_id, set()).add(version.object_id)
+    existing = set()
+    for content_type_id, object_ids in unrecorded.items():
+        model = content_types[content_type_id]
+        existing.update(
+            (content_type_id, str(pk)) for pk in model._default_manager.filter(pk__in=object_ids).values_list('pk', flat=True)
+        )
+
+    objects = {model: {} for model in content_types.values()}
+    m2m_data = {}
+    for version in versions:
+        key = (version.content_type_id, version.object_id)
+        if key not in recorded and key not in existing:
+            continue
+        model = content_types[version.content_type_id]
+        field_dict = dict(version.field_dict)
+        many_to_many = {field.attname: field_dict.pop(field.attname, []) for field in model._meta.many_to_many}
+        instance = model(**field_dict)
+        instance._state.adding = False
+        instance._state.db = version.db
+        instance._prefetched_objects_cache = {}
+        objects[model][instance.pk] = instance
+        m2m_data[(model, instance.pk)] = many_to_many
+    _add_unversioned_parents(objects, m2m_data)
+    _drop_orphans(objects)
+    _link(objects, m2m_data)
+    return objects
+
+
+def get_objects_as_of(as_of):
+    """ Returns the hardware objects as they were at a time, by model and primary key. Reconstructions are kept by
+        the cursor of the time, so repeated queries for any time between the same two changes are answered from
+        memory.
+    """
+    cursor = get_cursor_as_of(as_of)
+    with _reconstructions_lock:
+        if cursor in _reconstructions:
+            _reconstructions.move_to_end(cursor)
+            return _reconstructions[cursor]
+    objects = reconstruct(cursor)
+    with _reconstructions_lock:
+        _reconstructions[cursor] = objects
+        while len(_reconstructions) > HISTORY_CACHE_SIZE:
+            _reconstructions.popitem(last=False)
+    return objects
+
+
+def get_historic_queryset(model, as_of):
+    """ The objects of a model as they were at a time, as a queryset with its results already filled in
+    """
+    return _as_prefetched(model, get_objects_as_of(as_of)[model].values())
@@ -0,0 +1,44 @@
+import sys
+
+import yaml
+from django.core.management.base import BaseCommand, CommandError
+
+from configdb.hardware.network import apply_network, Change, NetworkDocumentError
+
+
+class Command(BaseCommand):
+    help = 'Applies a yaml or json network document to the hardware configuration and prints the changes it made'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document',
+                            help='Path to the yaml or json network document, or - to read it from stdin')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the changes that would be made without making them')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also delete the objects that are neither in the document nor referred to by it')
+
+    def handle(self, *args, **options):
+        try:
+            if options['document'] == '-':
+                document = yaml.safe_load(sys.stdin)
+            else:
+                with open(options['document']) as document_file:
+                    # Json documents are valid yaml, so both are read the same way
+                    document = yaml.safe_load(document_file)
+        except (OSError, yaml.YAMLError) as e:
+            raise CommandError(f'Could not read the network document: {e}')
+        try:
+            plan = apply_network(document or {}, prune=options['prune'], dry_run=options['dry_run'])
+        except NetworkDocumentError as e:
+            raise CommandError('The network document cannot be applied:\n' + '\n'.join(e.errors))
+        for change in plan:
+            self.stdout.write(str(change))
+        counts = {action: sum(1 for change in plan if change.action == action)
+                  for action in (Change.CREATE, Change.UPDATE, Change.DELETE)}
+        summary = f'create {counts[Change.CREATE]}, update {counts[Change.UPDATE]} and delete {counts[Change.DELETE]} objects'
+        if options['dry_run']:
+            self.stdout.write(f'Dry run, would {summary}')
+        elif plan:
+            self.stdout.write(f'Applied the network document to {summary}')
+        else:
+            self.stdout.write('The configuration already matches the network document')
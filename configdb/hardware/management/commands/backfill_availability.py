@@ -0,0 +1,49 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from reversion.models import Version
+
+from configdb.hardware.models import Instrument, Telescope, AvailabilityInterval
+from configdb.hardware.availability import (
+    intervals_from_versions, is_instrument_version_available, is_telescope_version_available
+)
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized instrument and telescope availability intervals from the reversion history'
+
+    def build_intervals(self, model, available_function, owner_field):
+        """ Builds the availability intervals of every object of a model in one pass over its versions """
+        existing_ids = set(model.objects.values_list('id', flat=True))
+        intervals = []
+        object_versions = []
+        object_id = None
+        versions = Version.objects.get_for_model(model).order_by('object_id', 'pk').iterator()
+        for version in versions:
+            if version.object_id != object_id:
+                intervals.extend(self.object_intervals(object_id, object_versions, existing_ids, available_function, owner_field))
+                object_id = version.object_id
+                object_versions = []
+            object_versions.append(version)
+        intervals.extend(self.object_intervals(object_id, object_versions, existing_ids, available_function, owner_field))
+        return intervals
+
+    def object_intervals(self, object_id, versions, existing_ids, available_function, owner_field):
+        # Versions of deleted objects are skipped since there is nothing to attach their intervals to
+        if object_id is None or int(object_id) not in existing_ids:
+            return []
+        return [
+            AvailabilityInterval(start=start, end=end, **{owner_field: int(object_id)})
+            for start, end in intervals_from_versions(versions, available_function)
+        ]
+
+    def handle(self, *args, **options):
+        instrument_intervals = self.build_intervals(Instrument, is_instrument_version_available, 'instrument_id')
+        telescope_intervals = self.build_intervals(Telescope, is_telescope_version_available, 'telescope_id')
+        with transaction.atomic():
+            AvailabilityInterval.objects.all().delete()
+            AvailabilityInterval.objects.bulk_create(instrument_intervals + telescope_intervals)
+        logger.info(f'Created {len(instrument_intervals)} instrument and {len(telescope_intervals)} telescope availability intervals')
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from configdb.hardware.benchmark import (
+    DEFAULT_NETWORK_SIZE, generate_network, network_size_key, run_benchmarks, compare_to_baseline, load_baseline,
+    save_baseline, BASELINE_PATH
+)
+
+
+class Command(BaseCommand):
+    help = ('Measures the queries, time and memory used by each endpoint against a generated network in a test '
+            'database, and fails if any of them regressed beyond the stored baseline')
+
+    def add_arguments(self, parser):
+        for component, count in DEFAULT_NETWORK_SIZE.items():
+            parser.add_argument(f'--{component.replace("_", "-")}', type=int, default=count,
+                                help=f'Number of {component.replace("_", " ")} to generate at each level of the network')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times to request each endpoint')
+        parser.add_argument('--baseline', default=BASELINE_PATH, help='Path of the baseline file')
+        parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+        parser.add_argument('--time-tolerance', type=float, default=1.0,
+                            help='Fraction the wall time may grow over the baseline before it is a regression')
+        parser.add_argument('--time-slack', type=float, default=25,
+                            help='Milliseconds the wall time may grow over the baseline in addition to the tolerance')
+        parser.add_argument('--memory-tolerance', type=float, default=0.5,
+                            help='Fraction the peak memory may grow over the baseline before it is a regression')
+        parser.add_argument('--noinput', action='store_true', help='Destroy an existing test database without asking')
+
+    def handle(self, *args, **options):
+        network_size = {component: options[component] for component in DEFAULT_NETWORK_SIZE}
+        size_key = network_size_key(network_size)
+        database_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=options['noinput'])
+        try:
+            generate_network(network_size)
+            results = run_benchmarks(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write(f'{name:40} {result["queries"]:5} queries {result["time_ms"]:10.2f}ms {result["peak_memory_kb"]:10.1f}KB')
+
+        baseline = load_baseline(options['baseline'])
+        if options['update_baseline']:
+            baseline[size_key] = results
+            save_baseline(options['baseline'], baseline)
+            self.stdout.write(f'Updated the baseline for network size {size_key}')
+            return
+        if size_key not in baseline:
+            raise CommandError(f'There is no baseline for network size {size_key}, create one with --update-baseline')
+        regressions = compare_to_baseline(
+            results, baseline[size_key], options['time_tolerance'], options['memory_tolerance'], options['time_slack']
+        )
+        if regressions:
+            raise CommandError('Performance regressed against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(f'No regressions against the baseline for network size {size_key}')
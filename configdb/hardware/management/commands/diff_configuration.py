@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from configdb.hardware.diff import resolve_cursor, diff_configuration
+
+
+class Command(BaseCommand):
+    help = 'Prints the objects that were added, removed or changed between two points in the configuration history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from', required=True,
+                            help='Timestamp or changes cursor to diff from')
+        parser.add_argument('--to', dest='to', default=None,
+                            help='Timestamp or changes cursor to diff to. Defaults to the current configuration')
+
+    def handle(self, *args, **options):
+        try:
+            diff = diff_configuration(resolve_cursor(options['from']), resolve_cursor(options['to']))
+        except (ValueError, OverflowError) as e:
+            raise CommandError(f'Could not diff the configuration: {e}')
+        self.stdout.write(json.dumps(diff, indent=2, cls=DjangoJSONEncoder))
@@ -0,0 +1,28 @@
+import json
+
+import yaml
+from django.core.management.base import BaseCommand
+
+from configdb.hardware.network import export_network
+
+
+class Command(BaseCommand):
+    help = 'Prints the whole hardware configuration as a network document keyed by codes, to be applied with apply_network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('yaml', 'json'), default='yaml',
+                            help='Format of the network document. Defaults to yaml')
+        parser.add_argument('--output', default=None,
+                            help='File to write the network document to. Defaults to stdout')
+
+    def handle(self, *args, **options):
+        document = export_network()
+        if options['format'] == 'json':
+            content = json.dumps(document, indent=2) + '\n'
+        else:
+            content = yaml.safe_dump(document, sort_keys=False, default_flow_style=False)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(content)
+        else:
+            self.stdout.write(content, ending='')
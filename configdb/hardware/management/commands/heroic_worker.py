@@ -0,0 +1,30 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from configdb.hardware.apps import can_submit_to_heroic
+from configdb.hardware.heroic import deliver_heroic_messages
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Delivers the queued HEROIC updates from the outbox, retrying failed deliveries with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver the queued messages that are due and exit')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when there is nothing to deliver')
+        parser.add_argument('--batch-size', type=int, default=100, help='Maximum number of messages to deliver per transaction')
+
+    def handle(self, *args, **options):
+        if not can_submit_to_heroic():
+            raise CommandError('HEROIC_API_URL, HEROIC_API_TOKEN and HEROIC_OBSERVATORY must be set to deliver messages to HEROIC')
+        while True:
+            delivered = deliver_heroic_messages(options['batch_size'])
+            if delivered:
+                logger.info(f'Delivered {delivered} messages to heroic')
+            if delivered < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,108 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from requests.adapters import HTTPAdapter
+
+from configdb.hardware.apps import can_submit_to_heroic
+from configdb.hardware.models import Site, Telescope, Instrument, HeroicSyncState
+from configdb.hardware.heroic import (
+    heroic_site_id, heroic_telescope_id, site_to_heroic_site_properties, telescope_to_heroic_telescope_properties,
+    site_to_heroic_site, telescope_to_heroic_telescope, instrument_to_heroic_instrument,
+    build_heroic_instrument_capabilities, heroic_sync_key, heroic_payload_hash, post_to_heroic
+)
+
+logger = logging.getLogger()
+
+
+def heroic_object_missing(error: Exception, update: bool):
+    ''' Whether a request to HEROIC failed because the object it is about does not exist there. An update of a
+        missing object is not found, and a post naming a missing object as a related object is invalid.
+    '''
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and (
+        response.status_code == 404 or (not update and response.status_code == 400)
+    )
+
+
+class Command(BaseCommand):
+    help = ('Sends the sites, telescopes and instrument capabilities that differ from what was last sent to HEROIC, '
+            'creating any that are missing from HEROIC')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be sent without sending it')
+        parser.add_argument('--force', action='store_true', help='Send everything, even if it is unchanged since it was last sent')
+        parser.add_argument('--workers', type=int, default=8, help='Maximum number of concurrent requests to HEROIC')
+
+    def site_messages(self):
+        for site in Site.objects.exclude(code__in=settings.HEROIC_EXCLUDE_SITES):
+            yield f'sites/{heroic_site_id(site)}/', site_to_heroic_site_properties(site), True, ('sites/', site_to_heroic_site(site))
+
+    def telescope_messages(self):
+        telescopes = Telescope.objects.select_related('enclosure__site').exclude(
+            enclosure__site__code__in=settings.HEROIC_EXCLUDE_SITES
+        )
+        for telescope in telescopes:
+            if str(telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES:
+                yield (f'telescopes/{heroic_telescope_id(telescope)}/', telescope_to_heroic_telescope_properties(telescope), True,
+                       ('telescopes/', telescope_to_heroic_telescope(telescope)))
+
+    def instrument_messages(self):
+        instruments = Instrument.objects.exclude(state=Instrument.DISABLED).exclude(
+            telescope__enclosure__site__code__in=settings.HEROIC_EXCLUDE_SITES
+        )
+        for instrument, capabilities in build_heroic_instrument_capabilities(instruments):
+            if str(instrument.telescope) not in settings.HEROIC_EXCLUDE_TELESCOPES:
+                yield 'instrument-capabilities/', capabilities, False, ('instruments/', instrument_to_heroic_instrument(instrument))
+
+    def send(self, session, message):
+        api_endpoint, payload, update, (create_endpoint, create_payload) = message
+        try:
+            try:
+                post_to_heroic(api_endpoint, payload, update=update, session=session)
+            except Exception as e:
+                if not heroic_object_missing(e, update):
+                    raise
+                # The object was never created in HEROIC or was removed from it, so it is created from scratch. The
+                # sites and telescopes are created with their properties, but capabilities still have to be posted.
+                logger.warning(f'{heroic_sync_key(create_endpoint, create_payload)} is missing from heroic, creating it')
+                post_to_heroic(create_endpoint, create_payload, session=session)
+                if not update:
+                    post_to_heroic(api_endpoint, payload, session=session)
+            return True
+        except Exception as e:
+            logger.error(f'Failed to sync {api_endpoint} {heroic_sync_key(api_endpoint, payload)} to heroic: {repr(e)}')
+            return False
+
+    def handle(self, *args, **options):
+        if not can_submit_to_heroic():
+            raise CommandError('HEROIC_API_URL, HEROIC_API_TOKEN and HEROIC_OBSERVATORY must be set to sync with HEROIC')
+        sent_hashes = dict(HeroicSyncState.objects.values_list('sync_key', 'payload_hash'))
+        with requests.Session() as session:
+            session.mount(settings.HEROIC_API_URL, HTTPAdapter(pool_maxsize=options['workers']))
+            # Sites are sent before their telescopes, and telescopes before their instruments
+            for name, messages in (('sites', self.site_messages()), ('telescopes', self.telescope_messages()),
+                                   ('instruments', self.instrument_messages())):
+                changed = []
+                unchanged = 0
+                for api_endpoint, payload, update, create in messages:
+                    sync_key = heroic_sync_key(api_endpoint, payload)
+                    payload_hash = heroic_payload_hash(payload)
+                    if options['force'] or sent_hashes.get(sync_key) != payload_hash:
+                        changed.append((sync_key, payload_hash, (api_endpoint, payload, update, create)))
+                    else:
+                        unchanged += 1
+                if options['dry_run']:
+                    for sync_key, _, (api_endpoint, _, update, _) in changed:
+                        self.stdout.write(f'Would send {"PATCH" if update else "POST"} {api_endpoint} for {sync_key}')
+                    self.stdout.write(f'{name}: {len(changed)} to send, {unchanged} unchanged')
+                    continue
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    results = list(executor.map(lambda change: self.send(session, change[2]), changed))
+                # Database writes stay on this thread rather than in the workers
+                for (sync_key, payload_hash, _), sent in zip(changed, results):
+                    if sent:
+                        HeroicSyncState.objects.update_or_create(sync_key=sync_key, defaults={'payload_hash': payload_hash})
+                self.stdout.write(f'{name}: {results.count(True)} sent, {results.count(False)} failed, {unchanged} unchanged')
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0035_configurationtypeproperties_validation_schema'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigurationGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField(default=0, help_text='Current configuration generation number')),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now, help_text='Time the configuration generation last changed')),
+            ],
+        ),
+    ]
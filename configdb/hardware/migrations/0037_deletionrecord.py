@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('hardware', '0036_configurationgeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletionRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(help_text='Primary key of the deleted object', max_length=191)),
+                ('object_repr', models.TextField(help_text='String representation of the deleted object')),
+                ('deleted', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Time the object was deleted')),
+                ('content_type', models.ForeignKey(help_text='Content type of the deleted object', on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0037_deletionrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(help_text='Start of the interval')),
+                ('end', models.DateTimeField(blank=True, help_text='End of the interval, or empty if it is ongoing', null=True)),
+                ('instrument', models.ForeignKey(blank=True, help_text='Instrument that was SCHEDULABLE', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='availability_intervals', to='hardware.instrument')),
+                ('telescope', models.ForeignKey(blank=True, help_text='Telescope that was active', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='availability_intervals', to='hardware.telescope')),
+            ],
+            options={
+                'ordering': ['-start'],
+                'indexes': [models.Index(fields=['instrument', 'start'], name='hardware_av_instrum_f8c9a6_idx'), models.Index(fields=['telescope', 'start'], name='hardware_av_telesco_58fdb6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0038_availabilityinterval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeroicMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api_endpoint', models.CharField(help_text='HEROIC api endpoint relative to the HEROIC_API_URL', max_length=255)),
+                ('payload', models.JSONField(help_text='Payload to send to the endpoint')),
+                ('update', models.BooleanField(default=False, help_text='Send as a PATCH to update an existing object instead of a POST')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, help_text='Time the message was queued')),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Number of failed delivery attempts')),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Earliest time to try delivering the message')),
+                ('last_error', models.TextField(blank=True, default='', help_text='Error from the last failed delivery attempt')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
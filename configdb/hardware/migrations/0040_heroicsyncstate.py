@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0039_heroicmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heroicmessage',
+            name='payload_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the payload', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='heroicmessage',
+            name='sync_key',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Kind and HEROIC id of the object the message is about', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='HeroicSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sync_key', models.CharField(help_text='Kind and HEROIC id of the object', max_length=255, unique=True)),
+                ('payload_hash', models.CharField(help_text='Hash of the last payload delivered for the object', max_length=32)),
+                ('modified', models.DateTimeField(auto_now=True, help_text='Time the payload was delivered')),
+            ],
+        ),
+    ]
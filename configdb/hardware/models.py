@@ -1,6 +1,8 @@
 import datetime
 
 from django.db import models
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class BaseModel(models.Model):
@@ -402,3 +404,115 @@ class Instrument(BaseModel):
 
     def __str__(self):
         return '{0}.{1}'.format(self.telescope, self.code)
+
+
+class ConfigurationGeneration(models.Model):
+    """ Singleton counter that is incremented whenever any hardware model changes. Caches and conditional
+        responses of the configuration are keyed on the generation, so they are invalidated by any change.
+    """
+    generation = models.BigIntegerField(default=0, help_text='Current configuration generation number')
+    modified = models.DateTimeField(default=timezone.now, help_text='Time the configuration generation last changed')
+
+    def __str__(self):
+        return str(self.generation)
+
+    @classmethod
+    def current(cls):
+        generation, _ = cls.objects.get_or_create(pk=1)
+        return generation
+
+    @classmethod
+    def bump(cls):
+        # The update takes a row lock until the surrounding transaction commits, so the generation
+        # becomes visible to readers at the same time as the change that caused it
+        updated = cls.objects.filter(pk=1).update(generation=models.F('generation') + 1, modified=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'generation': 1})
+
+    @classmethod
+    def lock(cls):
+        # Takes the row lock that bump takes without changing the generation. Ids that are allocated while holding
+        # it increase in the order their transactions commit, which is what makes the changes cursor safe to use
+        if not cls.objects.filter(pk=1).update(generation=models.F('generation')):
+            cls.bump()
+
+
+class DeletionRecord(models.Model):
+    """ Record of a deleted hardware object. The reversion history only contains versions of saved
+        objects, so these records complete it with the time each object was removed.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, help_text='Content type of the deleted object')
+    object_id = models.CharField(max_length=191, help_text='Primary key of the deleted object')
+    object_repr = models.TextField(help_text='String representation of the deleted object')
+    deleted = models.DateTimeField(default=timezone.now, db_index=True, help_text='Time the object was deleted')
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.object_repr
+
+
+class AvailabilityInterval(models.Model):
+    """ Interval of time that an instrument was SCHEDULABLE or a telescope was active. These are materialized from
+        the reversion history as versions are saved, so availability queries do not have to replay the history.
+        An interval that is still ongoing has no end.
+    """
+    instrument = models.ForeignKey(Instrument, null=True, blank=True, on_delete=models.CASCADE,
+                                   related_name='availability_intervals', help_text='Instrument that was SCHEDULABLE')
+    telescope = models.ForeignKey(Telescope, null=True, blank=True, on_delete=models.CASCADE,
+                                  related_name='availability_intervals', help_text='Telescope that was active')
+    start = models.DateTimeField(help_text='Start of the interval')
+    end = models.DateTimeField(null=True, blank=True, help_text='End of the interval, or empty if it is ongoing')
+
+    class Meta:
+        ordering = ['-start']
+        indexes = [
+            models.Index(fields=['instrument', 'start']),
+            models.Index(fields=['telescope', 'start']),
+        ]
+
+    def __str__(self):
+        return f'{self.instrument or self.telescope}: {self.start} - {self.end}'
+
+
+class HeroicMessage(models.Model):
+    """ Outbox of requests to send to the HEROIC service. Messages are written in the same transaction as the
+        change that caused them and delivered in order by the heroic_worker management command.
+    """
+    api_endpoint = models.CharField(max_length=255, help_text='HEROIC api endpoint relative to the HEROIC_API_URL')
+    payload = models.JSONField(help_text='Payload to send to the endpoint')
+    update = models.BooleanField(default=False, help_text='Send as a PATCH to update an existing object instead of a POST')
+    created = models.DateTimeField(default=timezone.now, help_text='Time the message was queued')
+    attempts = models.PositiveIntegerField(default=0, help_text='Number of failed delivery attempts')
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True, help_text='Earliest time to try delivering the message')
+    last_error = models.TextField(blank=True, default='', help_text='Error from the last failed delivery attempt')
+    sync_key = models.CharField(max_length=255, blank=True, default='', db_index=True,
+                                help_text='Kind and HEROIC id of the object the message is about')
+    payload_hash = models.CharField(max_length=32, blank=True, default='', help_text='Hash of the payload')
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{"PATCH" if self.update else "POST"} {self.api_endpoint}'
+
+
+class HeroicSyncState(models.Model):
+    """ Hash of the last payload successfully delivered to HEROIC for an object, used to skip sending it again
+        when nothing has changed
+    """
+    sync_key = models.CharField(max_length=255, unique=True, help_text='Kind and HEROIC id of the object')
+    payload_hash = models.CharField(max_length=32, help_text='Hash of the last payload delivered for the object')
+    modified = models.DateTimeField(auto_now=True, help_text='Time the payload was delivered')
+
+    def __str__(self):
+        return self.sync_key
+
+
+# All models that make up the hardware configuration, in dependency order
+HARDWARE_MODELS = (
+    Site, Enclosure, Telescope, OpticalElement, OpticalElementGroup, CameraType, ConfigurationType,
+    InstrumentCategory, InstrumentType, ConfigurationTypeProperties, ModeType, GenericMode, GenericModeGroup,
+    Camera, Instrument
+)
@@ -0,0 +1,630 @@
+''' Bulk writes of the hardware configuration from network documents. A network document describes the hardware from
+    sites down to optical elements, with every object identified by its code and referring to other objects by their
+    codes. The document is compared against the database to plan the objects to create, update and delete, and the
+    plan is applied with bulk queries in a single transaction and reversion revision.
+
+    Objects can be defined in the top level list of their component, nested in the object they belong to, or inline
+    where they are referred to. Fields left out of a definition keep their current value, or their default for new
+    objects.
+'''
+import json
+
+import reversion
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+
+from configdb.hardware import heroic
+from configdb.hardware.apps import can_submit_to_heroic
+from configdb.hardware.models import (
+    Site, Enclosure, Telescope, Instrument, Camera, CameraType, GenericMode, GenericModeGroup, OpticalElement,
+    OpticalElementGroup, ModeType, InstrumentType, InstrumentCategory, ConfigurationType,
+    ConfigurationTypeProperties, ConfigurationGeneration
+)
+
+
+class NetworkDocumentError(ValueError):
+    """ Raised when a network document cannot be applied, with every problem that was found in it """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+
+class Component:
+    """ How the objects of a hardware model appear in a network document. Each object has a key made from its own
+        fields and the keys of the objects it belongs to, which is how it is matched to an object in the database.
+    """
+    def __init__(self, name, model, key, foreign_keys=None, many_to_many=None, children=None, default_by_code=None,
+                 implicit=False, immutable=False, select_related=()):
+        self.name = name
+        self.model = model
+        self.key = key
+        # Field name to the name of the component it refers to
+        self.foreign_keys = foreign_keys or {}
+        self.many_to_many = many_to_many or {}
+        # Name of a list of nested objects to their component name and the foreign key that refers back to this object
+        self.children = children or {}
+        # A foreign key given as the code of one of the objects in a many to many field, as (foreign key, field)
+        self.default_by_code = default_by_code
+        # Objects that only have a key are created when they are referred to without being defined. They are shared
+        # vocabulary rather than hardware, so they are never pruned.
+        self.implicit = implicit
+        # Objects that are identified by all of their fields, so they are never updated and are shared when equal
+        self.immutable = immutable
+        self.select_related = select_related
+        self.fields = [
+            field.name for field in model._meta.concrete_fields
+            if not field.is_relation and not isinstance(field, models.AutoField) and field.name != 'modified'
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+def _code_key(fields, references):
+    return fields['code']
+
+
+def _value_key(fields, references):
+    return json.dumps(fields, sort_keys=True)
+
+
+# Components in the order they are created, so objects are created after the objects they refer to
+COMPONENTS = [
+    Component('optical_elements', OpticalElement, _code_key),
+    Component('optical_element_groups', OpticalElementGroup, lambda fields, references: fields['name'],
+              foreign_keys={'default': 'optical_elements'}, many_to_many={'optical_elements': 'optical_elements'}),
+    Component('camera_types', CameraType, _code_key),
+    Component('cameras', Camera, _code_key, foreign_keys={'camera_type': 'camera_types'},
+              many_to_many={'optical_element_groups': 'optical_element_groups'}),
+    Component('instrument_categories', InstrumentCategory, _code_key, implicit=True),
+    Component('configuration_types', ConfigurationType, _code_key),
+    Component('mode_types', ModeType, lambda fields, references: fields['id'], implicit=True),
+    Component('instrument_types', InstrumentType, _code_key,
+              foreign_keys={'instrument_category': 'instrument_categories',
+                            'default_configuration_type': 'configuration_types'},
+              children={'configuration_types': ('configuration_type_properties', 'instrument_type'),
+                        'mode_types': ('generic_mode_groups', 'instrument_type')}),
+    Component('configuration_type_properties', ConfigurationTypeProperties,
+              lambda fields, references: f"{references['instrument_type']}-{references['configuration_type']}",
+              foreign_keys={'instrument_type': 'instrument_types', 'configuration_type': 'configuration_types'}),
+    Component('generic_modes', GenericMode, _value_key, immutable=True),
+    Component('generic_mode_groups', GenericModeGroup,
+              lambda fields, references: f"{references['instrument_type']}.{references['type']}",
+              foreign_keys={'instrument_type': 'instrument_types', 'type': 'mode_types', 'default': 'generic_modes'},
+              many_to_many={'modes': 'generic_modes'}, default_by_code=('default', 'modes')),
+    Component('sites', Site, _code_key, children={'enclosures': ('enclosures', 'site')}),
+    Component('enclosures', Enclosure, lambda fields, references: f"{references['site']}.{fields['code']}",
+              foreign_keys={'site': 'sites'}, children={'telescopes': ('telescopes', 'enclosure')},
+              select_related=('site',)),
+    Component('telescopes', Telescope, lambda fields, references: f"{references['enclosure']}.{fields['code']}",
+              foreign_keys={'enclosure': 'enclosures'}, children={'instruments': ('instruments', 'telescope')},
+              select_related=('enclosure__site',)),
+    Component('instruments', Instrument, lambda fields, references: f"{references['telescope']}.{fields['code']}",
+              foreign_keys={'telescope': 'telescopes', 'instrument_type': 'instrument_types',
+                            'autoguider_camera': 'cameras'},
+              many_to_many={'science_cameras': 'cameras'}, select_related=('telescope__enclosure__site', 'instrument_type')),
+]
+COMPONENTS_BY_NAME = {component.name: component for component in COMPONENTS}
+
+
+def _new_object(fields=None, references=None, many_to_many=None):
+    return {'fields': fields or {}, 'references': references or {}, 'many_to_many': many_to_many or {}}
+
+
+def _many_to_many_links(component, field_name):
+    """ Returns the through model of a many to many field and the names of its columns for the two sides """
+    field = component.model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    return through, source, target
+
+
+def load_network():
+    """ Loads every hardware object with one query per model and many to many field. Returns the state of the
+        network as component name to object key to object, the model instances by component name and key, and the
+        keys that identify more than one object by component name. Only the first of the objects sharing a key is
+        in the state, so they can be exported but not changed.
+    """
+    state = {}
+    instances = {}
+    ambiguous = {}
+    keys_by_id = {}
+    for component in COMPONENTS:
+        state[component.name] = {}
+        instances[component.name] = {}
+        ambiguous[component.name] = set()
+        keys_by_id[component.name] = {}
+        links = {}
+        for field_name, target in component.many_to_many.items():
+            through, source, target_column = _many_to_many_links(component, field_name)
+            for source_id, target_id in through.objects.values_list(source, target_column):
+                links.setdefault((field_name, source_id), set()).add(keys_by_id[target][target_id])
+        for instance in component.model.objects.select_related(*component.select_related).order_by('pk'):
+            fields = {name: getattr(instance, name) for name in component.fields}
+            references = {
+                name: keys_by_id[target].get(getattr(instance, component.model._meta.get_field(name).attname))
+                for name, target in component.foreign_keys.items()
+            }
+            key = component.key(fields, references)
+            keys_by_id[component.name][instance.pk] = key
+            if key in state[component.name]:
+                # Equal immutable objects are interchangeable, so the first one stands in for the others
+                if not component.immutable:
+                    ambiguous[component.name].add(key)
+                continue
+            state[component.name][key] = _new_object(fields, references, {
+                name: links.get((name, instance.pk), set()) for name in component.many_to_many
+            })
+            instances[component.name][key] = instance
+    return state, instances, ambiguous
+
+
+def _export_object(component, key, state, children, parent_field=None):
+    definition = state[component.name][key]
+    entry = {name: _plain(value) for name, value in definition['fields'].items()}
+    for name, reference in definition['references'].items():
+        if name == parent_field:
+            continue
+        if reference is not None and component.default_by_code and name == component.default_by_code[0]:
+            entry[name] = state[component.foreign_keys[name]][reference]['fields']['code']
+        else:
+            entry[name] = reference
+    for name, keys in definition['many_to_many'].items():
+        target = COMPONENTS_BY_NAME[component.many_to_many[name]]
+        if target.immutable:
+            # Value objects are written out in full where they are used, rather than referred to by their key
+            entry[name] = sorted(({name: _plain(value) for name, value in state[target.name][key]['fields'].items()}
+                                  for key in keys),
+                                 key=lambda fields: _value_key(fields, {}))
+        else:
+            entry[name] = sorted(keys)
+    for name, (child_name, child_parent_field) in component.children.items():
+        entry[name] = [
+            _export_object(COMPONENTS_BY_NAME[child_name], child_key, state, children, child_parent_field)
+            for child_key in children.get((child_name, key), [])
+        ]
+    return entry
+
+
+def export_network():
+    """ Builds the network document of the whole hardware configuration. The document is canonical: objects are
+        nested in the object they belong to and every list is sorted by key, so the same configuration always
+        exports to the same document and applying it back changes nothing. Objects that share a key, such as
+        optical element groups with the same name, are exported once.
+    """
+    state, _, _ = load_network()
+    children = {}
+    nested = set()
+    for component in COMPONENTS:
+        for child_name, parent_field in component.children.values():
+            nested.add(child_name)
+            for key, definition in sorted(state[child_name].items()):
+                children.setdefault((child_name, definition['references'][parent_field]), []).append(key)
+    used_modes = {key for group in state['generic_mode_groups'].values() for key in group['many_to_many']['modes']}
+    document = {}
+    for component in COMPONENTS:
+        if component.name in nested:
+            continue
+        keys = sorted(state[component.name])
+        if component.immutable:
+            keys = [key for key in keys if key not in used_modes]
+        document[component.name] = [_export_object(component, key, state, children) for key in keys]
+    return document
+
+
+class DocumentReader:
+    """ Reads a network document into the state of the network it describes, collecting every error in it
+    """
+    def __init__(self):
+        self.state = {component.name: {} for component in COMPONENTS}
+        self.errors = []
+
+    def read(self, document):
+        if not isinstance(document, dict):
+            self.errors.append('The network document must be an object of components')
+            return self.state
+        for name, entries in document.items():
+            if name not in COMPONENTS_BY_NAME:
+                self.errors.append(f'{name}: unknown component')
+            elif not isinstance(entries, list):
+                self.errors.append(f'{name}: must be a list')
+            else:
+                for index, entry in enumerate(entries):
+                    self.read_object(COMPONENTS_BY_NAME[name], entry, f'{name}[{index}]')
+        return self.state
+
+    def read_object(self, component, entry, path, parent=None):
+        """ Adds the definition of an object to the state and returns its key, or None if it is invalid
+        """
+        if not isinstance(entry, dict):
+            self.errors.append(f'{path}: must be an object')
+            return None
+        fields = {}
+        references = {}
+        many_to_many = {}
+        children = []
+        for name, value in entry.items():
+            if component.default_by_code and name == component.default_by_code[0]:
+                continue
+            if name in component.foreign_keys:
+                references[name] = self.read_reference(COMPONENTS_BY_NAME[component.foreign_keys[name]], value, f'{path}.{name}')
+            elif name in component.many_to_many:
+                if not isinstance(value, list):
+                    self.errors.append(f'{path}.{name}: must be a list')
+                    continue
+                target = COMPONENTS_BY_NAME[component.many_to_many[name]]
+                many_to_many[name] = {
+                    self.read_reference(target, item, f'{path}.{name}[{index}]') for index, item in enumerate(value)
+                } - {None}
+            elif name in component.children:
+                children.append((name, value))
+            elif name in component.fields:
+                try:
+                    fields[name] = None if value is None else component.model._meta.get_field(name).to_python(value)
+                except ValidationError as e:
+                    self.errors.append(f'{path}.{name}: {" ".join(e.messages)}')
+            else:
+                self.errors.append(f'{path}.{name}: unknown field')
+        if parent is not None:
+            references[parent[0]] = parent[1]
+        if component.default_by_code and component.default_by_code[0] in entry:
+            self.read_default_by_code(component, entry, path, references, many_to_many)
+        if component.immutable:
+            fields = {name: fields.get(name, component.model._meta.get_field(name).get_default())
+                      for name in component.fields}
+        try:
+            key = component.key(fields, references)
+        except KeyError as e:
+            self.errors.append(f'{path}: {e.args[0]} is required')
+            return None
+        self.add_object(component, key, _new_object(fields, references, many_to_many), path)
+        for name, entries in children:
+            child_component, parent_field = component.children[name]
+            if not isinstance(entries, list):
+                self.errors.append(f'{path}.{name}: must be a list')
+                continue
+            for index, child in enumerate(entries):
+                self.read_object(COMPONENTS_BY_NAME[child_component], child, f'{path}.{name}[{index}]',
+                                 parent=(parent_field, key))
+        return key
+
+    def read_default_by_code(self, component, entry, path, references, many_to_many):
+        field_name, many_to_many_name = component.default_by_code
+        code = entry[field_name]
+        target = COMPONENTS_BY_NAME[component.many_to_many[many_to_many_name]]
+        if code is None:
+            references[field_name] = None
+            return
+        matches = [key for key in many_to_many.get(many_to_many_name, ())
+                   if self.state[target.name][key]['fields'].get('code') == code]
+        if not matches:
+            self.errors.append(f'{path}.{field_name}: {code} must be the code of one of its {many_to_many_name}')
+        else:
+            references[field_name] = matches[0]
+
+    def read_reference(self, component, value, path):
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            return self.read_object(component, value, path)
+        if not isinstance(value, (str, int)):
+            self.errors.append(f'{path}: must be a code or an object')
+            return None
+        key = str(value)
+        if component.implicit and key not in self.state[component.name]:
+            pk_name = component.model._meta.pk.name
+            self.state[component.name][key] = _new_object({pk_name: key})
+        return key
+
+    def add_object(self, component, key, definition, path):
+        existing = self.state[component.name].get(key)
+        if existing is None:
+            self.state[component.name][key] = definition
+            return
+        # An object can be defined in more than one place as long as the definitions agree
+        for part in ('fields', 'references', 'many_to_many'):
+            for name, value in definition[part].items():
+                if name in existing[part] and existing[part][name] != value:
+                    self.errors.append(f'{path}.{name}: conflicts with another definition of {component} {key}')
+                existing[part][name] = value
+
+
+def read_document(document):
+    """ Reads a network document into the state of the network it describes. Raises a NetworkDocumentError if
+        the document is invalid.
+    """
+    reader = DocumentReader()
+    state = reader.read(document)
+    if reader.errors:
+        raise NetworkDocumentError(reader.errors)
+    return state
+
+
+class Change:
+    """ A change to one object in a plan, with the (current, new) values of the fields that change """
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    SYMBOLS = {CREATE: '+', UPDATE: '~', DELETE: '-'}
+
+    def __init__(self, action, component, key, changes=None):
+        self.action = action
+        self.component = component
+        self.key = key
+        self.changes = changes or {}
+
+    def as_dict(self):
+        return {
+            'action': self.action,
+            'component': self.component.name,
+            'key': self.key,
+            'changes': {
+                name: {'from': _plain(current), 'to': _plain(new)} for name, (current, new) in self.changes.items()
+            }
+        }
+
+    def __str__(self):
+        lines = [f'{self.SYMBOLS[self.action]} {self.component} {self.key}']
+        for name, (current, new) in self.changes.items():
+            if self.action == self.CREATE:
+                lines.append(f'    {name}: {_plain(new)}')
+            else:
+                lines.append(f'    {name}: {_plain(current)} -> {_plain(new)}')
+        return '\n'.join(lines)
+
+
+def _plain(value):
+    """ Makes a value of a change plain enough to be put in a json document """
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _validate(component, key, fields, errors, changed=None):
+    # Existing objects are only validated on the fields that change, so objects saved before a validator was added
+    # can still be updated
+    instance = component.model(**fields)
+    exclude = list(component.foreign_keys) + list(component.many_to_many) + [component.model._meta.pk.name]
+    if changed is not None:
+        exclude += [name for name in component.fields if name not in changed]
+    try:
+        instance.full_clean(exclude=exclude, validate_unique=False)
+    except ValidationError as e:
+        for name, messages in e.message_dict.items():
+            errors.append(f'{component} {key}.{name}: {" ".join(messages)}')
+
+
+def _kept_keys(desired, current):
+    """ The objects that are defined by the document, along with the objects they refer to directly or through
+        other objects that are not defined by it
+    """
+    kept = {name: set(objects) for name, objects in desired.items()}
+    pending = [(component, definition) for component in COMPONENTS for definition in desired[component.name].values()]
+    while pending:
+        component, definition = pending.pop()
+        references = [(component.foreign_keys[name], key) for name, key in definition['references'].items()]
+        references += [(component.many_to_many[name], key) for name, keys in definition['many_to_many'].items()
+                       for key in keys]
+        for target, key in references:
+            if key is not None and key not in kept[target]:
+                kept[target].add(key)
+                if key in current[target]:
+                    pending.append((COMPONENTS_BY_NAME[target], current[target][key]))
+    return kept
+
+
+def _ambiguous_errors(plan, desired, current, ambiguous):
+    """ Errors for the changes that involve a key which identifies more than one object in the database, since it
+        cannot tell which of them is meant
+    """
+    errors = []
+    for change in plan:
+        component = change.component
+        if change.key in ambiguous.get(component.name, ()):
+            errors.append(f'{component} {change.key}: more than one object in the database is identified by {change.key}')
+        if change.action == Change.DELETE:
+            # Deleting an object only removes its own links, so it does not matter which object those refer to
+            continue
+        existing = current[component.name].get(change.key, _new_object())
+        for part, targets in (('references', component.foreign_keys), ('many_to_many', component.many_to_many)):
+            for name, target in targets.items():
+                if name not in change.changes:
+                    continue
+                values = [existing[part].get(name), desired[component.name].get(change.key, _new_object())[part].get(name)]
+                keys = set()
+                for value in values:
+                    keys.update(value if isinstance(value, (set, frozenset)) else [value])
+                for key in sorted(keys & ambiguous.get(target, set())):
+                    errors.append(f'{component} {change.key}.{name}: more than one {target} in the database is '
+                                  f'identified by {key}')
+    return errors
+
+
+def plan_network(desired, current, prune=False, ambiguous=None):
+    """ Compares the desired state of the network against its current state and returns the list of changes to
+        make, in the order they are applied. Objects that are not in the desired state are only deleted when pruning,
+        and objects that are still referred to are never deleted. Raises a NetworkDocumentError if the desired
+        state cannot be applied, including when a change involves a key that identifies more than one object.
+    """
+    plan = []
+    errors = []
+    for component in COMPONENTS:
+        for key, definition in sorted(desired[component.name].items()):
+            for name, reference in definition['references'].items():
+                target = component.foreign_keys[name]
+                if reference is not None and reference not in desired[target] and reference not in current[target]:
+                    errors.append(f'{component} {key}.{name}: {reference} is not a known {target}')
+            for name, references in definition['many_to_many'].items():
+                target = component.many_to_many[name]
+                for reference in sorted(references - set(desired[target]) - set(current[target])):
+                    errors.append(f'{component} {key}.{name}: {reference} is not a known {target}')
+            existing = current[component.name].get(key)
+            if existing is None:
+                _validate(component, key, definition['fields'], errors)
+                changes = {name: (None, value) for part in ('fields', 'references', 'many_to_many')
+                           for name, value in definition[part].items()}
+                plan.append(Change(Change.CREATE, component, key, changes))
+                continue
+            changes = {}
+            for part in ('fields', 'references', 'many_to_many'):
+                for name, value in definition[part].items():
+                    if existing[part].get(name) != value:
+                        changes[name] = (existing[part].get(name), value)
+            if changes:
+                _validate(component, key, {**existing['fields'], **definition['fields']}, errors, changed=changes)
+                plan.append(Change(Change.UPDATE, component, key, changes))
+    if errors:
+        raise NetworkDocumentError(errors)
+    if prune:
+        kept = _kept_keys(desired, current)
+        for component in reversed(COMPONENTS):
+            if component.implicit:
+                continue
+            for key in sorted(set(current[component.name]) - kept[component.name]):
+                plan.append(Change(Change.DELETE, component, key))
+    errors = _ambiguous_errors(plan, desired, current, ambiguous or {})
+    if errors:
+        raise NetworkDocumentError(errors)
+    return plan
+
+
+def _affected_instruments(plan, state, instances):
+    """ Instruments whose HEROIC capabilities may have changed, from the changes to them or to anything they use
+    """
+    changed = {(change.component.name, change.key) for change in plan}
+    deleted = {change.key for change in plan if change.component.name == 'instruments' and change.action == Change.DELETE}
+    affected = []
+    for key, instrument in state['instruments'].items():
+        if key not in instances['instruments'] or key in deleted:
+            continue
+        used = {('instruments', key)}
+        instrument_type = instrument['references'].get('instrument_type')
+        used.add(('instrument_types', instrument_type))
+        for group_key, group in state['generic_mode_groups'].items():
+            if group['references'].get('instrument_type') == instrument_type:
+                used.add(('generic_mode_groups', group_key))
+                used.update(('generic_modes', mode) for mode in group['many_to_many'].get('modes', ()))
+        for camera_key in instrument['many_to_many'].get('science_cameras', ()):
+            used.add(('cameras', camera_key))
+            for group_key in state['cameras'].get(camera_key, _new_object())['many_to_many'].get('optical_element_groups', ()):
+                used.add(('optical_element_groups', group_key))
+                group = state['optical_element_groups'].get(group_key, _new_object())
+                used.update(('optical_elements', element) for element in group['many_to_many'].get('optical_elements', ()))
+        if used & changed:
+            affected.append(instances['instruments'][key])
+    return affected
+
+
+def _send_to_heroic(plan, state, instances):
+    if can_submit_to_heroic():
+        handlers = {
+            ('sites', Change.CREATE): heroic.create_heroic_site,
+            ('sites', Change.UPDATE): heroic.update_heroic_site,
+            ('telescopes', Change.CREATE): heroic.create_heroic_telescope,
+            ('telescopes', Change.UPDATE): heroic.update_heroic_telescope_properties,
+            ('instruments', Change.CREATE): heroic.create_heroic_instrument,
+        }
+        for change in plan:
+            handler = handlers.get((change.component.name, change.action))
+            if handler:
+                handler(instances[change.component.name][change.key])
+    # Capabilities are queued after every change is written, so each instrument is sent its final state once
+    for instrument in _affected_instruments(plan, state, instances):
+        heroic.update_heroic_instrument_capabilities(instrument)
+
+
+def _set_many_to_many(component, instance, name, keys, instances, existing_keys):
+    target = component.many_to_many[name]
+    through, source, target_column = _many_to_many_links(component, name)
+    added = keys - existing_keys
+    removed = existing_keys - keys
+    if removed:
+        through.objects.filter(**{source: instance.pk}).filter(**{
+            f'{target_column}__in': [instances[target][key].pk for key in removed]
+        }).delete()
+    return [through(**{source: instance.pk, target_column: instances[target][key].pk}) for key in added]
+
+
+def apply_plan(plan, desired, current, instances):
+    """ Applies a plan with bulk queries in a single transaction and reversion revision, and sends the changes to
+        HEROIC once for every changed site, telescope and instrument
+    """
+    if not plan:
+        return
+    with transaction.atomic(), reversion.create_revision():
+        reversion.set_comment('Applied a network document')
+        now = timezone.now()
+        revised = []
+        for component in COMPONENTS:
+            changes = [change for change in plan if change.component is component and change.action != Change.DELETE]
+            if not changes:
+                continue
+            created = []
+            updated = []
+            update_fields = set()
+            for change in changes:
+                definition = desired[component.name][change.key]
+                if change.action == Change.CREATE:
+                    instance = component.model(**definition['fields'])
+                    created.append(instance)
+                    instances[component.name][change.key] = instance
+                else:
+                    instance = instances[component.name][change.key]
+                    instance.modified = now
+                    updated.append(instance)
+                    update_fields.update(name for name in change.changes if name not in component.many_to_many)
+                for name, value in definition['fields'].items():
+                    setattr(instance, name, value)
+                for name, key in definition['references'].items():
+                    setattr(instance, name, None if key is None else instances[component.foreign_keys[name]][key])
+            component.model.objects.bulk_create(created)
+            if updated and update_fields:
+                # bulk_update does not set auto_now fields, so the modified time is set along with the changes
+                component.model.objects.bulk_update(updated, sorted(update_fields) + ['modified'])
+            links = {}
+            for change in changes:
+                instance = instances[component.name][change.key]
+                revised.append(instance)
+                for name, keys in desired[component.name][change.key]['many_to_many'].items():
+                    if name in change.changes:
+                        existing_keys = current[component.name].get(change.key, _new_object())['many_to_many'].get(name, set())
+                        links.setdefault(name, []).extend(
+                            _set_many_to_many(component, instance, name, keys, instances, existing_keys)
+                        )
+            for name, through_links in links.items():
+                _many_to_many_links(component, name)[0].objects.bulk_create(through_links)
+        # Deletions go through the queryset so the deletion signals still record each deleted object
+        for component in reversed(COMPONENTS):
+            keys = [change.key for change in plan if change.component is component and change.action == Change.DELETE]
+            if keys:
+                component.model.objects.filter(pk__in=[instances[component.name][key].pk for key in keys]).delete()
+        # Versions are serialized when they are added, so they are only added once every link has been written
+        for instance in revised:
+            reversion.add_to_revision(instance)
+        ConfigurationGeneration.bump()
+        state = {
+            component.name: {**current[component.name], **{
+                key: {part: {**current[component.name].get(key, _new_object())[part], **definition[part]}
+                      for part in ('fields', 'references', 'many_to_many')}
+                for key, definition in desired[component.name].items()
+            }}
+            for component in COMPONENTS
+        }
+        _send_to_heroic(plan, state, instances)
+
+
+def apply_network(document, prune=False, dry_run=False):
+    """ Reads a network document, plans the changes that make the database match it and applies them unless this
+        is a dry run. Returns the plan, and raises a NetworkDocumentError if the document cannot be applied.
+    """
+    desired = read_document(document)
+    with transaction.atomic():
+        current, instances, ambiguous = load_network()
+        plan = plan_network(desired, current, prune, ambiguous)
+        if not dry_run:
+            apply_plan(plan, desired, current, instances)
+    return plan
@@ -0,0 +1,142 @@
+''' Dark and restart windows of the sites of the network. The altitude of the sun is sampled at every site over a
+    range of dates together with NumPy, and the times it crosses the dark altitude are interpolated between samples.
+    The windows of each site are cached by the time the site was last modified, so they only change with the site.
+
+    The sun position is the low precision one of the Astronomical Almanac, good to about a hundredth of a degree,
+    which puts the crossings within a few seconds.
+'''
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+
+from configdb.hardware.models import Site
+from configdb.hardware.snapshot import SNAPSHOT_CACHE_TIMEOUT
+from configdb.hardware.visibility import greenwich_sidereal_time
+
+
+DEFAULT_SUN_ALTITUDE = -12.0
+
+# Length in seconds of the daily restart of a site, which starts at its restart time
+DEFAULT_RESTART_DURATION = 900
+
+# Seconds between samples of the altitude of the sun. The sun moves less than 2.5 degrees between samples, so it
+# cannot cross the dark altitude and back in between.
+SUN_SAMPLE_STEP = 600
+
+# Longest range of dates the windows are computed for at once
+MAX_WINDOW_DAYS = 366
+
+
+def sun_coordinates(times):
+    """ Right ascension and declination in degrees of the sun at an array of UTC datetime64 """
+    seconds = (np.asarray(times, dtype='datetime64[s]') - np.datetime64(0, 's')).astype(float)
+    days_since_j2000 = seconds / 86400.0 + 2440587.5 - 2451545.0
+    mean_longitude = 280.460 + 0.9856474 * days_since_j2000
+    mean_anomaly = np.radians(357.528 + 0.9856003 * days_since_j2000)
+    ecliptic_longitude = np.radians(mean_longitude + 1.915 * np.sin(mean_anomaly) + 0.020 * np.sin(2 * mean_anomaly))
+    obliquity = np.radians(23.439 - 0.0000004 * days_since_j2000)
+    ra = np.degrees(np.arctan2(np.cos(obliquity) * np.sin(ecliptic_longitude), np.cos(ecliptic_longitude)))
+    dec = np.degrees(np.arcsin(np.sin(obliquity) * np.sin(ecliptic_longitude)))
+    return np.mod(ra, 360.0), dec
+
+
+def sun_altitudes(times, lat, long):
+    """ Altitude in degrees of the sun at arrays of latitudes and longitudes in degrees and UTC datetime64. Returns an
+        array of shape (locations, times).
+    """
+    ra, dec = sun_coordinates(times)
+    hour_angle = np.radians(greenwich_sidereal_time(times)[None, :] + np.asarray(long, dtype=float)[:, None] - ra)
+    latitude = np.radians(np.asarray(lat, dtype=float))[:, None]
+    dec = np.radians(dec)
+    return np.degrees(np.arcsin(np.clip(
+        np.sin(dec) * np.sin(latitude) + np.cos(dec) * np.cos(latitude) * np.cos(hour_angle), -1.0, 1.0
+    )))
+
+
+def dark_intervals(altitude, seconds, threshold):
+    """ The intervals each location has the sun below the threshold, from its altitudes sampled at the given seconds.
+        Crossings are interpolated linearly between samples, and intervals are clipped to the samples. Returns an
+        array of (location, start, end) rows.
+    """
+    below = altitude < threshold
+    padded = np.zeros((below.shape[0], below.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = below
+    changes = np.diff(padded, axis=1)
+    locations, first = np.nonzero(changes == 1)
+    last = np.nonzero(changes == -1)[1] - 1
+    starts = seconds[first].copy()
+    ends = seconds[last].copy()
+    # The sun set between the sample before the first dark sample and it, and rose after the last dark sample
+    setting = first > 0
+    before = first[setting] - 1
+    fraction = ((altitude[locations[setting], before] - threshold)
+                / (altitude[locations[setting], before] - altitude[locations[setting], first[setting]]))
+    starts[setting] = seconds[before] + fraction * (seconds[first[setting]] - seconds[before])
+    rising = last < len(seconds) - 1
+    after = last[rising] + 1
+    fraction = ((threshold - altitude[locations[rising], last[rising]])
+                / (altitude[locations[rising], after] - altitude[locations[rising], last[rising]]))
+    ends[rising] = seconds[last[rising]] + fraction * (seconds[after] - seconds[last[rising]])
+    return np.column_stack((locations, starts, ends))
+
+
+def restart_intervals(restarts, start_seconds, end_seconds, duration):
+    """ The daily restart windows of locations from their restart times in seconds after midnight UTC, clipped to a
+        range of seconds. Returns an array of (location, start, end) rows.
+    """
+    # Starting the day before the range catches a restart that runs over midnight into it
+    days = np.arange(start_seconds - 86400, end_seconds, 86400, dtype=float)
+    starts = days[None, :] + np.asarray(restarts, dtype=float)[:, None]
+    ends = np.minimum(starts + duration, end_seconds)
+    starts = np.maximum(starts, start_seconds)
+    locations, day = np.nonzero(ends > starts)
+    return np.column_stack((locations, starts[locations, day], ends[locations, day]))
+
+
+def _to_lists(intervals, count):
+    lists = [[] for _ in range(count)]
+    if len(intervals):
+        labels = np.datetime_as_string(np.round(intervals[:, 1:]).astype('datetime64[s]'), unit='s', timezone='UTC')
+        for location, (start, end) in zip(intervals[:, 0].astype(int).tolist(), labels.tolist()):
+            lists[location].append([start, end])
+    return lists
+
+
+def compute_site_windows(sites, start, end, sun_altitude=DEFAULT_SUN_ALTITUDE, restart_duration=DEFAULT_RESTART_DURATION):
+    """ Computes the dark and restart windows of sites from the start of the start date to the end of the end date
+        in UTC, all in one pass. Dark windows are when the sun is below the sun altitude, and restart windows start
+        at the daily restart time of the site and last restart_duration seconds. Returns the windows by site code as
+        lists of start and end times.
+    """
+    start_seconds = float((np.datetime64(start, 's') - np.datetime64(0, 's')).astype(int))
+    end_seconds = float((np.datetime64(end + timedelta(days=1), 's') - np.datetime64(0, 's')).astype(int))
+    seconds = np.arange(start_seconds, end_seconds + 1, SUN_SAMPLE_STEP)
+    altitude = sun_altitudes(seconds.astype('datetime64[s]'), [site.lat for site in sites], [site.long for site in sites])
+    dark = _to_lists(dark_intervals(altitude, seconds, sun_altitude), len(sites))
+    restarts = [site.restart.hour * 3600 + site.restart.minute * 60 + site.restart.second for site in sites]
+    restart = _to_lists(restart_intervals(restarts, start_seconds, end_seconds, restart_duration), len(sites))
+    return {site.code: {'dark': dark[index], 'restart': restart[index]} for index, site in enumerate(sites)}
+
+
+def get_site_windows(start, end, sun_altitude=DEFAULT_SUN_ALTITUDE, restart_duration=DEFAULT_RESTART_DURATION,
+                     site_codes=None):
+    """ Returns the dark and restart windows of the active sites, or the sites with the given codes, over a range of
+        dates. The windows of each site are cached by when the site was last modified and the parameters, and the
+        sites that are not cached are computed together.
+    """
+    sites = Site.objects.filter(active=True)
+    if site_codes:
+        sites = sites.filter(code__in=site_codes)
+    sites = list(sites)
+    cache_keys = {
+        site.code: f'site_windows:{site.pk}:{site.modified.isoformat()}:{start}:{end}:{sun_altitude}:{restart_duration}'
+        for site in sites
+    }
+    cached = cache.get_many(cache_keys.values())
+    missing = [site for site in sites if cache_keys[site.code] not in cached]
+    if missing:
+        computed = compute_site_windows(missing, start, end, sun_altitude, restart_duration)
+        cache.set_many({cache_keys[code]: windows for code, windows in computed.items()}, SNAPSHOT_CACHE_TIMEOUT)
+        cached.update({cache_keys[code]: windows for code, windows in computed.items()})
+    return {code: cached[cache_key] for code, cache_key in cache_keys.items()}
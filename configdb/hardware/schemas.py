@@ -0,0 +1,217 @@
+''' Effective validation schemas of instrument configs. The rules for an instrument config are spread across the
+    validation schemas of its instrument type, the properties of its configuration type on that instrument type and
+    its generic modes. They are merged in that order, with later schemas adding to and overriding the rules of
+    earlier ones.
+'''
+import hashlib
+from itertools import product
+
+from cerberus.schema import SchemaError
+from django.db.models import Prefetch
+
+from configdb.hardware.models import InstrumentType, GenericModeGroup
+from configdb.hardware.snapshot import get_by_generation
+from configdb.hardware.validator import validator_registry
+
+
+# Mode types whose generic mode schemas apply to the instrument config, the others apply to the acquisition and
+# guiding configs of an observation
+INSTRUMENT_CONFIG_MODE_TYPES = ('readout', 'exposure', 'rotator')
+
+
+class SchemaCombinationError(ValueError):
+    """ Raised when a combination of instrument type, configuration type and modes does not exist, with the errors
+        by field like a validation error
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(str(errors))
+
+
+def merge_schemas(*schemas):
+    """ Deep merges cerberus schemas. Rules that are both dicts, such as the schema of a nested dict, are merged and
+        any other rule is replaced by the later schema.
+    """
+    merged = {}
+    for schema in schemas:
+        for field, rules in (schema or {}).items():
+            if isinstance(rules, dict) and isinstance(merged.get(field), dict):
+                merged[field] = merge_schemas(merged[field], rules)
+            else:
+                merged[field] = rules
+    return merged
+
+
+def load_instrument_types(codes):
+    """ Loads the instrument types with the given codes along with everything that contributes to their schemas,
+        with a fixed number of queries. Returns the instrument types by code.
+    """
+    instrument_types = InstrumentType.objects.filter(code__in=set(codes)).prefetch_related(
+        'configurationtypeproperties_set',
+        Prefetch('mode_types', queryset=GenericModeGroup.objects.prefetch_related('modes')),
+    )
+    return {instrument_type.code: instrument_type for instrument_type in instrument_types}
+
+
+def get_schema_sources(instrument_type, configuration_type=None, modes=None):
+    """ Returns the objects whose validation schemas make up the schema of an instrument config, in the order they
+        are merged. The instrument type must have been loaded with load_instrument_types. Modes are given as mode
+        type to mode code. Raises a SchemaCombinationError if the configuration type or a mode does not belong to the
+        instrument type.
+    """
+    errors = {}
+    sources = [instrument_type]
+    if configuration_type:
+        properties = next((properties for properties in instrument_type.configurationtypeproperties_set.all()
+                           if properties.configuration_type_id == configuration_type), None)
+        if properties is None:
+            errors['configuration_type'] = [
+                f'Configuration type {configuration_type} is not available on instrument type {instrument_type.code}'
+            ]
+        else:
+            sources.append(properties)
+    groups = {group.type_id: group for group in instrument_type.mode_types.all()}
+    for mode_type, mode_code in sorted((modes or {}).items()):
+        if mode_type not in INSTRUMENT_CONFIG_MODE_TYPES:
+            errors.setdefault('modes', []).append(f'{mode_type} modes do not apply to instrument configs')
+            continue
+        mode = next((mode for mode in groups[mode_type].modes.all() if mode.code == mode_code), None) \
+            if mode_type in groups else None
+        if mode is None:
+            errors.setdefault('modes', []).append(
+                f'{mode_type} mode {mode_code} is not available on instrument type {instrument_type.code}'
+            )
+        else:
+            sources.append(mode)
+    if errors:
+        raise SchemaCombinationError(errors)
+    return sources
+
+
+def build_schema(sources):
+    return merge_schemas(*(source.validation_schema for source in sources))
+
+
+def get_schema_version(sources):
+    """ A digest of the objects that contribute to a schema and the time each last changed. It changes whenever
+        one of them is changed or the set of them does, so it is used as the cache key and etag of the schema.
+    """
+    representation = ';'.join(f'{source._meta.label}:{source.pk}:{source.modified.isoformat()}' for source in sources)
+    return hashlib.md5(representation.encode()).hexdigest()
+
+
+def get_merged_schema(sources):
+    """ Returns the merged schema of the sources, merging and caching it if it is not cached yet. Like the
+        snapshots, merged schemas are addressed by version so they never go stale.
+    """
+    return get_by_generation('merged_schema', get_schema_version(sources), lambda: build_schema(sources))
+
+
+def _instrument_config_mode_groups(instrument_type):
+    return sorted((group for group in instrument_type.mode_types.all() if group.type_id in INSTRUMENT_CONFIG_MODE_TYPES),
+                  key=lambda group: group.type_id)
+
+
+def get_all_schema_sources(instrument_type):
+    """ Every object that contributes to any schema of an instrument type """
+    sources = [instrument_type]
+    sources.extend(sorted(instrument_type.configurationtypeproperties_set.all(), key=lambda properties: properties.pk))
+    for group in _instrument_config_mode_groups(instrument_type):
+        sources.extend(sorted(group.modes.all(), key=lambda mode: mode.pk))
+    return sources
+
+
+def get_schema_combinations(instrument_type):
+    """ The valid combinations of an instrument type: each of its configuration types with one mode of each of its
+        mode groups that apply to instrument configs. Returns (configuration type, modes) pairs.
+    """
+    configuration_types = sorted(properties.configuration_type_id
+                                 for properties in instrument_type.configurationtypeproperties_set.all())
+    groups = _instrument_config_mode_groups(instrument_type)
+    mode_choices = product(*[sorted(mode.code for mode in group.modes.all()) for group in groups])
+    modes = [{group.type_id: code for group, code in zip(groups, codes)} for codes in mode_choices]
+    return [(configuration_type, combination_modes)
+            for configuration_type in configuration_types for combination_modes in modes]
+
+
+def get_instrument_type_schemas(instrument_type):
+    """ Returns the merged schema of every valid combination of an instrument type, all built together and cached
+        until any object that contributes to them changes. The instrument type must have been loaded with
+        load_instrument_types.
+    """
+    def build_schemas():
+        return [
+            {
+                'configuration_type': configuration_type,
+                'modes': modes,
+                'schema': get_merged_schema(get_schema_sources(instrument_type, configuration_type, modes))
+            }
+            for configuration_type, modes in get_schema_combinations(instrument_type)
+        ]
+    return get_by_generation(
+        'instrument_type_schemas', get_schema_version(get_all_schema_sources(instrument_type)), build_schemas
+    )
+
+
+def _combination(item):
+    """ Reads the combination an item of a validation batch is validated against, as a hashable key """
+    if not isinstance(item, dict):
+        raise SchemaCombinationError({'non_field_errors': ['Each item must be an object']})
+    errors = {}
+    if not isinstance(item.get('instrument_type'), str):
+        errors['instrument_type'] = ['An instrument type code is required']
+    if not isinstance(item.get('configuration_type') or '', str):
+        errors['configuration_type'] = ['The configuration type must be a code']
+    modes = item.get('modes') or {}
+    if not isinstance(modes, dict) or not all(isinstance(code, str) for code in modes.values()):
+        errors['modes'] = ['The modes must be an object of mode type to mode code']
+    if not isinstance(item.get('instrument_config'), dict):
+        errors['instrument_config'] = ['An instrument config object is required']
+    if errors:
+        raise SchemaCombinationError(errors)
+    return item['instrument_type'], item.get('configuration_type') or None, tuple(sorted(modes.items()))
+
+
+def _combination_validator(instrument_types, combination):
+    instrument_type_code, configuration_type, modes = combination
+    if instrument_type_code not in instrument_types:
+        raise SchemaCombinationError({'instrument_type': [f'Unknown instrument type {instrument_type_code}']})
+    sources = get_schema_sources(instrument_types[instrument_type_code], configuration_type, dict(modes))
+    try:
+        # The stored schemas only add rules to the fields of an instrument config, so the fields they do not cover,
+        # like its mode and optical elements, are allowed
+        return validator_registry.for_schema(get_merged_schema(sources), allow_unknown=True)
+    except SchemaError as e:
+        raise SchemaCombinationError({'non_field_errors': [f'The merged validation schema is invalid: {e}']})
+
+
+def validate_instrument_configs(items):
+    """ Validates a batch of instrument configs, each given with the instrument type, configuration type and modes
+        it is for. The schemas are loaded with a fixed number of queries, merged once per distinct combination and
+        validated with the compiled validators of the registry. Returns a result per item with whether it is valid,
+        its errors and the instrument config normalized by the schema.
+    """
+    combinations = []
+    for item in items:
+        try:
+            combinations.append(_combination(item))
+        except SchemaCombinationError as e:
+            combinations.append(e)
+    instrument_types = load_instrument_types(
+        combination[0] for combination in combinations if not isinstance(combination, SchemaCombinationError)
+    )
+    validators = {}
+    results = []
+    for item, combination in zip(items, combinations):
+        if not isinstance(combination, SchemaCombinationError) and combination not in validators:
+            try:
+                validators[combination] = _combination_validator(instrument_types, combination)
+            except SchemaCombinationError as e:
+                validators[combination] = e
+        validator = validators.get(combination, combination)
+        if isinstance(validator, SchemaCombinationError):
+            results.append({'valid': False, 'errors': validator.errors})
+            continue
+        valid, errors, document = validator.validate(item['instrument_config'])
+        results.append({'valid': valid, 'errors': errors, 'instrument_config': document if valid else None})
+    return results
@@ -1,15 +1,169 @@
+import json
+
+import reversion
+from django.db.models import Q
+from django.utils import timezone
 from rest_framework import serializers
 
 from .models import (
     Site, Enclosure, Telescope, OpticalElement, GenericMode, Instrument, Camera, OpticalElementGroup,
     CameraType, GenericModeGroup, InstrumentType, ConfigurationTypeProperties, ConfigurationType, ModeType,
-    InstrumentCategory
+    InstrumentCategory, ConfigurationGeneration
 )
-from configdb.hardware.validator import OCSValidator
+from configdb.hardware.validator import check_schema
 from configdb.hardware.heroic import update_heroic_instrument_capabilities
 
 
-class OpticalElementSerializer(serializers.ModelSerializer):
+class SparseFieldset:
+    """ Fields requested by a read request with the fields, exclude and depth parameters. Fields are comma
+        separated paths through the nested serializers, such as fields=code,instrument_type.code, and depth is the
+        number of levels of nested serializers to include.
+    """
+    def __init__(self, fields=(), exclude=(), depth=None):
+        self.fields = frozenset(fields)
+        self.exclude = frozenset(exclude)
+        self.depth = depth
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None
+        fields = [field for field in request.query_params.get('fields', '').split(',') if field]
+        exclude = [field for field in request.query_params.get('exclude', '').split(',') if field]
+        depth = request.query_params.get('depth')
+        if depth is not None:
+            if not depth.isdigit():
+                raise serializers.ValidationError({'depth': ['The depth parameter must be a non-negative integer']})
+            depth = int(depth)
+        if not fields and not exclude and depth is None:
+            return None
+        return cls(fields, exclude, depth)
+
+    def __eq__(self, other):
+        return isinstance(other, SparseFieldset) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return self.fields, self.exclude, self.depth
+
+    def includes(self, path, field_name, nested):
+        """ Whether a field of the serializer at the path of field names from the top level serializer is included
+        """
+        field_path = '.'.join(path + (field_name,))
+        if field_path in self.exclude:
+            return False
+        if nested and self.depth is not None and len(path) >= self.depth:
+            return False
+        if not self.fields:
+            return True
+        if any(field == field_path or field.startswith(field_path + '.') for field in self.fields):
+            return True
+        # All the fields of a nested serializer that was requested as a whole are included
+        return any('.'.join(path[:index]) in self.fields for index in range(1, len(path) + 1))
+
+    def prune_lookup(self, serializer_class, lookup):
+        """ Shortens a prefetch_related lookup of a serializer's queryset to the nested serializers that are included.
+            Relations that are not serialized by a nested serializer are kept, since the serializer may still need them.
+        """
+        relations = lookup.split('__')
+        path = ()
+        serializer = serializer_class()
+        for index, relation in enumerate(relations):
+            nested_fields = [
+                field for field in serializer.fields.values()
+                if isinstance(field, serializers.BaseSerializer) and field.source == relation
+            ]
+            if not nested_fields:
+                return lookup
+            if not any(self.includes(path, field.field_name, nested=True) for field in nested_fields):
+                return '__'.join(relations[:index])
+            path += (nested_fields[0].field_name,)
+            serializer = getattr(nested_fields[0], 'child', nested_fields[0])
+        return lookup
+
+
+class SparseFieldsMixin:
+    """ Serializers with this mixin leave out the fields that were not requested by a read request
+    """
+    def get_field_path(self):
+        path = []
+        serializer = self
+        while serializer.parent is not None:
+            if serializer.field_name:
+                path.append(serializer.field_name)
+            serializer = serializer.parent
+        return tuple(reversed(path))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = SparseFieldset.from_request(self.context.get('request'))
+        if fieldset is None:
+            return fields
+        path = self.get_field_path()
+        return {
+            field_name: field for field_name, field in fields.items()
+            if fieldset.includes(path, field_name, isinstance(field, serializers.BaseSerializer))
+        }
+
+
+def bulk_save(model, created=(), updated=(), update_fields=()):
+    """ Creates and updates objects with one query each. The bulk queries skip the save signals, so the objects are
+        added to the current revision and the configuration generation is bumped here as a save would.
+    """
+    created = model.objects.bulk_create(created)
+    if updated:
+        # bulk_update does not set auto_now fields, so the modified time is set along with the changes
+        for instance in updated:
+            instance.modified = timezone.now()
+        model.objects.bulk_update(updated, [*update_fields, 'modified'])
+    if reversion.is_active():
+        for instance in [*created, *updated]:
+            reversion.add_to_revision(instance)
+    if created or updated:
+        ConfigurationGeneration.bump()
+    return created
+
+
+def resolve_optical_elements(optical_elements):
+    """ Returns the optical elements with the codes of the nested optical elements, creating the missing ones from
+        their data. Existing optical elements are found with one query and the missing ones created with another.
+    """
+    codes = [optical_element['code'] for optical_element in optical_elements]
+    instances = {optical_element.code: optical_element for optical_element in OpticalElement.objects.filter(code__in=codes)}
+    missing = {}
+    for optical_element in optical_elements:
+        if optical_element['code'] not in instances:
+            missing.setdefault(optical_element['code'], OpticalElement(**optical_element))
+    bulk_save(OpticalElement, created=list(missing.values()))
+    instances.update(missing)
+    return [instances[code] for code in codes]
+
+
+def resolve_generic_modes(generic_modes):
+    """ Returns the generic modes matching all of the given fields of each nested generic mode, creating the missing
+        ones. Existing generic modes are found with one query and the missing ones created with another.
+    """
+    if not generic_modes:
+        return []
+    matching = Q()
+    for generic_mode in generic_modes:
+        matching |= Q(**generic_mode)
+    candidates = list(GenericMode.objects.filter(matching).order_by('pk'))
+    instances = []
+    missing = {}
+    for generic_mode in generic_modes:
+        instance = next((candidate for candidate in candidates
+                         if all(getattr(candidate, field) == value for field, value in generic_mode.items())), None)
+        if instance is None:
+            instance = missing.setdefault(json.dumps(generic_mode, sort_keys=True, default=str), GenericMode(**generic_mode))
+        instances.append(instance)
+    bulk_save(GenericMode, created=list(missing.values()))
+    return instances
+
+
+class OpticalElementSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = OpticalElement
@@ -38,7 +192,7 @@ class OpticalElementNestedSerializer(OpticalElementSerializer):
         }
 
 
-class OpticalElementGroupSerializer(serializers.ModelSerializer):
+class OpticalElementGroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     optical_elements = OpticalElementNestedSerializer(
         many=True, required=False,
         help_text='Optical elements belonging to this optical element group'
@@ -56,7 +210,7 @@ class OpticalElementGroupSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if data.get('default', None) is None:
+        if 'default' in data and data['default'] is None:
             data['default'] = ''
         return data
 
@@ -78,14 +232,7 @@ class OpticalElementGroupSerializer(serializers.ModelSerializer):
         optical_elements = validated_data.pop('optical_elements', [])
         optical_element_instances = validated_data.pop('optical_element_ids', [])
         optical_element_group = super().create(validated_data)
-
-        for optical_element_instance in optical_element_instances:
-            optical_element_group.optical_elements.add(optical_element_instance)
-
-        for optical_element in optical_elements:
-            optical_element_instance, _ = OpticalElement.objects.get_or_create(code=optical_element.pop('code'), defaults=optical_element)
-            optical_element_group.optical_elements.add(optical_element_instance)
-
+        optical_element_group.optical_elements.add(*optical_element_instances, *resolve_optical_elements(optical_elements))
         return optical_element_group
 
     def update(self, instance, validated_data):
@@ -93,13 +240,8 @@ class OpticalElementGroupSerializer(serializers.ModelSerializer):
         optical_element_instances = validated_data.pop('optical_element_ids', [])
         instance = super().update(instance, validated_data)
         if (optical_elements or optical_element_instances):
-            instance.optical_elements.clear()  # If we are updating optical elements, clear out old optical elements first
-        for optical_element_instance in optical_element_instances:
-            instance.optical_elements.add(optical_element_instance)
-
-        for optical_element in optical_elements:
-            optical_element_instance, _ = OpticalElement.objects.get_or_create(code=optical_element.pop('code'), defaults=optical_element)
-            instance.optical_elements.add(optical_element_instance)
+            # If we are updating optical elements, set only inserts and deletes the memberships that changed
+            instance.optical_elements.set([*optical_element_instances, *resolve_optical_elements(optical_elements)])
         # Update done so update HEROIC here - this catches optical elements changes in the optical elements group
         if optical_elements or optical_element_instances or 'default' in validated_data or 'type' in validated_data:
             for camera in instance.camera_set.all():
@@ -108,19 +250,19 @@ class OpticalElementGroupSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ModeTypeSerializer(serializers.ModelSerializer):
+class ModeTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('id',)
         model = ModeType
 
 
-class InstrumentCategorySerializer(serializers.ModelSerializer):
+class InstrumentCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('code',)
         model = InstrumentCategory
 
 
-class GenericModeSerializer(serializers.ModelSerializer):
+class GenericModeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     validation_schema = serializers.JSONField(required=False, default=dict,
                                               help_text='Cerberus styled validation schema used to validate '
                                                         'instrument configs using this generic mode')
@@ -132,7 +274,7 @@ class GenericModeSerializer(serializers.ModelSerializer):
 
     def validate_validation_schema(self, value):
         try:
-            OCSValidator(value)
+            check_schema(value)
         except Exception as e:
             raise serializers.ValidationError(f"Invalid cerberus validation_schema: {repr(e)}")
 
@@ -149,7 +291,7 @@ class GenericModeSerializer(serializers.ModelSerializer):
         return instance
 
 
-class GenericModeGroupSerializer(serializers.ModelSerializer):
+class GenericModeGroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     instrument_type = serializers.PrimaryKeyRelatedField(
         write_only=True, queryset=InstrumentType.objects.all(),
         help_text='ID for the instrument type associated with this group'
@@ -167,7 +309,7 @@ class GenericModeGroupSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if data.get('default', None) is None:
+        if 'default' in data and data['default'] is None:
             data['default'] = ''
         return data
 
@@ -189,13 +331,7 @@ class GenericModeGroupSerializer(serializers.ModelSerializer):
         generic_modes = validated_data.pop('modes', [])
         generic_mode_instances = validated_data.pop('mode_ids', [])
         generic_mode_group = super().create(validated_data)
-
-        for generic_mode_instance in generic_mode_instances:
-            generic_mode_group.modes.add(generic_mode_instance)
-
-        for generic_mode in generic_modes:
-            generic_mode_instance, _ = GenericMode.objects.get_or_create(**generic_mode)
-            generic_mode_group.modes.add(generic_mode_instance)
+        generic_mode_group.modes.add(*generic_mode_instances, *resolve_generic_modes(generic_modes))
 
         # Update heroic when a new GenericModeGroup is created for the first time for an instrument_type
         for instrument in generic_mode_group.instrument_type.instrument_set.all():
@@ -211,13 +347,8 @@ class GenericModeGroupSerializer(serializers.ModelSerializer):
             old_instrument_type = instance.instrument_type
         instance = super().update(instance, validated_data)
         if (generic_modes or generic_mode_instances):
-            instance.modes.clear()  # If we are updating modes, clear out old modes first
-        for generic_mode_instance in generic_mode_instances:
-            instance.modes.add(generic_mode_instance)
-
-        for generic_mode in generic_modes:
-            generic_mode_instance, _ = GenericMode.objects.get_or_create(**generic_mode)
-            instance.modes.add(generic_mode_instance)
+            # If we are updating modes, set only inserts and deletes the memberships that changed
+            instance.modes.set([*generic_mode_instances, *resolve_generic_modes(generic_modes)])
         # Update done so update HEROIC here - this catches generic mode changes in the generic mode group
         if instance.instrument_type and (generic_modes or generic_mode_instances or 'default' in validated_data or 'type' in validated_data):
             for instrument in instance.instrument_type.instrument_set.all():
@@ -229,13 +360,13 @@ class GenericModeGroupSerializer(serializers.ModelSerializer):
         return instance
 
 
-class CameraTypeSerializer(serializers.ModelSerializer):
+class CameraTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'size', 'pscale', 'name', 'code', 'pixels_x', 'pixels_y', 'max_rois')
         model = CameraType
 
 
-class CameraSerializer(serializers.ModelSerializer):
+class CameraSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     camera_type = CameraTypeSerializer(read_only=True, help_text='Camera type')
     camera_type_id = serializers.IntegerField(write_only=True, help_text='Model ID number that corresponds to this camera\'s type')
     optical_element_groups = OpticalElementGroupSerializer(many=True, read_only=True,
@@ -258,13 +389,13 @@ class CameraSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ConfigurationTypeSerializer(serializers.ModelSerializer):
+class ConfigurationTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('name', 'code')
         model = ConfigurationType
 
 
-class ConfigurationTypePropertiesNestedSerializer(serializers.ModelSerializer):
+class ConfigurationTypePropertiesNestedSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     name = serializers.ReadOnlyField(source='configuration_type.name', help_text='Configuration type name')
     code = serializers.ReadOnlyField(source='configuration_type.code', help_text='Configuration type code')
     configuration_type = serializers.PrimaryKeyRelatedField(queryset=ConfigurationType.objects.all(), write_only=True, required=False)
@@ -275,14 +406,14 @@ class ConfigurationTypePropertiesNestedSerializer(serializers.ModelSerializer):
         model = ConfigurationTypeProperties
 
 
-class ConfigurationTypePropertiesSerializer(serializers.ModelSerializer):
+class ConfigurationTypePropertiesSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'configuration_type', 'instrument_type', 'config_change_overhead',
                   'schedulable', 'force_acquisition_off', 'requires_optical_elements', 'validation_schema')
         model = ConfigurationTypeProperties
 
 
-class InstrumentTypeSerializer(serializers.ModelSerializer):
+class InstrumentTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     mode_types = GenericModeGroupSerializer(many=True, required=False, help_text='Set of generic modes that this instrument type supports')
     configuration_types = ConfigurationTypePropertiesNestedSerializer(
         source='configurationtypeproperties_set', many=True, required=False,
@@ -297,7 +428,7 @@ class InstrumentTypeSerializer(serializers.ModelSerializer):
 
     def validate_validation_schema(self, value):
         try:
-            OCSValidator(value)
+            check_schema(value)
         except Exception as e:
             raise serializers.ValidationError(f"Invalid cerberus validation_schema: {repr(e)}")
 
@@ -305,24 +436,43 @@ class InstrumentTypeSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         if 'configurationtypeproperties_set' in validated_data:
+            # Replace the existing configuration type properties with the new set, changing only the ones that differ
             configuration_type_properties = validated_data.pop('configurationtypeproperties_set')
-            # Clear all existing configuration type properties if we are setting a new set on an update
-            instance.configuration_types.all().delete()
+            existing = {
+                properties.configuration_type_id: properties
+                for properties in instance.configurationtypeproperties_set.all()
+            }
+            created = []
+            updated = []
+            update_fields = set()
             for configuration_type_property in configuration_type_properties:
-                ConfigurationTypeProperties.objects.get_or_create(instrument_type=instance, **configuration_type_property)
+                configuration_type = configuration_type_property.get('configuration_type')
+                properties = existing.pop(getattr(configuration_type, 'pk', None), None)
+                if properties is None:
+                    created.append(ConfigurationTypeProperties(instrument_type=instance, **configuration_type_property))
+                    continue
+                changed = [field for field, value in configuration_type_property.items() if getattr(properties, field) != value]
+                if changed:
+                    for field in changed:
+                        setattr(properties, field, configuration_type_property[field])
+                    updated.append(properties)
+                    update_fields.update(changed)
+            if existing:
+                ConfigurationTypeProperties.objects.filter(pk__in=[properties.pk for properties in existing.values()]).delete()
+            bulk_save(ConfigurationTypeProperties, created=created, updated=updated, update_fields=sorted(update_fields))
         return super().update(instance, validated_data)
 
     def create(self, validated_data):
         configuration_type_properties = validated_data.pop('configurationtypeproperties_set', [])
         instrument_type = InstrumentType.objects.create(**validated_data)
-
-        for configuration_type_property in configuration_type_properties:
-            ConfigurationTypeProperties.objects.get_or_create(instrument_type=instrument_type, **configuration_type_property)
-
+        bulk_save(ConfigurationTypeProperties, created=[
+            ConfigurationTypeProperties(instrument_type=instrument_type, **configuration_type_property)
+            for configuration_type_property in configuration_type_properties
+        ])
         return instrument_type
 
 
-class InstrumentSerializer(serializers.ModelSerializer):
+class InstrumentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     autoguider_camera = CameraSerializer(read_only=True, help_text='Autoguider camera for this instrument')
     autoguider_camera_id = serializers.IntegerField(write_only=True,
                                                     help_text='Model ID number for the autoguider camera belonging to this instrument')
@@ -352,7 +502,7 @@ class InstrumentSerializer(serializers.ModelSerializer):
         return instance
 
 
-class TelescopeSerializer(serializers.ModelSerializer):
+class TelescopeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     instrument_set = InstrumentSerializer(many=True, read_only=True, help_text='Set of instruments belonging to this telescope')
     enclosure = serializers.HyperlinkedRelatedField(view_name='enclosure-detail', read_only=True,
                                                     help_text='Enclosure that this telescope belongs to')
@@ -365,7 +515,7 @@ class TelescopeSerializer(serializers.ModelSerializer):
         model = Telescope
 
 
-class EnclosureSerializer(serializers.ModelSerializer):
+class EnclosureSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     telescope_set = TelescopeSerializer(many=True, read_only=True, help_text='Set of telescopes within this enclosure')
     site = serializers.HyperlinkedRelatedField(view_name='site-detail', read_only=True,
                                                help_text='Site where this enclosure is located')
@@ -377,7 +527,7 @@ class EnclosureSerializer(serializers.ModelSerializer):
         model = Enclosure
 
 
-class SiteSerializer(serializers.ModelSerializer):
+class SiteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     enclosure_set = EnclosureSerializer(many=True, read_only=True, help_text='Set of enclosures belonging to this site')
 
     class Meta:
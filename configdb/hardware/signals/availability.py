@@ -0,0 +1,20 @@
+''' These signals keep the materialized availability intervals of instruments and telescopes up to date
+    as new reversion versions of them are committed
+'''
+from django.dispatch import receiver
+from reversion.signals import post_revision_commit
+
+from configdb.hardware.models import Instrument, Telescope
+from configdb.hardware.availability import (
+    record_availability, is_instrument_version_available, is_telescope_version_available
+)
+
+
+@receiver(post_revision_commit)
+def on_revision_commit(sender, revision, versions, **kwargs):
+    for version in versions:
+        model = version._model
+        if model is Instrument:
+            record_availability(version, is_instrument_version_available, instrument_id=version.object_id)
+        elif model is Telescope:
+            record_availability(version, is_telescope_version_available, telescope_id=version.object_id)
@@ -0,0 +1,43 @@
+''' These signals increment the configuration generation whenever any hardware model or
+    one of its many-to-many relationships changes, and hold its lock while revisions of hardware models are saved
+'''
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from reversion.signals import pre_revision_commit
+
+from configdb.hardware.models import (
+    HARDWARE_MODELS, ConfigurationGeneration, OpticalElementGroup, GenericModeGroup, Camera, Instrument
+)
+
+
+M2M_THROUGH_MODELS = (
+    OpticalElementGroup.optical_elements.through,
+    GenericModeGroup.modes.through,
+    Camera.optical_element_groups.through,
+    Instrument.science_cameras.through,
+)
+
+
+def on_hardware_change(sender, **kwargs):
+    ConfigurationGeneration.bump()
+
+
+def on_hardware_m2m_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ConfigurationGeneration.bump()
+
+
+def on_revision_commit(sender, revision, versions, **kwargs):
+    # The revision id is allocated under the generation lock so revision ids of hardware changes are commit ordered
+    if any(version._model in HARDWARE_MODELS for version in versions):
+        ConfigurationGeneration.lock()
+
+
+for model in HARDWARE_MODELS:
+    post_save.connect(on_hardware_change, sender=model, dispatch_uid=f'generation_save_{model.__name__}')
+    post_delete.connect(on_hardware_change, sender=model, dispatch_uid=f'generation_delete_{model.__name__}')
+
+for through_model in M2M_THROUGH_MODELS:
+    m2m_changed.connect(on_hardware_m2m_change, sender=through_model,
+                        dispatch_uid=f'generation_m2m_{through_model.__name__}')
+
+pre_revision_commit.connect(on_revision_commit, dispatch_uid='generation_revision_commit')
@@ -0,0 +1,20 @@
+''' These signals record hardware object deletions, which the reversion history does not capture
+'''
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete
+
+from configdb.hardware.models import HARDWARE_MODELS, ConfigurationGeneration, DeletionRecord
+
+
+def on_hardware_delete(sender, instance, **kwargs):
+    # The record id is allocated under the generation lock so deletion ids are commit ordered
+    ConfigurationGeneration.lock()
+    DeletionRecord.objects.create(
+        content_type=ContentType.objects.get_for_model(sender),
+        object_id=str(instance.pk),
+        object_repr=str(instance)
+    )
+
+
+for model in HARDWARE_MODELS:
+    post_delete.connect(on_hardware_delete, sender=model, dispatch_uid=f'history_delete_{model.__name__}')
@@ -0,0 +1,36 @@
+from django.core.cache import cache
+
+
+# Snapshots are addressed by generation, so they never go stale and only need to expire to free memory
+SNAPSHOT_CACHE_TIMEOUT = 60 * 60 * 24
+# Query parameters that do not change the contents of a snapshot
+SNAPSHOT_PARAMETERS = ('limit', 'offset', 'format', 'serializer')
+
+
+def is_snapshot_request(request):
+    """ Only requests for the full, unfiltered list can be answered from a snapshot """
+    return all(parameter in SNAPSHOT_PARAMETERS for parameter in request.query_params)
+
+
+def get_by_generation(name, generation, build_function):
+    """ Returns the data with the given name for a generation, building and caching it with build_function if it
+        does not exist yet. The generation is anything that changes whenever the data would, like the configuration
+        generation or the version of the objects the data is built from, so the data never goes stale.
+    """
+    cache_key = f'{name}:{generation}'
+    data = cache.get(cache_key)
+    if data is None:
+        data = build_function()
+        cache.set(cache_key, data, SNAPSHOT_CACHE_TIMEOUT)
+    return data
+
+
+def get_snapshot(name, request, generation, build_function):
+    """ Returns the snapshot of serialized data with the given name for a configuration generation, building it
+        with build_function if it does not exist yet. Snapshots are also keyed on the base url and format parameter
+        of the request since the serialized data contains hyperlinks, which keep the format parameter.
+    """
+    format_parameter = request.query_params.get('format', '')
+    return get_by_generation(
+        f'snapshot:{name}:{format_parameter}:{request.build_absolute_uri("/")}', generation, build_function
+    )
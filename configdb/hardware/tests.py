@@ -1,21 +1,50 @@
 import json
+import numpy as np
+import os
+import tempfile
+import requests
 import reversion
+import yaml
 import time_machine
-from datetime import datetime
+from datetime import datetime, timezone
 from http import HTTPStatus
+from io import StringIO
+from urllib.parse import parse_qsl
 from django.test import TestCase, override_settings
 from django.test import Client
+from django.core.cache import cache
 from django.urls import reverse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from django.contrib.auth.models import User
+from reversion.models import Version
 from mixer.backend.django import mixer
+from cerberus.schema import SchemaError
 
 from configdb.hardware.models import (Site, Instrument, Enclosure, Telescope, Camera, CameraType, InstrumentType,
                      GenericMode, GenericModeGroup, ModeType, OpticalElement, OpticalElementGroup,
-                     ConfigurationType, ConfigurationTypeProperties, InstrumentCategory)
+                     ConfigurationType, ConfigurationTypeProperties, InstrumentCategory, ConfigurationGeneration,
+                     AvailabilityInterval, HeroicMessage, HeroicSyncState, DeletionRecord)
+from configdb.hardware.benchmark import (
+    generate_network, network_size_key, run_benchmarks, get_benchmark_urls, compare_to_baseline, load_baseline, BASELINE_PATH,
+    SPARSE_FIELDSET_REQUESTS
+)
 from configdb.hardware.serializers import GenericModeSerializer, InstrumentTypeSerializer
-from configdb.hardware.heroic import heroic_instrument_id
+from configdb.hardware.network import COMPONENTS, export_network
+from configdb.hardware.validator import ValidatorRegistry, check_schema, validator_registry
+from configdb.hardware.schemas import merge_schemas, build_schema
+from configdb.hardware.durations import compute_durations, build_overhead_tables
+from configdb.hardware.visibility import compute_visibility, build_telescope_limits, time_grid
+from configdb.hardware import nights
+from configdb.hardware.heroic import (
+    heroic_instrument_id, send_to_heroic, deliver_heroic_messages, send_heroic_instrument_capabilities,
+    update_heroic_instrument_capabilities, build_heroic_instrument_capabilities,
+    instrument_to_heroic_instrument_capabilities
+)
 
 
 class BaseHardwareTest(TestCase):
@@ -145,8 +174,8 @@ class SimpleHardwareTest(BaseHardwareTest):
 
 
 @override_settings(HEROIC_API_URL='http://fake', HEROIC_API_TOKEN='123fake', HEROIC_OBSERVATORY='tst')
-@patch('configdb.hardware.heroic.send_to_heroic')
-class TestHeroicUpdates(APITestCase):
+@patch('configdb.hardware.heroic.send_to_heroic', wraps=send_to_heroic)
+class TestHeroicUpdates(APITransactionTestCase):
     def setUp(self):
         super().setUp()
         self.site = mixer.blend(Site, code='tst')
@@ -301,6 +330,19 @@ class TestHeroicUpdates(APITestCase):
         }
         mock_send.assert_called_with('instrument-capabilities/', expected_capabilities)
 
+    def test_instrument_is_sent_to_heroic_once_per_request(self, mock_send):
+        # The optical element reaches the instrument through both groups, but the instrument is only sent once
+        optical_element = mixer.blend(OpticalElement, name='myOE', code='myoe1', schedulable=True)
+        optical_element_group = mixer.blend(OpticalElementGroup, optical_elements=[optical_element], type='filters')
+        optical_element_group2 = mixer.blend(OpticalElementGroup, optical_elements=[optical_element], type='slits')
+        self.camera.optical_element_groups.add(optical_element_group, optical_element_group2)
+        self.client.patch(
+            reverse('opticalelement-detail', args=(optical_element.id,)),
+            data={'schedulable': False}, format='json'
+        )
+        mock_send.assert_called_once()
+        self.assertFalse(HeroicMessage.objects.get().payload['optical_element_groups']['filters']['options'][0]['schedulable'])
+
     def test_create_generic_mode_group_of_instrument_type_calls_out_to_heroic(self, mock_send):
         generic_mode1 = {'name': 'testMode1', 'code': 'tM1', 'schedulable': True}
         generic_mode_group = {'type': 'readout', 'instrument_type': self.instrument_type.id,
@@ -375,6 +417,231 @@ class TestHeroicUpdates(APITestCase):
         mock_send.assert_called_with('instrument-capabilities/', expected_capabilities)
 
 
+@override_settings(HEROIC_API_URL='http://fake', HEROIC_API_TOKEN='123fake', HEROIC_OBSERVATORY='tst',
+                   HEROIC_MAX_ATTEMPTS=3, HEROIC_RETRY_DELAY=30, HEROIC_MAX_RETRY_DELAY=3600)
+@patch('configdb.hardware.heroic.post_to_heroic')
+class TestHeroicOutbox(TestCase):
+    def test_send_to_heroic_queues_message(self, mock_post):
+        send_to_heroic('telescopes/tst.doma-1m0a/', {'aperture': 1.0}, update=True)
+        mock_post.assert_not_called()
+        message = HeroicMessage.objects.get()
+        self.assertEqual(message.api_endpoint, 'telescopes/tst.doma-1m0a/')
+        self.assertEqual(message.payload, {'aperture': 1.0})
+        self.assertTrue(message.update)
+
+    def test_messages_are_delivered_in_order(self, mock_post):
+        send_to_heroic('sites/', {'id': 'tst.tst'})
+        send_to_heroic('telescopes/', {'id': 'tst.tst.doma-1m0a'})
+        self.assertEqual(deliver_heroic_messages(), 2)
+        self.assertEqual([call.args[0] for call in mock_post.call_args_list], ['sites/', 'telescopes/'])
+        self.assertFalse(HeroicMessage.objects.exists())
+
+    def test_each_message_is_committed_before_the_next_is_sent(self, mock_post):
+        send_to_heroic('sites/', {'id': 'tst.tst'})
+        send_to_heroic('telescopes/', {'id': 'tst.tst.doma-1m0a'})
+        outbox = []
+
+        def post(api_endpoint, payload, update=False):
+            # The message being sent is claimed, and the messages before it are already recorded as delivered
+            message = HeroicMessage.objects.get(api_endpoint=api_endpoint)
+            outbox.append((api_endpoint, message.next_attempt > datetime.now(timezone.utc),
+                           list(HeroicMessage.objects.values_list('api_endpoint', flat=True)),
+                           list(HeroicSyncState.objects.values_list('sync_key', flat=True))))
+            # Another worker finds the oldest message claimed and does not send anything after it
+            self.assertEqual(deliver_heroic_messages(), 0)
+        mock_post.side_effect = post
+        self.assertEqual(deliver_heroic_messages(), 2)
+        self.assertEqual(outbox, [
+            ('sites/', True, ['sites/', 'telescopes/'], []),
+            ('telescopes/', True, ['telescopes/'], ['sites:tst.tst']),
+        ])
+
+    def test_failed_message_is_retried_with_backoff(self, mock_post):
+        mock_post.side_effect = Exception('HEROIC is down')
+        with time_machine.travel("2024-01-01 00:00:00", tick=False):
+            send_to_heroic('sites/', {'id': 'tst.tst'})
+            send_to_heroic('telescopes/', {'id': 'tst.tst.doma-1m0a'})
+            self.assertEqual(deliver_heroic_messages(), 0)
+        # Delivery stops at the failed message so the telescope is not sent before its site
+        self.assertEqual(mock_post.call_count, 1)
+        message = HeroicMessage.objects.first()
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.next_attempt, datetime(2024, 1, 1, 0, 0, 30, tzinfo=timezone.utc))
+        self.assertIn('HEROIC is down', message.last_error)
+        # Nothing is attempted until the backoff has passed
+        with time_machine.travel("2024-01-01 00:00:10", tick=False):
+            deliver_heroic_messages()
+        self.assertEqual(mock_post.call_count, 1)
+        with time_machine.travel("2024-01-01 00:00:40", tick=False):
+            deliver_heroic_messages()
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertEqual(message.next_attempt, datetime(2024, 1, 1, 0, 1, 40, tzinfo=timezone.utc))
+
+    def test_capabilities_are_built_once_when_the_change_commits(self, mock_post):
+        instrument = mixer.blend(Instrument, state=Instrument.SCHEDULABLE)
+        with patch('configdb.hardware.heroic.build_heroic_instrument_capabilities',
+                   wraps=build_heroic_instrument_capabilities) as mock_build:
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                update_heroic_instrument_capabilities(instrument)
+                instrument.state = Instrument.MANUAL
+                instrument.save()
+                update_heroic_instrument_capabilities(instrument)
+                self.assertFalse(HeroicMessage.objects.exists())
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertEqual(HeroicMessage.objects.get().payload['status'], 'UNAVAILABLE')
+        # Nothing is queued for a transaction that is rolled back
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            instrument.state = Instrument.SCHEDULABLE
+            instrument.save()
+            update_heroic_instrument_capabilities(instrument)
+            raise RuntimeError()
+        self.assertEqual(HeroicMessage.objects.get().payload['status'], 'UNAVAILABLE')
+        mock_post.assert_not_called()
+
+    def test_unchanged_instrument_capabilities_are_not_sent_again(self, mock_post):
+        instrument = mixer.blend(Instrument, state=Instrument.SCHEDULABLE)
+        send_heroic_instrument_capabilities(instrument)
+        send_heroic_instrument_capabilities(instrument)
+        self.assertEqual(HeroicMessage.objects.count(), 1)
+        deliver_heroic_messages()
+        send_heroic_instrument_capabilities(instrument)
+        self.assertFalse(HeroicMessage.objects.exists())
+        instrument.state = Instrument.MANUAL
+        instrument.save()
+        send_heroic_instrument_capabilities(instrument)
+        self.assertEqual(HeroicMessage.objects.get().payload['status'], 'UNAVAILABLE')
+
+    def test_message_is_skipped_after_max_attempts(self, mock_post):
+        send_to_heroic('sites/', {'id': 'tst.tst'})
+        send_to_heroic('telescopes/', {'id': 'tst.tst.doma-1m0a'})
+        HeroicMessage.objects.filter(api_endpoint='sites/').update(attempts=3)
+        call_command('heroic_worker', '--once')
+        mock_post.assert_called_once_with('telescopes/', {'id': 'tst.tst.doma-1m0a'}, update=False)
+        self.assertEqual(HeroicMessage.objects.get().api_endpoint, 'sites/')
+
+
+@override_settings(HEROIC_OBSERVATORY='tst')
+class TestHeroicPayloads(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.readout_mode = mixer.blend(ModeType, id='readout')
+        self.telescope = mixer.blend(Telescope)
+
+    def _add_instrument(self, code):
+        optical_elements = mixer.cycle(2).blend(OpticalElement)
+        optical_element_group = mixer.blend(OpticalElementGroup, optical_elements=optical_elements,
+                                            default=optical_elements[0], type='filters')
+        camera = mixer.blend(Camera, optical_element_groups=[optical_element_group])
+        instrument_type = mixer.blend(InstrumentType)
+        modes = mixer.cycle(2).blend(GenericMode)
+        mixer.blend(GenericModeGroup, type=self.readout_mode, instrument_type=instrument_type, modes=modes, default=modes[1])
+        return mixer.blend(Instrument, autoguider_camera=camera, telescope=self.telescope, science_cameras=[camera],
+                           instrument_type=instrument_type, code=code)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            build_heroic_instrument_capabilities(Instrument.objects.all())
+        return len(queries)
+
+    def test_capabilities_match_single_instrument_payload(self):
+        instrument = self._add_instrument('inst1')
+        capabilities = build_heroic_instrument_capabilities(Instrument.objects.all())
+        self.assertEqual(capabilities, [(instrument, instrument_to_heroic_instrument_capabilities(instrument))])
+        self.assertEqual(len(capabilities[0][1]['optical_element_groups']['filters']['options']), 2)
+        self.assertIn('default', capabilities[0][1]['operation_modes']['readout'])
+
+    def test_query_count_does_not_grow_with_instruments(self):
+        self._add_instrument('inst1')
+        query_count = self._count_queries()
+        for i in range(2, 6):
+            self._add_instrument(f'inst{i}')
+        self.assertEqual(self._count_queries(), query_count)
+
+
+@override_settings(HEROIC_API_URL='http://fake', HEROIC_API_TOKEN='123fake', HEROIC_OBSERVATORY='tst')
+@patch('configdb.hardware.management.commands.sync_heroic.post_to_heroic')
+class TestHeroicSync(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.site = mixer.blend(Site, code='tst')
+        self.enclosure = mixer.blend(Enclosure, site=self.site, code='doma')
+        self.telescope = mixer.blend(Telescope, enclosure=self.enclosure, code='1m0a', active=True)
+        self.camera = mixer.blend(Camera)
+        self.instrument = mixer.blend(Instrument, autoguider_camera=self.camera, telescope=self.telescope,
+                                      science_cameras=[self.camera], state=Instrument.SCHEDULABLE, code='myInst01')
+
+    def _sync(self, *args):
+        out = StringIO()
+        call_command('sync_heroic', *args, stdout=out)
+        return out.getvalue()
+
+    def _http_error(self, status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        return requests.HTTPError(response=response)
+
+    def test_dry_run_does_not_send(self, mock_post):
+        output = self._sync('--dry-run')
+        mock_post.assert_not_called()
+        self.assertIn('instruments: 1 to send, 0 unchanged', output)
+        self.assertIn(f'Would send POST instrument-capabilities/ for instrument-capabilities:{heroic_instrument_id(self.instrument)}', output)
+
+    def test_only_changes_are_sent(self, mock_post):
+        output = self._sync()
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertIn('telescopes: 1 sent, 0 failed, 0 unchanged', output)
+        mock_post.reset_mock()
+        self._sync()
+        mock_post.assert_not_called()
+        self.telescope.aperture = 2.0
+        self.telescope.save()
+        self._sync()
+        mock_post.assert_called_once()
+        self.assertEqual(mock_post.call_args.args[1]['aperture'], 2.0)
+
+    def test_failed_sends_are_retried_on_next_sync(self, mock_post):
+        mock_post.side_effect = Exception('HEROIC is down')
+        output = self._sync()
+        self.assertIn('sites: 0 sent, 1 failed, 0 unchanged', output)
+        mock_post.side_effect = None
+        self._sync()
+        self.assertEqual(mock_post.call_count, 6)
+
+    def test_objects_missing_from_heroic_are_created(self, mock_post):
+        created = set()
+
+        def post(api_endpoint, payload, update=False, session=None):
+            # HEROIC has none of the objects until they are created
+            if api_endpoint in ('sites/', 'telescopes/', 'instruments/'):
+                created.add(payload['id'])
+            elif update and api_endpoint.split('/')[1] not in created:
+                raise self._http_error(404)
+            elif not update and payload['instrument'] not in created:
+                raise self._http_error(400)
+        mock_post.side_effect = post
+        output = self._sync()
+        self.assertIn('instruments: 1 sent, 0 failed, 0 unchanged', output)
+        self.assertEqual(
+            [(call.args[0], call.kwargs.get('update', False)) for call in mock_post.call_args_list],
+            [('sites/tst.tst/', True), ('sites/', False), ('telescopes/tst.tst.doma-1m0a/', True), ('telescopes/', False),
+             ('instrument-capabilities/', False), ('instruments/', False), ('instrument-capabilities/', False)]
+        )
+        self.assertEqual(mock_post.call_args_list[1].args[1]['id'], 'tst.tst')
+        self.assertEqual(mock_post.call_args_list[3].args[1]['status'], 'SCHEDULABLE')
+
+    def test_other_errors_do_not_create_objects(self, mock_post):
+        mock_post.side_effect = self._http_error(500)
+        output = self._sync()
+        self.assertIn('sites: 0 sent, 1 failed, 0 unchanged', output)
+        self.assertEqual(mock_post.call_count, 3)
+
+    @override_settings(HEROIC_EXCLUDE_SITES=['tst'])
+    def test_excluded_sites_are_not_sent(self, mock_post):
+        self._sync()
+        mock_post.assert_not_called()
+
+
 class TestCreationThroughAPI(APITestCase):
     def setUp(self):
         super().setUp()
@@ -445,6 +712,29 @@ class TestCreationThroughAPI(APITestCase):
         self.assertEqual(oeg.optical_elements.first().code, optical_element1.code)
         self.assertEqual(oeg.optical_elements.last().code, optical_element2.code)
 
+    def test_nested_optical_elements_are_written_in_bulk(self):
+        mixer.blend(OpticalElement, code='f0', name='Filter 0')
+        optical_elements = [{'code': f'f{index}', 'name': f'Filter {index}'} for index in range(30)]
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(reverse('opticalelementgroup-list'), format='json',
+                             data={'name': 'wheel1', 'type': 'filters', 'optical_elements': optical_elements[:2]})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(reverse('opticalelementgroup-list'), format='json',
+                                        data={'name': 'wheel2', 'type': 'filters', 'optical_elements': optical_elements})
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(OpticalElement.objects.count(), 30)
+        self.assertEqual(OpticalElementGroup.objects.get(name='wheel2').optical_elements.count(), 30)
+        self.assertEqual(len(large), len(small))
+        # The optical elements created in bulk are still recorded in the revisions of the requests
+        self.assertEqual(Version.objects.get_for_model(OpticalElement).count(), 29)
+
+        oeg = OpticalElementGroup.objects.get(name='wheel2')
+        response = self.client.patch(reverse('opticalelementgroup-detail', args=(oeg.id,)), format='json',
+                                     data={'optical_elements': optical_elements[1:] + [{'code': 'new', 'name': 'New'}]})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(sorted(oeg.optical_elements.values_list('code', flat=True)),
+                         sorted([optical_element['code'] for optical_element in optical_elements[1:]] + ['new']))
+
     def test_default_mode_types_exist(self):
         response = self.client.get(reverse('modetype-list'))
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -524,6 +814,20 @@ class TestCreationThroughAPI(APITestCase):
         self.assertEqual(gmg.modes.first().code, mode1.code)
         self.assertEqual(gmg.modes.last().code, mode2.code)
 
+    def test_nested_generic_modes_are_matched_on_their_fields(self):
+        instrument_type = mixer.blend(InstrumentType)
+        existing_mode = mixer.blend(GenericMode, code='full', name='Full', overhead=10, validation_schema={})
+        generic_mode_group = {
+            'type': 'readout', 'instrument_type': instrument_type.id, 'default': 'full',
+            'modes': [{'code': 'full', 'name': 'Full', 'overhead': 10},
+                      {'code': 'central', 'name': 'Central', 'overhead': 5},
+                      {'code': 'central', 'name': 'Central', 'overhead': 5}]
+        }
+        response = self.client.post(reverse('genericmodegroup-list'), data=generic_mode_group, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(GenericMode.objects.count(), 2)
+        self.assertIn(existing_mode, GenericModeGroup.objects.get().modes.all())
+
     def test_create_configuration_type(self):
         configuration_type = {'name': 'Repeat Exposure', 'code': 'REPEAT_EXPOSE'}
         response = self.client.post(reverse('configurationtype-list'), data=configuration_type)
@@ -636,6 +940,25 @@ class TestCreationThroughAPI(APITestCase):
         self.assertEqual(it.configuration_types.first().code, config_type2.code)
         self.assertEqual(response.json()['configuration_types'][0]['config_change_overhead'], 6.6)
 
+    def test_patch_instrument_type_configuration_types_only_changes_its_properties(self):
+        config_type1 = mixer.blend(ConfigurationType)
+        config_type2 = mixer.blend(ConfigurationType)
+        instrument_type = mixer.blend(InstrumentType)
+        other_instrument_type = mixer.blend(InstrumentType)
+        kept = mixer.blend(ConfigurationTypeProperties, configuration_type=config_type1, instrument_type=instrument_type,
+                           config_change_overhead=1.0)
+        mixer.blend(ConfigurationTypeProperties, configuration_type=config_type2, instrument_type=instrument_type)
+        mixer.blend(ConfigurationTypeProperties, configuration_type=config_type2, instrument_type=other_instrument_type)
+        updates = {'configuration_types': [{'configuration_type': config_type1.code, 'config_change_overhead': 2.0}]}
+        response = self.client.patch(reverse('instrumenttype-detail', args=(instrument_type.id,)), data=updates, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        # The configuration types themselves and the properties of other instrument types are left alone
+        self.assertEqual(ConfigurationType.objects.count(), 2)
+        self.assertEqual(other_instrument_type.configurationtypeproperties_set.count(), 1)
+        kept.refresh_from_db()
+        self.assertEqual(kept.config_change_overhead, 2.0)
+        self.assertEqual(list(instrument_type.configurationtypeproperties_set.all()), [kept])
+
 
 class TestAvailabilityHistory(BaseHardwareTest):
     def setUp(self):
@@ -733,6 +1056,50 @@ class TestAvailabilityHistory(BaseHardwareTest):
             {'start': datetime(2023, 1, 1).isoformat(), 'end': datetime(2023, 2, 1).isoformat()}]}
         self.assertEqual(response.json(), expected_intervals)
 
+    def test_availability_intervals_are_materialized_from_versions(self):
+        self._update_instrument_revision(self.instrument, Instrument.MANUAL, "2023-02-01 00:00:00")
+        self._update_instrument_revision(self.instrument, Instrument.STANDBY, "2023-02-15 00:00:00")
+        self._update_instrument_revision(self.instrument, Instrument.SCHEDULABLE, "2023-03-01 00:00:00")
+        intervals = list(self.instrument.availability_intervals.values_list('start', 'end'))
+        self.assertEqual(intervals, [
+            (datetime(2023, 3, 1, tzinfo=timezone.utc), None),
+            (datetime(2023, 1, 1, tzinfo=timezone.utc), datetime(2023, 2, 1, tzinfo=timezone.utc))
+        ])
+        self.assertEqual(self.telescope.availability_intervals.count(), 1)
+
+    def test_availability_falls_back_to_the_current_state(self):
+        # An instrument that was never versioned is available since it was last modified, and one changed without
+        # a version is not available after that change
+        with time_machine.travel("2023-06-01 00:00:00"):
+            instrument_2 = mixer.blend(Instrument, autoguider_camera=self.camera, telescope=self.telescope,
+                                       instrument_type=self.instrument_type, science_cameras=[self.camera],
+                                       state=Instrument.SCHEDULABLE, code='myInst02')
+        with time_machine.travel("2023-07-01 00:00:00"):
+            self.instrument.state = Instrument.MANUAL
+            self.instrument.save()
+        with time_machine.travel("2024-01-01 00:00:00"):
+            response = self.client.get(reverse('availability') + f'?instrument_id={instrument_2.code}')
+            self.assertEqual(response.json(), {'availability_intervals': [
+                {'start': datetime(2023, 6, 1).isoformat(), 'end': datetime(2024, 1, 1).isoformat()}]})
+            response = self.client.get(reverse('availability') + f'?instrument_id={self.instrument.code}')
+            self.assertEqual(response.json(), {'availability_intervals': [
+                {'start': datetime(2023, 1, 1).isoformat(), 'end': datetime(2023, 7, 1).isoformat()}]})
+        self.assertEqual(self._get_bulk_availability()['telescopes'][0]['instruments'], [
+            {'instrument': self.instrument.code, 'availability_intervals': [
+                {'start': datetime(2023, 1, 1).isoformat(), 'end': datetime(2023, 7, 1).isoformat()}]},
+            {'instrument': instrument_2.code, 'availability_intervals': [
+                {'start': datetime(2023, 6, 1).isoformat(), 'end': datetime(2024, 1, 1).isoformat()}]},
+        ])
+
+    def test_backfill_rebuilds_availability_intervals(self):
+        self._update_instrument_revision(self.instrument, Instrument.MANUAL, "2023-02-01 00:00:00")
+        self._update_instrument_revision(self.instrument, Instrument.SCHEDULABLE, "2023-03-01 00:00:00")
+        self._update_telescope_revision(self.telescope, False, "2023-02-10 00:00:00")
+        expected_intervals = set(AvailabilityInterval.objects.values_list('instrument', 'telescope', 'start', 'end'))
+        AvailabilityInterval.objects.all().delete()
+        call_command('backfill_availability')
+        self.assertEqual(set(AvailabilityInterval.objects.values_list('instrument', 'telescope', 'start', 'end')), expected_intervals)
+
     def test_multiple_instrument_availability_history(self):
         # Add a second instrument on the telescope that is always available and see that the telescope shows always available
         instrument_2 = mixer.blend(Instrument, autoguider_camera=self.camera, telescope=self.telescope,
@@ -749,3 +1116,1385 @@ class TestAvailabilityHistory(BaseHardwareTest):
         expected_intervals = {'availability_intervals': [
             {'start': datetime(2023, 1, 1).isoformat(), 'end': datetime(2024, 1, 1).isoformat()}]}
         self.assertEqual(response.json(), expected_intervals)
+
+    def _get_bulk_availability(self, params=''):
+        with time_machine.travel("2024-01-01 00:00:00"):
+            response = self.client.get(reverse('availability-bulk') + params)
+            return json.loads(b''.join(response.streaming_content))
+
+    def test_bulk_availability_history(self):
+        self._update_instrument_revision(self.instrument, Instrument.MANUAL, "2023-02-01 00:00:00")
+        self._update_instrument_revision(self.instrument, Instrument.SCHEDULABLE, "2023-03-01 00:00:00")
+        self._update_telescope_revision(self.telescope, False, "2023-02-10 00:00:00")
+        self._update_telescope_revision(self.telescope, True, "2023-03-10 00:00:00")
+
+        data = self._get_bulk_availability()
+        with time_machine.travel("2024-01-01 00:00:00"):
+            telescope_response = self.client.get(reverse('availability') + f'?telescope_id={self.telescope.code}&site_id={self.site.code}&enclosure_id={self.enclosure.code}')
+            instrument_response = self.client.get(reverse('availability') + f'?instrument_id={self.instrument.code}')
+        self.assertEqual(len(data['telescopes']), 1)
+        self.assertEqual(data['telescopes'][0]['telescope'], str(self.telescope))
+        self.assertEqual(data['telescopes'][0]['availability_intervals'], telescope_response.json()['availability_intervals'])
+        self.assertEqual(data['telescopes'][0]['instruments'], [
+            {'instrument': self.instrument.code, 'availability_intervals': instrument_response.json()['availability_intervals']}
+        ])
+
+    def test_bulk_availability_history_query_count_is_constant(self):
+        for i in range(5):
+            instrument = mixer.blend(Instrument, autoguider_camera=self.camera, telescope=self.telescope,
+                                     instrument_type=self.instrument_type, science_cameras=[self.camera],
+                                     state=Instrument.SCHEDULABLE, code=f'bulkInst{i}')
+            with time_machine.travel("2023-01-01 00:00:00"):
+                with reversion.create_revision():
+                    instrument.save()
+        with self.assertNumQueries(2):
+            data = self._get_bulk_availability()
+        self.assertEqual(len(data['telescopes'][0]['instruments']), 6)
+
+    def test_bulk_availability_history_filters(self):
+        data = self._get_bulk_availability(f'?site_id={self.site.code}&state={Instrument.SCHEDULABLE}')
+        self.assertEqual(len(data['telescopes']), 1)
+        data = self._get_bulk_availability('?site_id=nosite')
+        self.assertEqual(data['telescopes'], [])
+        data = self._get_bulk_availability(f'?state={Instrument.MANUAL}&state={Instrument.DISABLED}')
+        self.assertEqual(data['telescopes'], [])
+
+    def test_bulk_availability_history_requires_date_params_be_parseable(self):
+        response = self.client.get(reverse('availability-bulk') + '?end=notadate')
+        self.assertContains(response, 'The format used for the start/end parameters is not parseable', status_code=400)
+
+
+class TestSiteSnapshot(BaseHardwareTest):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_hardware_changes_increment_generation(self):
+        generation = ConfigurationGeneration.current().generation
+        self.instrument.state = Instrument.MANUAL
+        self.instrument.save()
+        self.assertGreater(ConfigurationGeneration.current().generation, generation)
+        generation = ConfigurationGeneration.current().generation
+        self.instrument.science_cameras.clear()
+        self.assertGreater(ConfigurationGeneration.current().generation, generation)
+
+    def test_sites_are_served_from_snapshot(self):
+        response = self.client.get(reverse('site-list'))
+        # Only the configuration generation is read from the database once the snapshot exists
+        with self.assertNumQueries(1):
+            cached_response = self.client.get(reverse('site-list'))
+        self.assertEqual(response.json(), cached_response.json())
+        self.assertEqual(cached_response.json()['results'][0]['code'], self.site.code)
+
+    def test_snapshot_is_rebuilt_when_configuration_changes(self):
+        response = self.client.get(reverse('site-list'))
+        instrument = response.json()['results'][0]['enclosure_set'][0]['telescope_set'][0]['instrument_set'][0]
+        self.assertEqual(instrument['state'], Instrument.SCHEDULABLE)
+        self.instrument.state = Instrument.MANUAL
+        self.instrument.save()
+        response = self.client.get(reverse('site-list'))
+        instrument = response.json()['results'][0]['enclosure_set'][0]['telescope_set'][0]['instrument_set'][0]
+        self.assertEqual(instrument['state'], Instrument.MANUAL)
+
+    def test_filtered_sites_are_not_served_from_snapshot(self):
+        mixer.blend(Site, code='abc')
+        response = self.client.get(reverse('site-list'))
+        self.assertEqual(response.json()['count'], 2)
+        response = self.client.get(reverse('site-list') + '?code=abc')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response.json()['results'][0]['code'], 'abc')
+
+    def test_snapshot_hyperlinks_keep_the_format_of_the_request(self):
+        response = self.client.get(reverse('site-list') + '?format=json')
+        self.assertTrue(response.json()['results'][0]['enclosure_set'][0]['site'].endswith('?format=json'))
+        response = self.client.get(reverse('site-list'))
+        self.assertFalse(response.json()['results'][0]['enclosure_set'][0]['site'].endswith('?format=json'))
+
+
+class TestConditionalRequests(BaseHardwareTest):
+    def test_responses_have_etag_and_last_modified(self):
+        response = self.client.get(reverse('instrument-list'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(reverse('instrument-detail', args=(self.instrument.id,)))
+        # Only the configuration generation is read from the database to answer a conditional request
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('instrument-detail', args=(self.instrument.id,)),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_changes_when_configuration_changes(self):
+        response = self.client.get(reverse('instrument-list'))
+        self.instrument.state = Instrument.MANUAL
+        self.instrument.save()
+        response = self.client.get(reverse('instrument-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['results'][0]['state'], Instrument.MANUAL)
+
+    def test_etag_differs_between_urls(self):
+        response = self.client.get(reverse('instrument-list'))
+        response = self.client.get(reverse('instrument-list') + '?state=MANUAL', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_if_modified_since_is_not_modified(self):
+        response = self.client.get(reverse('site-list'))
+        response = self.client.get(reverse('site-list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+
+class TestChangesFeed(BaseHardwareTest):
+    def setUp(self):
+        super().setUp()
+        with reversion.create_revision():
+            self.instrument.save()
+        self.cursor = self.client.get(reverse('changes')).json()['cursor']
+
+    def test_no_cursor_returns_current_cursor(self):
+        response = self.client.get(reverse('changes'))
+        self.assertEqual(response.json(), {'cursor': self.cursor, 'changes': []})
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('changes') + '?since=notacursor')
+        self.assertContains(response, 'The since parameter must be a cursor returned by a previous call', status_code=400)
+
+    def test_changes_since_cursor(self):
+        with reversion.create_revision():
+            self.instrument.state = Instrument.MANUAL
+            self.instrument.save()
+        with reversion.create_revision():
+            self.instrument.state = Instrument.STANDBY
+            self.instrument.save()
+            new_telescope = mixer.blend(Telescope, enclosure=self.enclosure, code='2m0a')
+        response = self.client.get(reverse('changes') + f'?since={self.cursor}')
+        changes = response.json()['changes']
+        # Only the latest version of each changed object is returned
+        self.assertEqual(len(changes), 2)
+        instrument_change = next(change for change in changes if change['model'] == 'instrument')
+        self.assertEqual(instrument_change['action'], 'updated')
+        self.assertEqual(instrument_change['id'], self.instrument.id)
+        self.assertEqual(instrument_change['fields']['state'], Instrument.STANDBY)
+        telescope_change = next(change for change in changes if change['model'] == 'telescope')
+        self.assertEqual(telescope_change['action'], 'created')
+        self.assertEqual(telescope_change['repr'], str(new_telescope))
+
+        # The returned cursor only picks up later changes
+        response = self.client.get(reverse('changes') + f'?since={response.json()["cursor"]}')
+        self.assertEqual(response.json()['changes'], [])
+
+    def test_deletions_since_cursor(self):
+        instrument_id = self.instrument.id
+        instrument_repr = str(self.instrument)
+        self.instrument.delete()
+        response = self.client.get(reverse('changes') + f'?since={self.cursor}')
+        changes = response.json()['changes']
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['action'], 'deleted')
+        self.assertEqual(changes[0]['id'], instrument_id)
+        self.assertEqual(changes[0]['repr'], instrument_repr)
+
+    def test_change_ids_are_allocated_under_the_generation_lock(self):
+        # Ids taken after the generation row lock increase in commit order, so no change lands behind a cursor
+        def first_query(queries, table):
+            return next(index for index, query in enumerate(queries) if f'INSERT INTO "{table}"' in query['sql'])
+
+        def lock_before(queries, index):
+            return any(query['sql'].startswith('UPDATE "hardware_configurationgeneration"') for query in queries[:index])
+
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                with reversion.create_revision():
+                    reversion.add_to_revision(self.telescope)
+        self.assertTrue(lock_before(queries.captured_queries, first_query(queries.captured_queries, 'reversion_revision')))
+        with CaptureQueriesContext(connection) as queries:
+            self.instrument.delete()
+        self.assertTrue(lock_before(queries.captured_queries,
+                                    first_query(queries.captured_queries, 'hardware_deletionrecord')))
+
+
+class TestFastSerializers(TestCase):
+    def setUp(self):
+        super().setUp()
+        generate_network({'sites': 1, 'enclosures': 1})
+        cache.clear()
+
+    def _assert_same_content(self, url):
+        # The client replaces the query string of the url with its parameters, so they are passed separately
+        url, _, query_string = url.partition('?')
+        query = dict(parse_qsl(query_string))
+        # Hyperlinks keep the format parameter, so urls with and without it are compared
+        for params in (query, {**query, 'format': 'json'}):
+            response = self.client.get(url, params)
+            cache.clear()
+            fast_response = self.client.get(url, {**params, 'serializer': 'fast'})
+            cache.clear()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(fast_response.content, response.content)
+
+    def test_fast_serializers_match_serializers(self):
+        sparse_names = [name for name, _, _ in SPARSE_FIELDSET_REQUESTS]
+        for name, url in get_benchmark_urls():
+            if name.endswith('-list') or name.endswith('-detail') or name in sparse_names:
+                if not name.startswith('html-'):
+                    with self.subTest(endpoint=name):
+                        self._assert_same_content(url)
+
+    @override_settings(FAST_SERIALIZATION=True)
+    def test_fast_serialization_setting(self):
+        url = reverse('instrument-list')
+        fast_content = self.client.get(url, {'format': 'json'}).content
+        standard_content = self.client.get(url, {'format': 'json', 'serializer': 'standard'}).content
+        self.assertEqual(fast_content, standard_content)
+
+    def test_fast_serializers_are_not_used_for_writes_or_browsable_api(self):
+        with patch('configdb.hardware.api_views.FastSerializer') as mock_fast_serializer:
+            self.client.get(reverse('instrument-list'), {'format': 'api', 'serializer': 'fast'})
+        mock_fast_serializer.assert_not_called()
+
+
+class TestSparseFieldsets(TestCase):
+    def setUp(self):
+        super().setUp()
+        generate_network({'sites': 1, 'enclosures': 1})
+        cache.clear()
+
+    def test_fields_include_nested_fields(self):
+        response = self.client.get(reverse('instrument-list'), {'fields': 'code,state,instrument_type.code'})
+        instrument = response.json()['results'][0]
+        self.assertEqual(set(instrument), {'code', 'state', 'instrument_type'})
+        self.assertEqual(instrument['instrument_type'], {'code': 'BENCH-IMAGER'})
+
+    def test_field_of_nested_serializer_includes_all_its_fields(self):
+        response = self.client.get(reverse('instrument-list'), {'fields': 'code,autoguider_camera'})
+        camera = response.json()['results'][0]['autoguider_camera']
+        self.assertIn('camera_type', camera)
+        self.assertIn('optical_elements', camera['optical_element_groups'][0])
+
+    def test_exclude_fields(self):
+        response = self.client.get(reverse('instrument-list'),
+                                   {'exclude': 'science_cameras,instrument_type.configuration_types'})
+        instrument = response.json()['results'][0]
+        self.assertNotIn('science_cameras', instrument)
+        self.assertNotIn('configuration_types', instrument['instrument_type'])
+        self.assertIn('mode_types', instrument['instrument_type'])
+
+    def test_depth_limits_nested_serializers(self):
+        response = self.client.get(reverse('site-list'), {'depth': 1})
+        enclosure = response.json()['results'][0]['enclosure_set'][0]
+        self.assertIn('code', enclosure)
+        self.assertNotIn('telescope_set', enclosure)
+        response = self.client.get(reverse('site-list'), {'depth': 0})
+        self.assertNotIn('enclosure_set', response.json()['results'][0])
+
+    def test_invalid_depth_is_rejected(self):
+        response = self.client.get(reverse('site-list'), {'depth': 'deep'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_default_is_not_added_when_excluded(self):
+        response = self.client.get(reverse('opticalelementgroup-list'), {'fields': 'name'})
+        self.assertEqual(set(response.json()['results'][0]), {'name'})
+
+    def test_prefetches_are_pruned(self):
+        url = reverse('instrument-list')
+        with CaptureQueriesContext(connection) as full_queries:
+            self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as sparse_queries:
+            self.client.get(url, {'fields': 'code,state'})
+        self.assertLess(len(sparse_queries), len(full_queries))
+        self.assertFalse(any('hardware_camera' in query['sql'] for query in sparse_queries))
+
+    def test_sparse_fieldsets_are_ignored_for_writes(self):
+        instrument = Instrument.objects.first()
+        self.client.force_login(mixer.blend(User))
+        response = self.client.patch(reverse('instrument-detail', args=(instrument.id,)) + '?fields=code',
+                                     json.dumps({'state': 'MANUAL'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('state', response.json())
+
+    def test_fast_serializers_match_with_sparse_fieldsets(self):
+        for params in ({'fields': 'code,instrument_type.mode_types'}, {'exclude': 'telescope,science_cameras'},
+                       {'depth': 1}):
+            with self.subTest(params=params):
+                url = reverse('instrument-list')
+                content = self.client.get(url, params).content
+                cache.clear()
+                fast_content = self.client.get(url, {**params, 'serializer': 'fast'}).content
+                cache.clear()
+                self.assertEqual(fast_content, content)
+
+
+class TestChangeNotifications(BaseHardwareTest):
+    def setUp(self):
+        super().setUp()
+        with reversion.create_revision():
+            self.instrument.save()
+        self.cursor = self.client.get(reverse('changes')).json()['cursor']
+
+    def change_instrument_state(self, *args):
+        with reversion.create_revision():
+            self.instrument.state = Instrument.MANUAL
+            self.instrument.save()
+
+    def test_wait_times_out_without_changes(self):
+        response = self.client.get(reverse('changes-wait'), {'since': self.cursor, 'timeout': 0})
+        self.assertEqual(response.json(), {'cursor': self.cursor, 'changes': []})
+
+    def test_wait_returns_changes_made_while_waiting(self):
+        with patch('configdb.hardware.changes.time.sleep', side_effect=self.change_instrument_state) as mock_sleep:
+            response = self.client.get(reverse('changes-wait'), {'since': self.cursor, 'timeout': 10})
+        self.assertEqual(mock_sleep.call_count, 1)
+        changes = response.json()['changes']
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['fields']['state'], Instrument.MANUAL)
+        self.assertNotEqual(response.json()['cursor'], self.cursor)
+
+    def test_wait_filters_by_model_and_site(self):
+        self.change_instrument_state()
+        url = reverse('changes-wait')
+        response = self.client.get(url, {'since': self.cursor, 'timeout': 0, 'model': 'telescope'})
+        # Changes that were filtered out still move the cursor along
+        self.assertEqual(response.json()['changes'], [])
+        self.assertNotEqual(response.json()['cursor'], self.cursor)
+        response = self.client.get(url, {'since': self.cursor, 'timeout': 0, 'model': ['telescope', 'instrument']})
+        self.assertEqual(len(response.json()['changes']), 1)
+        response = self.client.get(url, {'since': self.cursor, 'timeout': 0, 'site': 'tst'})
+        self.assertEqual(len(response.json()['changes']), 1)
+        response = self.client.get(url, {'since': self.cursor, 'timeout': 0, 'site': 'ts'})
+        self.assertEqual(response.json()['changes'], [])
+
+    def test_wait_rejects_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('changes-wait'), {'since': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('changes-wait'), {'timeout': 'nan'}).status_code, 400)
+
+    @override_settings(CHANGES_WAIT_TIMEOUT=0, CHANGES_STREAM_DURATION=0.5)
+    def test_stream_sends_changes_from_last_event_id(self):
+        self.change_instrument_state()
+        response = self.client.get(reverse('changes-stream'), HTTP_LAST_EVENT_ID=self.cursor)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [event.decode() for event in response.streaming_content]
+        self.assertEqual(events[0], f'id: {self.cursor}\nevent: cursor\ndata: {{"cursor": "{self.cursor}"}}\n\n')
+        event_id, event_type, data = events[1].strip().split('\n')
+        self.assertEqual(event_type, 'event: changes')
+        changes = json.loads(data[len('data: '):])
+        self.assertEqual(event_id, f'id: {changes["cursor"]}')
+        self.assertEqual(changes['changes'][0]['id'], self.instrument.id)
+
+    @override_settings(CHANGES_WAIT_TIMEOUT=0, CHANGES_STREAM_DURATION=0.5)
+    def test_stream_sends_keepalives_and_closes(self):
+        response = self.client.get(reverse('changes-stream'))
+        events = [event.decode() for event in response.streaming_content]
+        self.assertTrue(events[0].startswith('id: '))
+        self.assertTrue(all(event == ': keepalive\n\n' for event in events[1:]))
+
+
+class TestCapabilities(TestCase):
+    def setUp(self):
+        super().setUp()
+        generate_network({'sites': 1, 'enclosures': 1, 'telescopes': 1})
+        cache.clear()
+
+    def test_capabilities_rows(self):
+        response = self.client.get(reverse('capabilities'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        row = data['results'][0]
+        self.assertEqual(row['path'], 's00.dom0.1m00.1m00-s00-dom0-0')
+        self.assertEqual(row['instrument_type'], 'BENCH-IMAGER')
+        self.assertEqual(row['instrument_category'], 'IMAGE')
+        self.assertEqual(row['horizon'], 15)
+        self.assertEqual(row['optical_elements'], {'filters': ['f0', 'f1', 'f2', 'f3']})
+        self.assertEqual(row['modes']['readout'], ['default', 'fast'])
+
+    def test_capabilities_filters(self):
+        instrument = Instrument.objects.order_by('code').first()
+        instrument.state = Instrument.MANUAL
+        instrument.save()
+        url = reverse('capabilities')
+        self.assertEqual(self.client.get(url).json()['count'], 1)
+        self.assertEqual(self.client.get(url, {'state': ['MANUAL', 'SCHEDULABLE']}).json()['count'], 2)
+        self.assertEqual(self.client.get(url, {'site': 's00', 'state': 'MANUAL'}).json()['count'], 1)
+        self.assertEqual(self.client.get(url, {'site': 'xxx'}).json()['count'], 0)
+        self.assertEqual(self.client.get(url, {'instrument_type': 'BENCH-IMAGER'}).json()['count'], 1)
+        self.assertEqual(self.client.get(url, {'instrument_category': 'SPECTRA'}).json()['count'], 0)
+
+    def test_capabilities_use_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as small_network_queries:
+            self.client.get(reverse('capabilities'))
+        instrument = Instrument.objects.first()
+        for index in range(3):
+            camera = mixer.blend(Camera, camera_type=instrument.autoguider_camera.camera_type)
+            camera.optical_element_groups.add(*instrument.autoguider_camera.optical_element_groups.all())
+            mixer.blend(Instrument, code=f'extra{index}', telescope=instrument.telescope, state=Instrument.SCHEDULABLE,
+                        instrument_type=instrument.instrument_type, autoguider_camera=camera, science_cameras=[camera])
+        cache.clear()
+        with CaptureQueriesContext(connection) as large_network_queries:
+            self.client.get(reverse('capabilities'))
+        self.assertEqual(len(small_network_queries), len(large_network_queries))
+
+    def test_capabilities_are_cached_by_generation(self):
+        url = reverse('capabilities')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as cached_queries:
+            self.client.get(url)
+        self.assertEqual(len(cached_queries), 1)
+        telescope = Telescope.objects.first()
+        telescope.horizon = 20
+        telescope.save()
+        rows = self.client.get(url).json()['results']
+        self.assertEqual(rows[0]['horizon'], 20)
+
+
+class TestHistoricConfiguration(TestCase):
+    def setUp(self):
+        super().setUp()
+        with time_machine.travel('2024-01-01 00:00:00', tick=False):
+            with reversion.create_revision():
+                generate_network({'sites': 1, 'enclosures': 1})
+                # Objects created by the migrations are saved so they have a version too
+                for model in (ModeType, InstrumentCategory, ConfigurationType):
+                    for instance in model.objects.all():
+                        instance.save()
+        self.instrument = Instrument.objects.order_by('code').first()
+        with time_machine.travel('2024-01-02 00:00:00', tick=False):
+            with reversion.create_revision():
+                self.instrument.state = Instrument.MANUAL
+                self.instrument.save()
+        deleted_telescope = Telescope.objects.order_by('code').last()
+        self.deleted_telescope_id = deleted_telescope.id
+        with time_machine.travel('2024-01-03 00:00:00', tick=False):
+            deleted_telescope.delete()
+        cache.clear()
+
+    def _normalize(self, content):
+        # Lists without an ordering come back in whatever order the database returns them, so lists are compared sorted
+        def normalize(data):
+            if isinstance(data, dict):
+                return {key: normalize(value) for key, value in data.items()}
+            if isinstance(data, list):
+                return sorted((normalize(value) for value in data), key=lambda value: json.dumps(value, sort_keys=True))
+            return data
+        return normalize(json.loads(content))
+
+    def test_as_of_now_matches_current_configuration(self):
+        endpoints = ['site', 'enclosure', 'telescope', 'instrument', 'camera', 'instrumenttype', 'opticalelementgroup',
+                     'opticalelement', 'genericmodegroup', 'genericmode', 'modetype', 'configurationtype']
+        for name, url in get_benchmark_urls():
+            if name.rsplit('-', 1)[0] in endpoints and (name.endswith('-list') or name.endswith('-detail')):
+                with self.subTest(endpoint=name):
+                    for params in ({}, {'serializer': 'fast'}):
+                        content = self.client.get(url, params).content
+                        cache.clear()
+                        historic_content = self.client.get(url, {**params, 'as_of': '2024-01-04T00:00:00Z'}).content
+                        self.assertEqual(self._normalize(historic_content), self._normalize(content))
+
+    def test_as_of_before_a_change(self):
+        response = self.client.get(reverse('instrument-detail', args=(self.instrument.id,)),
+                                   {'as_of': '2024-01-01T12:00:00Z'})
+        self.assertEqual(response.json()['state'], Instrument.SCHEDULABLE)
+        response = self.client.get(reverse('instrument-detail', args=(self.instrument.id,)),
+                                   {'as_of': '2024-01-02T12:00:00'})
+        self.assertEqual(response.json()['state'], Instrument.MANUAL)
+
+    def test_deleted_objects_are_included_before_deletion(self):
+        response = self.client.get(reverse('telescope-list'), {'as_of': '2024-01-02T12:00:00Z'})
+        self.assertEqual(response.json()['count'], 2)
+        telescope = next(result for result in response.json()['results'] if result['id'] == self.deleted_telescope_id)
+        self.assertEqual(len(telescope['instrument_set']), 2)
+        response = self.client.get(reverse('telescope-list'), {'as_of': '2024-01-03T12:00:00Z'})
+        self.assertEqual(response.json()['count'], 1)
+        response = self.client.get(reverse('telescope-detail', args=(self.deleted_telescope_id,)),
+                                   {'as_of': '2024-01-03T12:00:00Z'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_objects_deleted_before_deletions_were_recorded_are_left_out(self):
+        DeletionRecord.objects.all().delete()
+        response = self.client.get(reverse('telescope-list'), {'as_of': '2024-01-02T12:00:00Z'})
+        self.assertEqual(response.json()['count'], 1)
+        self.assertNotEqual(response.json()['results'][0]['id'], self.deleted_telescope_id)
+        response = self.client.get(reverse('instrument-list'), {'as_of': '2024-01-02T12:00:00Z'})
+        self.assertEqual(response.json()['count'], Instrument.objects.count())
+
+    def test_as_of_before_any_revision_is_empty(self):
+        response = self.client.get(reverse('site-list'), {'as_of': '2023-01-01T00:00:00Z'})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_reconstructions_are_reused_within_a_window(self):
+        url = reverse('site-list')
+        self.client.get(url, {'as_of': '2024-01-02T06:00:00Z'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'as_of': '2024-01-02T18:00:00Z', 'fields': 'code,enclosure_set.code'})
+        self.assertEqual(response.json()['results'][0]['enclosure_set'][0], {'code': 'dom0'})
+        self.assertFalse(any('reversion_version' in query['sql'] for query in queries))
+
+    def test_invalid_as_of_parameters_are_rejected(self):
+        response = self.client.get(reverse('site-list'), {'as_of': 'yesterday-ish'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('site-list'), {'as_of': '2024-01-02T00:00:00Z', 'code': 's00'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestHistoricUnversionedParents(BaseHardwareTest):
+    def setUp(self):
+        super().setUp()
+        # Only the instrument has a version, as when its parents were saved before they were versioned
+        with time_machine.travel('2024-01-01 00:00:00', tick=False):
+            with reversion.create_revision():
+                self.instrument.save()
+        cache.clear()
+
+    def test_parents_without_a_version_are_taken_as_they_are_now(self):
+        response = self.client.get(reverse('instrument-list'), {'as_of': '2024-01-02T00:00:00Z'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response.json()['results'][0]['__str__'], 'tst.doma.1m0a.myInst01')
+        response = self.client.get(reverse('telescope-list'), {'as_of': '2024-01-02T00:00:00Z'})
+        self.assertEqual([telescope['code'] for telescope in response.json()['results']], ['1m0a'])
+
+    def test_objects_whose_parents_no_longer_exist_are_left_out(self):
+        with time_machine.travel('2024-01-03 00:00:00', tick=False):
+            self.telescope.delete()
+        response = self.client.get(reverse('instrument-list'), {'as_of': '2024-01-02T00:00:00Z'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
+
+
+class TestConfigurationDiff(BaseHardwareTest):
+    def setUp(self):
+        super().setUp()
+        with time_machine.travel('2024-01-01 00:00:00', tick=False):
+            with reversion.create_revision():
+                self.instrument.save()
+                self.telescope.save()
+        self.cursor = self.client.get(reverse('changes')).json()['cursor']
+        with time_machine.travel('2024-01-02 00:00:00', tick=False):
+            with reversion.create_revision():
+                self.instrument.state = Instrument.MANUAL
+                self.instrument.save()
+                self.telescope.save()
+                self.new_telescope = mixer.blend(Telescope, enclosure=self.enclosure, code='2m0a')
+        with time_machine.travel('2024-01-03 00:00:00', tick=False):
+            with reversion.create_revision():
+                temporary_telescope = mixer.blend(Telescope, enclosure=self.enclosure, code='0m4a')
+            temporary_telescope.delete()
+
+    def test_diff_between_timestamps(self):
+        response = self.client.get(reverse('diff'), {'from': '2024-01-01T12:00:00Z', 'to': '2024-01-02T12:00:00Z'})
+        diff = response.json()
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual([added['label'] for added in diff['added']], [str(self.new_telescope)])
+        # The telescope was saved without changes, so only the instrument changed
+        self.assertEqual(len(diff['changed']), 1)
+        self.assertEqual(diff['changed'][0]['label'], str(self.instrument))
+        self.assertEqual(diff['changed'][0]['fields'], {'state': {'from': 'SCHEDULABLE', 'to': 'MANUAL'}})
+
+    def test_diff_from_cursor_to_now(self):
+        diff = self.client.get(reverse('diff'), {'from': self.cursor}).json()
+        # The telescope created and deleted after the cursor did not exist at either end
+        self.assertEqual(len(diff['added']), 1)
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual(diff['to'], self.client.get(reverse('changes')).json()['cursor'])
+
+    def test_removed_objects(self):
+        with time_machine.travel('2024-01-04 00:00:00', tick=False):
+            self.new_telescope.delete()
+        diff = self.client.get(reverse('diff'), {'from': '2024-01-02T12:00:00Z'}).json()
+        self.assertEqual([removed['model'] for removed in diff['removed']], ['telescope'])
+        self.assertEqual(diff['added'], [])
+
+    def test_objects_are_identified_by_id_not_label(self):
+        # The label of a group is made of the codes of its members, so it changes when they do
+        with time_machine.travel('2024-01-04 00:00:00', tick=False):
+            with reversion.create_revision():
+                optical_elements = mixer.cycle(2).blend(OpticalElement)
+                group = mixer.blend(OpticalElementGroup, optical_elements=optical_elements[:1], type='filters')
+        cursor = self.client.get(reverse('changes')).json()['cursor']
+        with time_machine.travel('2024-01-05 00:00:00', tick=False):
+            with reversion.create_revision():
+                group.optical_elements.add(optical_elements[1])
+                group.save()
+        diff = self.client.get(reverse('diff'), {'from': cursor}).json()
+        self.assertEqual(diff['added'], [])
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual([(changed['model'], changed['id'], changed['label']) for changed in diff['changed']],
+                         [('opticalelementgroup', group.id, str(group))])
+        self.assertEqual(set(diff['changed'][0]['fields']['optical_elements']['to']),
+                         {optical_element.id for optical_element in optical_elements})
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('diff')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('diff'), {'from': 'whenever'}).status_code, 400)
+        response = self.client.get(reverse('diff'), {'from': '2024-01-03T00:00:00Z', 'to': '2024-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_diff_command(self):
+        out = StringIO()
+        call_command('diff_configuration', '--from', '2024-01-01T12:00:00Z', '--to', '2024-01-02T12:00:00Z', stdout=out)
+        diff = json.loads(out.getvalue())
+        self.assertEqual(len(diff['changed']), 1)
+        self.assertEqual(len(diff['added']), 1)
+
+
+class TestNetworkDocuments(TestCase):
+    telescope_fields = {'serial_number': '1', 'lat': 30.0, 'long': -100.0, 'horizon': 15.0, 'ha_limit_neg': -4.6,
+                        'ha_limit_pos': 4.6}
+
+    def setUp(self):
+        self.user = mixer.blend(User)
+        self.client.force_login(self.user)
+        self.document = {
+            'sites': [{
+                'code': 'tst',
+                'name': 'Test Site',
+                'elevation': 2000,
+                'timezone': -7,
+                'enclosures': [{
+                    'code': 'doma',
+                    'telescopes': [{
+                        'code': '1m0a',
+                        'aperture': 1.0,
+                        **self.telescope_fields,
+                        'instruments': [{
+                            'code': 'fa01',
+                            'state': Instrument.SCHEDULABLE,
+                            'instrument_type': {
+                                'code': '1M0-SCICAM-SINISTRO',
+                                'name': 'Sinistro',
+                                'instrument_category': 'IMAGE',
+                                'configuration_types': [{
+                                    'configuration_type': {'code': 'EXPOSE', 'name': 'Expose'},
+                                    'config_change_overhead': 2.0
+                                }],
+                                'mode_types': [{
+                                    'type': 'readout',
+                                    'default': 'full',
+                                    'modes': [
+                                        {'code': 'full', 'name': 'Full Frame', 'overhead': 10},
+                                        {'code': 'central', 'name': 'Central 2k', 'overhead': 5}
+                                    ]
+                                }]
+                            },
+                            'science_cameras': [{
+                                'code': 'fa01',
+                                'camera_type': {'code': '1m0-SciCam-Sinistro', 'name': 'Sinistro', 'size': '26x26',
+                                                'pscale': 0.389},
+                                'optical_element_groups': [{
+                                    'name': 'sinistro-filters',
+                                    'type': 'filters',
+                                    'default': 'rp',
+                                    'optical_elements': [{'code': 'rp', 'name': 'SDSS rp'},
+                                                         {'code': 'gp', 'name': 'SDSS gp'}]
+                                }]
+                            }],
+                            'autoguider_camera': 'fa01'
+                        }]
+                    }]
+                }]
+            }]
+        }
+
+    def post(self, document, **params):
+        url = reverse('network')
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, data=json.dumps(document), content_type='application/json')
+
+    def test_nested_document_creates_the_network(self):
+        response = self.post(self.document)
+        self.assertEqual(response.status_code, 200)
+        instrument = Instrument.objects.get(code='fa01')
+        self.assertEqual(str(instrument), 'tst.doma.1m0a.fa01')
+        self.assertEqual(instrument.state, Instrument.SCHEDULABLE)
+        self.assertEqual(instrument.telescope.aperture, 1.0)
+        self.assertEqual(instrument.autoguider_camera.code, 'fa01')
+        self.assertEqual(instrument.instrument_type.instrument_category_id, 'IMAGE')
+        camera = instrument.science_cameras.get()
+        group = camera.optical_element_groups.get()
+        self.assertEqual(group.default.code, 'rp')
+        self.assertEqual(sorted(group.optical_elements.values_list('code', flat=True)), ['gp', 'rp'])
+        mode_group = instrument.instrument_type.mode_types.get()
+        self.assertEqual(mode_group.type_id, 'readout')
+        self.assertEqual(mode_group.default.code, 'full')
+        self.assertEqual(mode_group.modes.count(), 2)
+        properties = ConfigurationTypeProperties.objects.get()
+        self.assertEqual(properties.configuration_type_id, 'EXPOSE')
+        self.assertEqual(properties.config_change_overhead, 2.0)
+        actions = {(change['component'], change['action']) for change in response.json()['changes']}
+        self.assertIn(('instruments', 'create'), actions)
+
+    def test_document_is_applied_in_a_single_revision(self):
+        generation = ConfigurationGeneration.current().generation
+        self.post(self.document)
+        self.assertEqual(reversion.models.Revision.objects.count(), 1)
+        revision = reversion.models.Revision.objects.get()
+        self.assertEqual(revision.version_set.count(), 16)
+        self.assertEqual(ConfigurationGeneration.current().generation, generation + 1)
+
+    def test_versions_record_many_to_many_links(self):
+        self.post(self.document)
+        instrument = Version.objects.get_for_model(Instrument).get()
+        camera = Version.objects.get_for_model(Camera).get()
+        group = Version.objects.get_for_model(OpticalElementGroup).get()
+        self.assertEqual(instrument.field_dict['science_cameras'], [Camera.objects.get().pk])
+        self.assertEqual(camera.field_dict['optical_element_groups'], [OpticalElementGroup.objects.get().pk])
+        self.assertEqual(sorted(group.field_dict['optical_elements']), sorted(OpticalElement.objects.values_list('pk', flat=True)))
+        self.assertEqual(group.object_repr, str(OpticalElementGroup.objects.get()))
+
+    def test_groups_sharing_a_name_are_only_refused_when_touched(self):
+        self.post(self.document)
+        camera_type = CameraType.objects.get()
+        for code in ('fa02', 'fa03'):
+            group = mixer.blend(OpticalElementGroup, name='wheel', type='filters', default=None)
+            mixer.blend(Camera, code=code, camera_type=camera_type, optical_element_groups=[group])
+        self.assertEqual(self.post(self.document).json()['changes'], [])
+        self.assertEqual([group['name'] for group in export_network()['optical_element_groups']],
+                         ['sinistro-filters', 'wheel'])
+        response = self.post({'optical_element_groups': [{'name': 'wheel', 'element_change_overhead': 5}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('more than one object in the database is identified by wheel', response.json()['errors'][0])
+        response = self.post({'cameras': [{'code': 'fa04', 'camera_type': '1m0-SciCam-Sinistro',
+                                           'optical_element_groups': ['wheel']}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('more than one optical_element_groups in the database is identified by wheel',
+                      response.json()['errors'][0])
+        self.assertEqual(self.post(self.document, prune='true').status_code, 400)
+        self.assertEqual(OpticalElementGroup.objects.filter(name='wheel').count(), 2)
+
+    def test_document_is_applied_with_bulk_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.document)
+        document = self.document
+        document['sites'][0]['enclosures'][0]['telescopes'][0]['instruments'] += [
+            {'code': f'fa{index:02}', 'instrument_type': '1M0-SCICAM-SINISTRO', 'science_cameras': ['fa01'],
+             'autoguider_camera': 'fa01'}
+            for index in range(2, 12)
+        ]
+        with CaptureQueriesContext(connection) as large:
+            self.post(document)
+        self.assertEqual(Instrument.objects.count(), 11)
+        self.assertLessEqual(len(large), len(small))
+
+    def test_applying_an_unchanged_document_changes_nothing(self):
+        self.post(self.document)
+        modified = Instrument.objects.get().modified
+        generation = ConfigurationGeneration.current().generation
+        response = self.post(self.document)
+        self.assertEqual(response.json()['changes'], [])
+        self.assertEqual(reversion.models.Revision.objects.count(), 1)
+        self.assertEqual(ConfigurationGeneration.current().generation, generation)
+        self.assertEqual(Instrument.objects.get().modified, modified)
+
+    def test_update_only_changes_the_given_fields(self):
+        self.post(self.document)
+        response = self.post({'instruments': [{'telescope': 'tst.doma.1m0a', 'code': 'fa01', 'state': 'MANUAL'}]})
+        changes = response.json()['changes']
+        self.assertEqual(changes, [{
+            'action': 'update', 'component': 'instruments', 'key': 'tst.doma.1m0a.fa01',
+            'changes': {'state': {'from': 'SCHEDULABLE', 'to': 'MANUAL'}}
+        }])
+        instrument = Instrument.objects.get()
+        self.assertEqual(instrument.state, Instrument.MANUAL)
+        self.assertEqual(instrument.science_cameras.count(), 1)
+
+    def test_dry_run_does_not_change_anything(self):
+        response = self.post(self.document, dry_run='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['changes'])
+        self.assertFalse(Site.objects.exists())
+        self.assertFalse(reversion.models.Revision.objects.exists())
+
+    def test_prune_deletes_objects_not_in_the_document(self):
+        self.post(self.document)
+        telescopes = self.document['sites'][0]['enclosures'][0]['telescopes']
+        telescopes.append({'code': '0m4a', **self.telescope_fields})
+        self.post(self.document)
+        self.assertEqual(Telescope.objects.count(), 2)
+        telescopes.pop()
+        response = self.post(self.document, prune='true')
+        self.assertEqual(
+            [(change['action'], change['key']) for change in response.json()['changes']], [('delete', 'tst.doma.0m4a')]
+        )
+        self.assertEqual(Telescope.objects.count(), 1)
+
+    def test_invalid_documents_are_rejected_with_every_error(self):
+        document = {
+            'sites': [{'code': 'tst', 'lat': 'north'}],
+            'telescopes': [{'code': '1m0a', 'enclosure': 'tst.missing'}],
+            'instruments': [{'code': 'fa01', 'telescope': 'tst.doma.1m0a', 'colour': 'blue'}],
+        }
+        response = self.post(document)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(any('lat' in error for error in errors))
+        self.assertTrue(any('colour' in error for error in errors))
+        response = self.post({'telescopes': [{'code': '1m0a', 'enclosure': 'tst.missing'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tst.missing is not a known enclosures', response.json()['errors'][0])
+        self.assertFalse(Telescope.objects.exists())
+
+    def test_anonymous_users_cannot_apply_documents(self):
+        self.client.logout()
+        self.assertEqual(self.post(self.document).status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertFalse(Site.objects.exists())
+
+    @override_settings(HEROIC_API_URL='http://fake', HEROIC_API_TOKEN='123fake', HEROIC_OBSERVATORY='tst')
+    @patch('configdb.hardware.heroic.send_to_heroic', wraps=send_to_heroic)
+    def test_heroic_updates_are_sent_once(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post(self.document)
+        endpoints = [call.args[0] for call in mock_send.call_args_list]
+        self.assertEqual(endpoints.count('sites/'), 1)
+        self.assertEqual(endpoints.count('telescopes/'), 1)
+        self.assertEqual(endpoints.count('instruments/'), 1)
+        self.assertEqual(endpoints.count('instrument-capabilities/'), 1)
+
+
+class TestNetworkCommands(TestCase):
+    def setUp(self):
+        generate_network({'sites': 2, 'enclosures': 1, 'telescopes': 2, 'instruments': 2})
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'network.yaml')
+        call_command('export_network', '--output', self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def apply(self, *args):
+        out = StringIO()
+        call_command('apply_network', self.path, *args, stdout=out)
+        return out.getvalue()
+
+    def edit_document(self, edit):
+        with open(self.path) as document_file:
+            document = yaml.safe_load(document_file)
+        edit(document)
+        with open(self.path, 'w') as document_file:
+            yaml.safe_dump(document, document_file)
+
+    def test_export_is_canonical(self):
+        out = StringIO()
+        call_command('export_network', '--format', 'json', stdout=out)
+        document = json.loads(out.getvalue())
+        self.assertEqual(export_network(), document)
+        with open(self.path) as document_file:
+            self.assertEqual(yaml.safe_load(document_file), document)
+        self.assertEqual([site['code'] for site in document['sites']], ['s00', 's01'])
+        instrument = document['sites'][0]['enclosures'][0]['telescopes'][0]['instruments'][0]
+        self.assertEqual(instrument['instrument_type'], 'BENCH-IMAGER')
+        self.assertNotIn('telescope', instrument)
+
+    def test_applying_an_exported_document_touches_nothing(self):
+        generation = ConfigurationGeneration.current().generation
+        revisions = reversion.models.Revision.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            out = self.apply()
+        self.assertIn('already matches', out)
+        self.assertEqual(ConfigurationGeneration.current().generation, generation)
+        self.assertEqual(reversion.models.Revision.objects.count(), revisions)
+        # The configuration is loaded with one query per model and many to many field, and nothing is written
+        self.assertLessEqual(len(queries), len(COMPONENTS) + 6)
+        self.assertFalse(any(query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) for query in queries))
+
+    def test_dry_run_prints_the_plan(self):
+        def edit(document):
+            document['sites'][0]['enclosures'][0]['telescopes'][0]['instruments'][0]['state'] = 'MANUAL'
+            document['sites'][0]['name'] = 'Renamed'
+        self.edit_document(edit)
+        out = self.apply('--dry-run')
+        self.assertIn('~ sites s00\n    name: Site 0 -> Renamed', out)
+        self.assertIn('state: SCHEDULABLE -> MANUAL', out)
+        self.assertIn('would create 0, update 2 and delete 0 objects', out)
+        self.assertFalse(Site.objects.filter(name='Renamed').exists())
+        self.apply()
+        self.assertTrue(Site.objects.filter(name='Renamed').exists())
+        self.assertEqual(Instrument.objects.filter(state=Instrument.MANUAL).count(), 1)
+
+    def test_prune_deletes_what_was_removed_from_the_document(self):
+        def edit(document):
+            document['sites'][1]['enclosures'][0]['telescopes'].pop()
+        self.edit_document(edit)
+        self.assertIn('delete 0 objects', self.apply('--dry-run'))
+        out = self.apply('--prune')
+        self.assertIn('- telescopes s01.dom0.1m01', out)
+        self.assertEqual(Telescope.objects.count(), 3)
+        self.assertEqual(Instrument.objects.count(), 6)
+
+    def test_invalid_documents_raise_command_errors(self):
+        self.edit_document(lambda document: document['sites'][0].update({'elevation': 'high'}))
+        with self.assertRaisesRegex(CommandError, 'sites\\[0\\].elevation'):
+            self.apply()
+        with self.assertRaises(CommandError):
+            call_command('apply_network', os.path.join(self.directory.name, 'missing.yaml'))
+
+
+class TestValidatorRegistry(TestCase):
+    def setUp(self):
+        validator_registry.clear()
+        self.schema = {'exposure_count': {'type': 'integer', 'min': 1, 'label': 'Exposures', 'show': True}}
+
+    def test_validate_returns_errors_and_normalized_document(self):
+        validator = validator_registry.for_schema(self.schema)
+        self.assertEqual(validator.validate({'exposure_count': 2}), (True, {}, {'exposure_count': 2}))
+        valid, errors, _ = validator.validate({'exposure_count': 0})
+        self.assertFalse(valid)
+        self.assertIn('exposure_count', errors)
+
+    def test_submitted_schemas_are_checked_without_being_cached(self):
+        check_schema(self.schema)
+        with self.assertRaises(SchemaError):
+            check_schema({'a': {'type': 'not a type'}})
+        serializer = GenericModeSerializer(data={'name': 'Full', 'code': 'full', 'validation_schema': self.schema})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(len(validator_registry._validators), 0)
+
+    def test_equal_schemas_share_a_validator(self):
+        reordered = {'b': {'type': 'string'}, 'a': {'type': 'integer'}}
+        validator = validator_registry.for_schema({'a': {'type': 'integer'}, 'b': {'type': 'string'}})
+        self.assertIs(validator_registry.for_schema(reordered), validator)
+
+    def test_least_recently_used_validators_are_dropped(self):
+        registry = ValidatorRegistry(size=2)
+        first = registry.for_schema({'a': {'type': 'integer'}})
+        registry.for_schema({'b': {'type': 'integer'}})
+        registry.for_schema({'a': {'type': 'integer'}})
+        registry.for_schema({'c': {'type': 'integer'}})
+        self.assertIs(registry.for_schema({'a': {'type': 'integer'}}), first)
+        self.assertEqual(len(registry._validators), 2)
+
+    def test_invalid_schemas_are_not_cached(self):
+        with self.assertRaises(SchemaError):
+            validator_registry.for_schema({'a': {'type': 'not a type'}})
+        self.assertEqual(len(validator_registry._validators), 0)
+
+
+class BaseSchemaTest(TestCase):
+    def setUp(self):
+        validator_registry.clear()
+        self.instrument_type = mixer.blend(InstrumentType, code='1M0-SCICAM-SINISTRO', validation_schema={
+            'exposure_time': {'type': 'float', 'min': 0, 'required': True},
+            'extra_params': {'type': 'dict', 'schema': {'defocus': {'type': 'float', 'min': -3, 'max': 3}}}
+        })
+        configuration_type = mixer.blend(ConfigurationType, code='EXPOSE')
+        mixer.blend(ConfigurationTypeProperties, instrument_type=self.instrument_type,
+                    configuration_type=configuration_type,
+                    validation_schema={'exposure_count': {'type': 'integer', 'min': 1, 'default': 1}})
+        full = mixer.blend(GenericMode, code='full', validation_schema={
+            'extra_params': {'type': 'dict', 'schema': {'bin_x': {'type': 'integer', 'allowed': [1]}}}
+        })
+        central = mixer.blend(GenericMode, code='central', validation_schema={
+            'extra_params': {'type': 'dict', 'schema': {'bin_x': {'type': 'integer', 'allowed': [2]}}}
+        })
+        mixer.blend(GenericModeGroup, instrument_type=self.instrument_type, type=ModeType.objects.get(id='readout'),
+                    modes=[full, central], default=full)
+        self.item = {
+            'instrument_type': '1M0-SCICAM-SINISTRO',
+            'configuration_type': 'EXPOSE',
+            'modes': {'readout': 'full'},
+            'instrument_config': {
+                'exposure_time': 30.0,
+                'exposure_count': 2,
+                'mode': 'full',
+                'rotator_mode': '',
+                'optical_elements': {'filter': 'rp'},
+                'extra_params': {'bin_x': 1, 'bin_y': 1, 'defocus': 1.0}
+            }
+        }
+
+    def validate(self, items):
+        return self.client.post(reverse('validate'), data=json.dumps(items), content_type='application/json')
+
+
+class TestInstrumentConfigValidation(BaseSchemaTest):
+    def test_schemas_are_deep_merged(self):
+        merged = merge_schemas(
+            {'a': {'type': 'dict', 'schema': {'b': {'type': 'integer', 'min': 1}}}, 'c': {'type': 'string'}},
+            {'a': {'schema': {'b': {'min': 2}, 'd': {'type': 'float'}}}, 'c': {'type': 'integer'}}
+        )
+        self.assertEqual(merged, {
+            'a': {'type': 'dict', 'schema': {'b': {'type': 'integer', 'min': 2}, 'd': {'type': 'float'}}},
+            'c': {'type': 'integer'}
+        })
+
+    def test_valid_instrument_config_is_normalized(self):
+        instrument_config = {name: value for name, value in self.item['instrument_config'].items()
+                             if name != 'exposure_count'}
+        response = self.validate([{**self.item, 'instrument_config': instrument_config}])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['valid'])
+        result = response.json()['results'][0]
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(result['instrument_config']['exposure_count'], 1)
+        # Fields the schemas do not cover are kept as they are
+        self.assertEqual(result['instrument_config']['optical_elements'], {'filter': 'rp'})
+        self.assertEqual(result['instrument_config']['extra_params']['bin_y'], 1)
+
+    def test_every_item_gets_its_own_errors(self):
+        central = {**self.item, 'modes': {'readout': 'central'}}
+        invalid = {**self.item, 'instrument_config': {
+            **self.item['instrument_config'], 'exposure_time': -1, 'extra_params': {'bin_x': 1, 'defocus': 5.0}
+        }}
+        response = self.validate([self.item, central, invalid])
+        self.assertFalse(response.json()['valid'])
+        results = response.json()['results']
+        self.assertEqual([result['valid'] for result in results], [True, False, False])
+        self.assertIn('bin_x', results[1]['errors']['extra_params'][0])
+        self.assertEqual(set(results[2]['errors']), {'exposure_time', 'extra_params'})
+        self.assertIsNone(results[2]['instrument_config'])
+
+    def test_unknown_combinations_are_errors(self):
+        response = self.validate([
+            {**self.item, 'instrument_type': 'MISSING'},
+            {**self.item, 'configuration_type': 'SPECTRUM'},
+            {**self.item, 'modes': {'readout': 'missing', 'guiding': 'on'}},
+            {'instrument_type': '1M0-SCICAM-SINISTRO'},
+            'not an item',
+        ])
+        results = response.json()['results']
+        self.assertEqual(list(results[0]['errors']), ['instrument_type'])
+        self.assertEqual(list(results[1]['errors']), ['configuration_type'])
+        self.assertEqual(len(results[2]['errors']['modes']), 2)
+        self.assertEqual(list(results[3]['errors']), ['instrument_config'])
+        self.assertEqual(list(results[4]['errors']), ['non_field_errors'])
+
+    def test_schemas_are_merged_and_compiled_once_per_combination(self):
+        with CaptureQueriesContext(connection) as small:
+            self.validate([self.item])
+        items = [self.item, {**self.item, 'modes': {'readout': 'central'}}] * 500
+        with patch('configdb.hardware.schemas.build_schema', wraps=build_schema) as mock_build:
+            with CaptureQueriesContext(connection) as large:
+                response = self.validate(items)
+        self.assertEqual(len(response.json()['results']), 1000)
+        self.assertEqual(len(large), len(small))
+        # The schema of the full readout mode was already merged for the first request
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertEqual(len(validator_registry._validators), 2)
+
+    def test_validation_does_not_need_authentication(self):
+        self.assertEqual(self.validate([self.item]).status_code, 200)
+        response = self.client.post(reverse('validate'), data=json.dumps(self.item), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestMergedSchemas(BaseSchemaTest):
+    def get_schemas(self, **params):
+        return self.client.get(reverse('schemas'), params)
+
+    def test_schema_of_a_combination(self):
+        response = self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO', configuration_type='EXPOSE', mode='readout:full')
+        self.assertEqual(response.status_code, 200)
+        schema = response.json()['schema']
+        self.assertEqual(set(schema), {'exposure_time', 'extra_params', 'exposure_count'})
+        self.assertEqual(set(schema['extra_params']['schema']), {'defocus', 'bin_x'})
+        self.assertEqual(response.json()['modes'], {'readout': 'full'})
+
+    def test_schemas_of_every_combination(self):
+        response = self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO')
+        results = response.json()['results']
+        self.assertEqual([(result['configuration_type'], result['modes']) for result in results],
+                         [('EXPOSE', {'readout': 'central'}), ('EXPOSE', {'readout': 'full'})])
+        self.assertEqual(results[0]['schema']['extra_params']['schema']['bin_x']['allowed'], [2])
+
+    def test_etag_changes_when_a_contributing_object_changes(self):
+        response = self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO', mode='readout:full')
+        etag = response['ETag']
+        response = self.client.get(reverse('schemas'), {'instrument_type': '1M0-SCICAM-SINISTRO', 'mode': 'readout:full'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Changing a mode that is not part of the combination keeps the etag
+        central = GenericMode.objects.get(code='central')
+        central.validation_schema = {}
+        central.save()
+        response = self.client.get(reverse('schemas'), {'instrument_type': '1M0-SCICAM-SINISTRO', 'mode': 'readout:full'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        full = GenericMode.objects.get(code='full')
+        full.validation_schema = {'extra_params': {'type': 'dict', 'schema': {'bin_x': {'allowed': [1, 2]}}}}
+        full.save()
+        response = self.client.get(reverse('schemas'), {'instrument_type': '1M0-SCICAM-SINISTRO', 'mode': 'readout:full'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['schema']['extra_params']['schema']['bin_x'], {'allowed': [1, 2]})
+
+    def test_schemas_are_only_conditional_on_the_etag(self):
+        # A source can be replaced by one modified earlier, so a last modified time could go backwards
+        response = self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO')
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get(reverse('schemas'), {'instrument_type': '1M0-SCICAM-SINISTRO'},
+                                   HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_merged_schemas_are_cached(self):
+        self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO')
+        with patch('configdb.hardware.schemas.build_schema', wraps=build_schema) as mock_build:
+            self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO')
+            self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO', configuration_type='EXPOSE', mode='readout:full')
+            self.validate([self.item])
+        mock_build.assert_not_called()
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get_schemas().status_code, 400)
+        self.assertEqual(self.get_schemas(instrument_type='MISSING').status_code, 404)
+        response = self.get_schemas(instrument_type='1M0-SCICAM-SINISTRO', mode='readout:missing')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('modes', response.json()['errors'])
+
+
+class TestDurations(TestCase):
+    def setUp(self):
+        super().setUp()
+        generate_network({'sites': 1, 'enclosures': 1, 'telescopes': 1})
+        InstrumentType.objects.update(fixed_overhead_per_exposure=2, observation_front_padding=90,
+                                      config_front_padding=10, acquire_exposure_time=30)
+        ConfigurationTypeProperties.objects.update(config_change_overhead=5)
+        GenericMode.objects.filter(code='fast').update(overhead=1)
+        GenericMode.objects.filter(code='WCS').update(overhead=20)
+        OpticalElementGroup.objects.update(element_change_overhead=3)
+        Telescope.objects.update(telescope_front_padding=60, slew_rate=0.01, minimum_slew_overhead=2)
+        cache.clear()
+        self.request = {
+            'telescope': 's00.dom0.1m00',
+            'configurations': [{
+                'instrument_type': 'BENCH-IMAGER',
+                'type': 'EXPOSE',
+                'acquisition_mode': 'WCS',
+                'instrument_configs': [
+                    {'exposure_time': 10, 'exposure_count': 2, 'mode': 'fast', 'optical_elements': {'filters': 'f0'}},
+                    {'exposure_time': 5, 'mode': 'default', 'optical_elements': {'filters': 'f1'}}
+                ]
+            }]
+        }
+
+    def estimate(self, requests):
+        return self.client.post(reverse('durations'), data=json.dumps(requests), content_type='application/json')
+
+    def test_request_duration(self):
+        response = self.estimate([self.request])
+        self.assertEqual(response.status_code, 200)
+        # Exposures 2 * (10 + 2 + 1) and 5 + 2 with a filter change of 3, then front padding, configuration type
+        # and acquisition overheads, then the telescope and observation front paddings
+        self.assertEqual(response.json()['results'], [{'duration': 251.0, 'configurations': [101.0]}])
+
+    def test_optical_elements_are_named_by_singular_or_plural_group_type(self):
+        singular = json.loads(json.dumps(self.request).replace('"filters"', '"filter"'))
+        self.assertEqual(self.estimate([singular]).json()['results'][0]['duration'], 251.0)
+        unknown = json.loads(json.dumps(self.request).replace('"filters"', '"filtre"'))
+        errors = self.estimate([unknown]).json()['results'][0]['errors']
+        self.assertEqual(errors['configurations[0].instrument_configs[0].optical_elements'],
+                         ['Unknown optical element type filtre'])
+
+    def test_slews_between_targets(self):
+        configuration = {
+            'instrument_type': 'BENCH-IMAGER', 'type': 'EXPOSE', 'target': {'ra': 10.0, 'dec': 0.0},
+            'instrument_configs': [{'exposure_time': 10}]
+        }
+        request = {'configurations': [configuration, {**configuration, 'target': {'ra': 11.0, 'dec': 0.0}}]}
+        tables = build_overhead_tables()
+        result = compute_durations([request], tables)[0]
+        self.assertEqual(result['configurations'], [27.0, 27.0])
+        # A one degree slew at 0.01 seconds per arcsecond
+        self.assertAlmostEqual(result['duration'], 60 + 90 + 27 + 27 + 36)
+
+    def test_errors_are_returned_per_request(self):
+        unknown = {'configurations': [{'instrument_type': 'UNKNOWN', 'type': 'EXPOSE',
+                                       'instrument_configs': [{'exposure_time': 1}]}]}
+        bad_mode = json.loads(json.dumps(self.request))
+        bad_mode['configurations'][0]['instrument_configs'][0]['mode'] = 'slow'
+        bad_mode['configurations'][0]['instrument_configs'][1]['exposure_time'] = -1
+        results = self.estimate([unknown, self.request, bad_mode]).json()['results']
+        self.assertIn('configurations[0].instrument_type', results[0]['errors'])
+        self.assertEqual(results[1]['duration'], 251.0)
+        self.assertEqual(set(results[2]['errors']), {
+            'configurations[0].instrument_configs[0].mode', 'configurations[0].instrument_configs[1].exposure_time'
+        })
+        self.assertEqual(self.estimate({}).status_code, 400)
+
+    def test_overhead_tables_are_cached_by_generation(self):
+        with CaptureQueriesContext(connection) as uncached_queries:
+            self.estimate([self.request])
+        with CaptureQueriesContext(connection) as cached_queries:
+            response = self.estimate([self.request] * 100)
+        # Only the configuration generation is read once the tables are cached
+        self.assertLess(len(cached_queries), len(uncached_queries))
+        self.assertFalse(any('hardware_instrumenttype' in query['sql'] for query in cached_queries.captured_queries))
+        self.assertEqual(len(response.json()['results']), 100)
+        telescope = Telescope.objects.first()
+        telescope.telescope_front_padding = 0
+        telescope.save()
+        self.assertEqual(self.estimate([self.request]).json()['results'][0]['duration'], 191.0)
+
+
+class TestVisibility(TestCase):
+    def setUp(self):
+        super().setUp()
+        site = mixer.blend(Site, code='tst', active=True)
+        enclosure = mixer.blend(Enclosure, code='doma', site=site, active=True)
+        mixer.blend(Telescope, code='1m0a', enclosure=enclosure, active=True, lat=0.0, long=0.0, horizon=15.0,
+                    ha_limit_neg=-4.6, ha_limit_pos=4.6, zenith_blind_spot=0.0)
+        mixer.blend(Telescope, code='2m0a', enclosure=enclosure, active=True, lat=-30.0, long=20.0, horizon=30.0,
+                    ha_limit_neg=-12.0, ha_limit_pos=12.0, zenith_blind_spot=10.0)
+        mixer.blend(Telescope, code='0m4a', enclosure=enclosure, active=False, lat=0.0, long=0.0, horizon=15.0,
+                    ha_limit_neg=-12.0, ha_limit_pos=12.0, zenith_blind_spot=0.0)
+        cache.clear()
+        # Greenwich sidereal time is 280.46 degrees at noon of January 1st 2000, so this target transits then
+        self.transiting = {'ra': 280.46, 'dec': 0.0}
+        self.data = {'targets': [self.transiting], 'start': '2000-01-01T00:00:00Z', 'end': '2000-01-02T00:00:00Z',
+                     'step': 3600, 'telescopes': ['tst.doma.1m0a']}
+
+    def visibility(self, data):
+        return self.client.post(reverse('visibility'), data=json.dumps(data), content_type='application/json')
+
+    def streamed(self, response):
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_visibility_within_hour_angle_limits(self):
+        visibility = self.streamed(self.visibility(self.data))
+        self.assertEqual(visibility['telescopes'], ['tst.doma.1m0a'])
+        self.assertEqual(visibility['times'], 25)
+        # The target is above the horizon within 5 hours of transit, but the hour angle limits are tighter
+        self.assertEqual(visibility['results'],
+                         [{'tst.doma.1m0a': [['2000-01-01T08:00:00Z', '2000-01-01T16:00:00Z']]}])
+
+    def test_horizon_and_zenith_blind_spot(self):
+        limits = build_telescope_limits()
+        self.assertEqual(limits['telescopes'], ['tst.doma.1m0a', 'tst.doma.2m0a'])
+        noon = time_grid(datetime(2000, 1, 1, 12, tzinfo=timezone.utc), datetime(2000, 1, 1, 12, tzinfo=timezone.utc), 60)
+        visible = compute_visibility([280.46, 280.46, 300.46], [0.0, -80.0, -30.0], noon, limits)
+        self.assertEqual(visible.shape, (3, 2, 1))
+        # The southern target never rises above the horizon of the equatorial telescope, and the last target passes
+        # through the zenith of the second telescope, within its blind spot
+        self.assertEqual(visible[:, :, 0].tolist(), [[True, True], [False, True], [True, False]])
+        limits['zenith_blind_spot'][1] = 0.0
+        self.assertTrue(compute_visibility([300.46], [-30.0], noon, limits)[0, 1, 0])
+
+    def test_targets_are_computed_in_chunks(self):
+        limits = build_telescope_limits()
+        times = time_grid(datetime(2000, 1, 1, tzinfo=timezone.utc), datetime(2000, 1, 2, tzinfo=timezone.utc), 300)
+        random = np.random.default_rng(0)
+        ra, dec = random.uniform(0, 360, 10000), np.degrees(np.arcsin(random.uniform(-1, 1, 10000)))
+        visible = compute_visibility(ra, dec, times, limits)
+        self.assertEqual(visible.shape, (10000, 2, 289))
+        self.assertTrue(visible.any())
+        with patch('configdb.hardware.visibility.VISIBILITY_CHUNK_CELLS', 1000):
+            np.testing.assert_array_equal(compute_visibility(ra, dec, times, limits), visible)
+
+    def test_invalid_requests(self):
+        response = self.visibility({**self.data, 'targets': [{'ra': 400, 'dec': 0}, {'ra': 'x'}],
+                                    'end': '1999-12-31T00:00:00Z', 'telescopes': ['tst.doma.0m4a']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'targets[0]', 'targets[1]', 'end', 'telescopes'})
+        response = self.visibility({**self.data, 'step': 1})
+        self.assertIn('step', response.json()['errors'])
+
+    def test_results_are_the_same_whatever_the_chunks(self):
+        data = {**self.data, 'targets': [self.transiting] * 3, 'telescopes': ['tst.doma.1m0a', 'tst.doma.2m0a']}
+        visibility = self.streamed(self.visibility(data))
+        self.assertEqual(len(visibility['results']), 3)
+        # Computing the targets one chunk at a time gives the same intervals
+        with patch('configdb.hardware.visibility.VISIBILITY_CHUNK_CELLS', 50):
+            self.assertEqual(self.streamed(self.visibility(data)), visibility)
+
+    def test_ten_thousand_targets_from_twenty_telescopes(self):
+        enclosure = Enclosure.objects.get(code='doma')
+        for index in range(18):
+            mixer.blend(Telescope, code=f'{index}m0b', enclosure=enclosure, active=True, lat=index * 5.0 - 45.0,
+                        long=index * 20.0, horizon=15.0, ha_limit_neg=-12.0, ha_limit_pos=12.0, zenith_blind_spot=0.0)
+        random = np.random.default_rng(0)
+        targets = [{'ra': ra, 'dec': dec} for ra, dec in zip(
+            random.uniform(0, 360, 10000).tolist(), np.degrees(np.arcsin(random.uniform(-1, 1, 10000))).tolist()
+        )]
+        # The full request is a day at five minutes, the step is longer to keep the test short
+        data = {'targets': targets, 'start': '2000-01-01T00:00:00Z', 'end': '2000-01-02T00:00:00Z', 'step': 7200}
+        visibility = self.streamed(self.visibility(data))
+        self.assertEqual(len(visibility['telescopes']), 20)
+        self.assertEqual(visibility['times'], 13)
+        self.assertEqual(len(visibility['results']), 10000)
+        self.assertTrue(all(visibility['results'][:10]))
+
+
+class TestSiteWindows(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.equator = mixer.blend(Site, code='eqt', active=True, lat=0.0, long=0.0, restart='06:00:00')
+        self.hawaii = mixer.blend(Site, code='ogg', active=True, lat=20.7, long=-156.3, restart='23:55:00')
+        mixer.blend(Site, code='old', active=False)
+        cache.clear()
+        self.params = {'start': '2024-03-20', 'end': '2024-03-21'}
+
+    def windows(self, params):
+        return self.client.get(reverse('site_windows'), params)
+
+    def test_sun_altitude(self):
+        times = np.array(['2024-06-20T12:00:00', '2024-06-20T00:00:00'], dtype='datetime64[s]')
+        altitude = nights.sun_altitudes(times, [23.44], [0.0])
+        self.assertGreater(altitude[0, 0], 89.5)
+        self.assertLess(altitude[0, 1], -40)
+
+    def test_dark_windows_cross_the_sun_altitude(self):
+        response = self.windows({**self.params, 'sun_altitude': -18})
+        self.assertEqual(response.status_code, 200)
+        sites = response.json()['sites']
+        self.assertEqual(set(sites), {'eqt', 'ogg'})
+        dark = sites['eqt']['dark']
+        self.assertEqual(len(dark), 3)
+        # It is already dark at the start of the range and still dark at its end
+        self.assertEqual(dark[0][0], '2024-03-20T00:00:00Z')
+        self.assertEqual(dark[-1][1], '2024-03-22T00:00:00Z')
+        crossings = np.array([time.rstrip('Z') for interval in dark for time in interval][1:-1], dtype='datetime64[s]')
+        np.testing.assert_allclose(nights.sun_altitudes(crossings, [0.0], [0.0])[0], -18, atol=0.05)
+
+    def test_restart_windows(self):
+        sites = self.windows(self.params).json()['sites']
+        self.assertEqual(sites['eqt']['restart'], [['2024-03-20T06:00:00Z', '2024-03-20T06:15:00Z'],
+                                                   ['2024-03-21T06:00:00Z', '2024-03-21T06:15:00Z']])
+        # Restarts that run over midnight are split at the edges of the range
+        self.assertEqual(sites['ogg']['restart'], [['2024-03-20T00:00:00Z', '2024-03-20T00:10:00Z'],
+                                                   ['2024-03-20T23:55:00Z', '2024-03-21T00:10:00Z'],
+                                                   ['2024-03-21T23:55:00Z', '2024-03-22T00:00:00Z']])
+        sites = self.windows({**self.params, 'site': 'eqt', 'restart_duration': 60}).json()['sites']
+        self.assertEqual(list(sites), ['eqt'])
+        self.assertEqual(sites['eqt']['restart'][0], ['2024-03-20T06:00:00Z', '2024-03-20T06:01:00Z'])
+
+    def test_windows_are_cached_until_the_site_changes(self):
+        with patch('configdb.hardware.nights.compute_site_windows', wraps=nights.compute_site_windows) as compute:
+            first = self.windows(self.params).json()
+            self.assertEqual(self.windows(self.params).json(), first)
+            self.assertEqual(compute.call_count, 1)
+            self.equator.restart = '07:00:00'
+            self.equator.save()
+            sites = self.windows(self.params).json()['sites']
+            self.assertEqual(compute.call_count, 2)
+            self.assertEqual([site.code for site in compute.call_args[0][0]], ['eqt'])
+        self.assertEqual(sites['eqt']['restart'][0], ['2024-03-20T07:00:00Z', '2024-03-20T07:15:00Z'])
+        self.assertEqual(sites['ogg'], first['sites']['ogg'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.windows({'start': '2024-03-20'}).status_code, 400)
+        self.assertEqual(self.windows({'start': '2024-03-20', 'end': '2024-03-19'}).status_code, 400)
+        self.assertEqual(self.windows({'start': '2024-01-01', 'end': '2025-06-01'}).status_code, 400)
+        self.assertEqual(self.windows({**self.params, 'sun_altitude': 'dark'}).status_code, 400)
+        self.assertEqual(self.windows({**self.params, 'restart_duration': -1}).status_code, 400)
+
+
+class TestBenchmark(TestCase):
+    def test_query_counts_do_not_regress(self):
+        network_size = generate_network()
+        baseline = load_baseline(BASELINE_PATH)[network_size_key(network_size)]
+        results = run_benchmarks(repeat=1)
+        self.assertEqual(set(results), set(baseline))
+        # Time and memory depend on the machine, so only the query counts are checked here
+        regressions = compare_to_baseline(results, baseline, time_tolerance=float('inf'), memory_tolerance=float('inf'))
+        self.assertEqual(regressions, [])
+
+    def test_compare_to_baseline(self):
+        baseline = {'site-list': {'queries': 10, 'time_ms': 100.0, 'peak_memory_kb': 1000.0}}
+        results = {'site-list': {'queries': 10, 'time_ms': 140.0, 'peak_memory_kb': 1400.0}}
+        self.assertEqual(compare_to_baseline(results, baseline, time_tolerance=0.5, memory_tolerance=0.5), [])
+        results = {'site-list': {'queries': 11, 'time_ms': 200.0, 'peak_memory_kb': 1600.0}}
+        self.assertEqual(len(compare_to_baseline(results, baseline, time_tolerance=0.5, memory_tolerance=0.5)), 3)
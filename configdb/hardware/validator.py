@@ -1,6 +1,15 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+
 from cerberus import Validator
 
 
+# Number of compiled validators kept in memory. There is one for each combination of instrument type, configuration
+# type and modes that instrument configs are validated against, so this covers every combination of a whole network.
+VALIDATOR_CACHE_SIZE = 1024
+
+
 class OCSValidator(Validator):
     """ Custom validator that allows label, show(in UI), and description fields in the schema """
     def _validate_description(self, constraint, field, value):
@@ -11,3 +20,70 @@ class OCSValidator(Validator):
 
     def _validate_show(self, constraint, field, value):
         pass
+
+
+class CompiledValidator:
+    """ A validator for a schema that is checked and compiled once and reused for every document. Cerberus
+        validators hold the state of the document being validated, so validations of the same schema take turns.
+        Fields that are not in the schema are rejected unless allow_unknown is set.
+    """
+    def __init__(self, schema, allow_unknown=False):
+        self.schema = schema
+        self.validator = OCSValidator(schema, allow_unknown=allow_unknown)
+        self.lock = Lock()
+
+    def validate(self, document, normalize=True):
+        """ Validates a document against the schema. Returns whether it is valid, the errors by field and the
+            document normalized by the schema.
+        """
+        with self.lock:
+            valid = self.validator.validate(document, normalize=normalize)
+            return valid, self.validator.errors, self.validator.document
+
+
+def check_schema(schema):
+    """ Checks a validation schema that is being submitted, raising a SchemaError if it is invalid. The validator is
+        compiled without keeping it, since schemas that are never saved should not take the place of the ones in use.
+    """
+    OCSValidator(schema)
+
+
+def schema_key(schema):
+    """ A key that is the same for equal schemas, however their keys are ordered """
+    return json.dumps(schema, sort_keys=True, default=str)
+
+
+class ValidatorRegistry:
+    """ Compiled validators kept by their schema, so equal schemas share a validator. The least recently used
+        validators are dropped once the registry is full.
+    """
+    def __init__(self, size=VALIDATOR_CACHE_SIZE):
+        self.size = size
+        self._validators = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key, schema, allow_unknown=False):
+        with self._lock:
+            if key in self._validators:
+                self._validators.move_to_end(key)
+                return self._validators[key]
+        # Compiled outside the lock since checking a large schema is slow, an invalid schema raises a SchemaError
+        compiled = CompiledValidator(schema, allow_unknown)
+        with self._lock:
+            self._validators[key] = compiled
+            while len(self._validators) > self.size:
+                self._validators.popitem(last=False)
+        return compiled
+
+    def for_schema(self, schema, allow_unknown=False):
+        """ Returns the compiled validator of a schema, which allows fields the schema does not cover if
+            allow_unknown is set
+        """
+        return self._get(('schema', schema_key(schema), allow_unknown), schema, allow_unknown)
+
+    def clear(self):
+        with self._lock:
+            self._validators.clear()
+
+
+validator_registry = ValidatorRegistry()
@@ -1,13 +1,39 @@
-from datetime import datetime
+import json
+import time
+from datetime import date, datetime
 from dateutil.parser import parse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.generic import TemplateView
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseNotFound, StreamingHttpResponse
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
 
 from configdb.hardware.serializers import AvailabilityHistorySerializer
-from configdb.hardware.models import Site, Telescope, Camera, Instrument, OpticalElementGroup, GenericModeGroup
-from configdb.hardware.availability import build_instrument_availability_history, build_telescope_availability_history
+from configdb.hardware.models import (
+    Site, Telescope, Camera, Instrument, OpticalElementGroup, GenericModeGroup, ConfigurationGeneration
+)
+from configdb.hardware.availability import (
+    build_instrument_availability_history, build_telescope_availability_history, build_network_availability_history
+)
+from configdb.hardware.changes import get_changes, get_current_cursor, parse_cursor, wait_for_changes
+from configdb.hardware.capabilities import build_capabilities, filter_capabilities
+from configdb.hardware.diff import resolve_cursor, diff_configuration
+from configdb.hardware.network import apply_network, NetworkDocumentError
+from configdb.hardware.schemas import (
+    validate_instrument_configs, load_instrument_types, get_schema_sources, get_all_schema_sources, get_merged_schema,
+    get_instrument_type_schemas, get_schema_version, SchemaCombinationError
+)
+from configdb.hardware.durations import compute_durations, build_overhead_tables
+from configdb.hardware.visibility import target_visibility, build_telescope_limits, VisibilityError
+from configdb.hardware.nights import (
+    get_site_windows, DEFAULT_SUN_ALTITUDE, DEFAULT_RESTART_DURATION, MAX_WINDOW_DAYS
+)
+from configdb.hardware.snapshot import get_by_generation
 
 class IndexView(TemplateView):
     template_name = 'hardware/index.html'
@@ -23,6 +49,31 @@ class IndexView(TemplateView):
         return context
 
 
+def parse_availability_window(request):
+    """ Start/end are optional parameters to cap what is returned """
+    start = request.GET.get('start')
+    end = request.GET.get('end')
+    if start:
+        start = parse(start).replace(tzinfo=timezone.utc)
+    else:
+        start = datetime(2010, 1, 1, tzinfo=timezone.utc)
+    if end:
+        end = parse(end).replace(tzinfo=timezone.utc)
+    else:
+        end = timezone.now()
+    return start, end
+
+
+def format_availability_intervals(availability, start, end):
+    return [
+        {
+            'start': interval[0].replace(microsecond=0, tzinfo=None).isoformat(),
+            'end': interval[1].replace(microsecond=0, tzinfo=None).isoformat()
+        }
+        for interval in availability if interval[0] <= end and interval[1] >= start
+    ]
+
+
 class AvailabilityHistoryView(RetrieveAPIView):
     """ Use django-reversion models to build a set of timestamps for when an instrument or telescope has availability
         Meaning it has at least one schedulable instrument
@@ -35,18 +86,8 @@ class AvailabilityHistoryView(RetrieveAPIView):
         telescope_id = request.GET.get('telescope_id')
         site_id = request.GET.get('site_id')
         enclosure_id = request.GET.get('enclosure_id')
-        # Start/end are optional parameters to cap what is returned
-        start = request.GET.get('start')
-        end = request.GET.get('end')
         try:
-            if start:
-                start = parse(start).replace(tzinfo=timezone.utc)
-            else:
-                start = datetime(2010, 1, 1, tzinfo=timezone.utc)
-            if end:
-                end = parse(end).replace(tzinfo=timezone.utc)
-            else:
-                end = timezone.now()
+            start, end = parse_availability_window(request)
         except Exception:
             return HttpResponseBadRequest('The format used for the start/end parameters is not parseable')
 
@@ -68,11 +109,323 @@ class AvailabilityHistoryView(RetrieveAPIView):
                 return HttpResponseNotFound(f'No telescope found with code {site_id}.{enclosure_id}.{telescope_id}')
             availability = build_telescope_availability_history(telescope)
 
-        availability_data = {'availability_intervals': []}
-        for interval in availability:
-            if interval[0] <= end and interval[1] >= start:
-                availability_data['availability_intervals'].append({
-                    'start': interval[0].replace(microsecond=0, tzinfo=None).isoformat(),
-                    'end': interval[1].replace(microsecond=0, tzinfo=None).isoformat()
-                })
+        availability_data = {'availability_intervals': format_availability_intervals(availability, start, end)}
         return JsonResponse(data=availability_data)
+
+
+class BulkAvailabilityHistoryView(APIView):
+    """ Returns the availability history of every telescope and instrument in the network in a single call.
+        The instruments can be narrowed down by site, instrument type and current state, and each telescope's
+        availability is computed from its instruments in that set. The result is streamed one telescope at a time.
+    """
+    schema = None
+
+    def get(self, request):
+        try:
+            start, end = parse_availability_window(request)
+        except Exception:
+            return HttpResponseBadRequest('The format used for the start/end parameters is not parseable')
+        instruments = Instrument.objects.all()
+        if request.GET.get('site_id'):
+            instruments = instruments.filter(telescope__enclosure__site__code=request.GET['site_id'])
+        if request.GET.get('instrument_type'):
+            instruments = instruments.filter(instrument_type__code=request.GET['instrument_type'])
+        if request.GET.getlist('state'):
+            instruments = instruments.filter(state__in=request.GET.getlist('state'))
+
+        def stream():
+            yield '{"telescopes": ['
+            for index, (telescope, telescope_availability, instruments_availability) in enumerate(
+                    build_network_availability_history(instruments)):
+                telescope_data = {
+                    'telescope': str(telescope),
+                    'availability_intervals': format_availability_intervals(telescope_availability, start, end),
+                    'instruments': [
+                        {
+                            'instrument': instrument.code,
+                            'availability_intervals': format_availability_intervals(instrument_availability, start, end)
+                        }
+                        for instrument, instrument_availability in instruments_availability
+                    ]
+                }
+                yield (',' if index else '') + json.dumps(telescope_data)
+            yield ']}'
+
+        return StreamingHttpResponse(stream(), content_type='application/json')
+
+
+class ChangesView(APIView):
+    """ Use django-reversion models to return the hardware objects created, updated or deleted since a cursor.
+        Calling without a cursor returns the current cursor, to be used after downloading the full configuration.
+    """
+    schema = None
+
+    def get(self, request):
+        since = request.GET.get('since')
+        if since is None:
+            return JsonResponse(data={'cursor': get_current_cursor(), 'changes': []})
+        try:
+            changes = get_changes(since)
+        except ValueError:
+            return HttpResponseBadRequest('The since parameter must be a cursor returned by a previous call')
+        return JsonResponse(data=changes)
+
+
+def parse_change_notification_request(request):
+    """ Returns the cursor to wait for changes after, and the model names and site to filter the changes by.
+        Raises a ValueError if the cursor is malformed.
+    """
+    since = request.GET.get('since') or request.META.get('HTTP_LAST_EVENT_ID')
+    if since:
+        parse_cursor(since)
+    else:
+        since = get_current_cursor()
+    return since, request.GET.getlist('model'), request.GET.get('site')
+
+
+class WaitForChangesView(APIView):
+    """ Long poll for changes. Returns as soon as there are changes after the cursor that match the model and site
+        filters, or with no changes once the timeout has passed. Calling without a cursor waits for changes after
+        the current configuration.
+    """
+    schema = None
+
+    def get(self, request):
+        try:
+            since, models, site = parse_change_notification_request(request)
+            timeout = float(request.GET.get('timeout', settings.CHANGES_WAIT_TIMEOUT))
+            if not timeout >= 0:
+                raise ValueError(f'Invalid timeout {timeout}')
+        except ValueError:
+            return HttpResponseBadRequest('The since parameter must be a cursor and the timeout a number of seconds')
+        return JsonResponse(data=wait_for_changes(since, min(timeout, settings.CHANGES_WAIT_TIMEOUT), models, site))
+
+
+class ChangesStreamView(APIView):
+    """ Server-sent event stream of changes. An event is sent with the changes that match the model and site filters
+        as they happen, with the cursor after them as its id so that clients reconnect from where they left off.
+        The stream is closed after CHANGES_STREAM_DURATION seconds, which the event source reconnects from.
+    """
+    schema = None
+
+    def get(self, request):
+        try:
+            since, models, site = parse_change_notification_request(request)
+        except ValueError:
+            return HttpResponseBadRequest('The since parameter or Last-Event-ID header must be a cursor')
+
+        def stream():
+            cursor = since
+            deadline = time.monotonic() + settings.CHANGES_STREAM_DURATION
+            yield f'id: {cursor}\nevent: cursor\ndata: {json.dumps({"cursor": cursor})}\n\n'
+            while time.monotonic() < deadline:
+                timeout = min(settings.CHANGES_WAIT_TIMEOUT, deadline - time.monotonic())
+                changes = wait_for_changes(cursor, timeout, models, site)
+                cursor = changes['cursor']
+                if changes['changes']:
+                    yield f'id: {cursor}\nevent: changes\ndata: {json.dumps(changes, cls=DjangoJSONEncoder)}\n\n'
+                else:
+                    yield ': keepalive\n\n'
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops proxies like nginx from buffering the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class CapabilitiesView(APIView):
+    """ Returns one flat row per instrument of what it can do, with its telescope's geometry and limits, its
+        instrument type's overheads and the codes of its optical elements and generic modes by group. Only
+        SCHEDULABLE instruments are returned unless other states are requested. The rows are built from a fixed
+        number of queries and cached per configuration generation.
+    """
+    schema = None
+
+    def get(self, request):
+        capabilities = filter_capabilities(
+            get_by_generation('capabilities', ConfigurationGeneration.current().generation, build_capabilities),
+            site=request.GET.get('site'),
+            instrument_type=request.GET.get('instrument_type'),
+            instrument_category=request.GET.get('instrument_category'),
+            states=request.GET.getlist('state') or (Instrument.SCHEDULABLE,)
+        )
+        return JsonResponse(data={'count': len(capabilities), 'results': capabilities})
+
+
+class DiffView(APIView):
+    """ Returns the objects that were added, removed or changed between two points in the configuration history,
+        and the fields that changed on each changed object. Each point is a timestamp or a cursor returned by the
+        changes endpoint, and the end point defaults to the current configuration.
+    """
+    schema = None
+
+    def get(self, request):
+        if not request.GET.get('from'):
+            return HttpResponseBadRequest('The from parameter is required')
+        try:
+            diff = diff_configuration(resolve_cursor(request.GET['from']), resolve_cursor(request.GET.get('to')))
+        except (ValueError, OverflowError):
+            return HttpResponseBadRequest('The from and to parameters must be timestamps or cursors, with from before to')
+        return JsonResponse(data=diff)
+
+
+class NetworkView(APIView):
+    """ Creates, updates and optionally deletes hardware in bulk from a network document, which describes the
+        network from its sites down to its optical elements with every object identified by its code. The whole
+        document is applied in a single transaction and revision, or not at all. Returns the changes that were
+        made, or that would be made in a dry run.
+    """
+    schema = None
+
+    def post(self, request):
+        try:
+            plan = apply_network(
+                request.data,
+                prune=request.GET.get('prune', '').lower() in ('true', '1'),
+                dry_run=request.GET.get('dry_run', '').lower() in ('true', '1')
+            )
+        except NetworkDocumentError as e:
+            return JsonResponse(data={'errors': e.errors}, status=400)
+        return JsonResponse(data={'changes': [change.as_dict() for change in plan]})
+
+
+class ComputeView(APIView):
+    """ Base of the endpoints that compute answers about a request body from the configuration. They do not change
+        anything, so they are open to anyone like the read endpoints.
+    """
+    schema = None
+    permission_classes = (AllowAny,)
+
+
+class ValidateView(ComputeView):
+    """ Validates a batch of instrument configs against the merged validation schemas of their instrument type,
+        configuration type and generic modes. Each item is an object with the instrument_type and configuration_type
+        codes, the modes as mode type to mode code and the instrument_config to validate. Returns the validity,
+        errors and normalized instrument config of each item in the order they were given.
+    """
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return HttpResponseBadRequest('The request body must be a list of instrument configs to validate')
+        results = validate_instrument_configs(request.data)
+        return JsonResponse(data={
+            'valid': all(result['valid'] for result in results),
+            'results': results
+        })
+
+
+class SchemaView(APIView):
+    """ Returns the effective validation schema of instrument configs for an instrument type, merged from the
+        schemas of the instrument type, the configuration type properties and the generic modes. With a
+        configuration_type and mode=<mode type>:<mode code> parameters it returns the schema of that combination,
+        and otherwise the schemas of every valid combination of the instrument type. Schemas are cached and have
+        etags until any object that contributes to them changes.
+    """
+    schema = None
+
+    def get(self, request):
+        if not request.GET.get('instrument_type'):
+            return HttpResponseBadRequest('The instrument_type parameter is required')
+        instrument_type = load_instrument_types([request.GET['instrument_type']]).get(request.GET['instrument_type'])
+        if instrument_type is None:
+            return HttpResponseNotFound(f'Unknown instrument type {request.GET["instrument_type"]}')
+        modes = {}
+        for mode in request.GET.getlist('mode'):
+            mode_type, _, mode_code = mode.partition(':')
+            modes[mode_type] = mode_code
+        combination = 'configuration_type' in request.GET or modes
+        try:
+            if combination:
+                sources = get_schema_sources(instrument_type, request.GET.get('configuration_type'), modes)
+            else:
+                sources = get_all_schema_sources(instrument_type)
+        except SchemaCombinationError as e:
+            return JsonResponse(data={'errors': e.errors}, status=400)
+        # Only the etag is used, since the schema version also changes when a source is removed or replaced by an
+        # older one, which a last modified time would miss
+        etag = quote_etag(get_schema_version(sources))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if combination:
+                response = JsonResponse(data={
+                    'instrument_type': instrument_type.code,
+                    'configuration_type': request.GET.get('configuration_type'),
+                    'modes': modes,
+                    'schema': get_merged_schema(sources)
+                })
+            else:
+                response = JsonResponse(data={
+                    'instrument_type': instrument_type.code,
+                    'results': get_instrument_type_schemas(instrument_type)
+                })
+        response['ETag'] = etag
+        return response
+
+
+class DurationView(ComputeView):
+    """ Estimates the durations of a batch of requests from the overheads of their telescopes, instrument types,
+        configuration types, generic modes and optical element groups. Each request has an optional telescope, as
+        site.enclosure.telescope codes, and a list of configurations to estimate. Returns the duration of each
+        request and of its configurations, or its errors, in the order they were given.
+    """
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return HttpResponseBadRequest('The request body must be a list of requests to estimate')
+        tables = get_by_generation('overhead_tables', ConfigurationGeneration.current().generation, build_overhead_tables)
+        results = compute_durations(request.data, tables)
+        return JsonResponse(data={'results': results})
+
+
+class VisibilityView(ComputeView):
+    """ Computes when a batch of targets is visible from the active telescopes of the network, within their horizon,
+        hour angle limits and zenith blind spot. The body has the targets as objects with an ra and dec in degrees,
+        the start and end of the time grid, its step in seconds and optionally the paths of the telescopes to
+        check. Returns, for each target, the intervals of the time grid each telescope can see it. The results are
+        streamed as they are computed, so there is no limit on the number of targets.
+    """
+
+    def post(self, request):
+        try:
+            visibility = target_visibility(request.data, get_by_generation(
+                'telescope_limits', ConfigurationGeneration.current().generation, build_telescope_limits
+            ))
+        except VisibilityError as e:
+            return JsonResponse(data={'errors': e.errors}, status=400)
+        return StreamingHttpResponse(visibility, content_type='application/json')
+
+
+class SiteWindowsView(APIView):
+    """ Returns the dark and daily restart windows of the active sites for each day from the start date to the end
+        date, as lists of start and end times in UTC. Dark windows are when the sun is below sun_altitude, which
+        defaults to nautical twilight, and restart windows last restart_duration seconds from each site's restart
+        time. The windows of each site are cached until the site changes.
+    """
+    schema = None
+
+    def get(self, request):
+        try:
+            start = date.fromisoformat(request.GET.get('start', ''))
+            end = date.fromisoformat(request.GET.get('end', ''))
+        except ValueError:
+            return HttpResponseBadRequest('The start and end parameters are required and must be dates')
+        if not 0 <= (end - start).days < MAX_WINDOW_DAYS:
+            return HttpResponseBadRequest(f'The end must be on or after the start and within {MAX_WINDOW_DAYS} days of it')
+        try:
+            sun_altitude = float(request.GET.get('sun_altitude', DEFAULT_SUN_ALTITUDE))
+            restart_duration = int(request.GET.get('restart_duration', DEFAULT_RESTART_DURATION))
+        except ValueError:
+            return HttpResponseBadRequest('The sun_altitude and restart_duration parameters must be numbers')
+        if not -90 <= sun_altitude <= 90 or not 0 <= restart_duration <= 86400:
+            return HttpResponseBadRequest(
+                'The sun_altitude must be between -90 and 90 degrees and the restart_duration at most a day in seconds'
+            )
+        windows = get_site_windows(start, end, sun_altitude, restart_duration, site_codes=request.GET.getlist('site'))
+        return JsonResponse(data={
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'sun_altitude': sun_altitude,
+            'restart_duration': restart_duration,
+            'sites': windows
+        })
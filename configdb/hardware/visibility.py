@@ -0,0 +1,199 @@
+''' Visibility of targets from the telescopes of the network. The altitude and hour angle of every target from every
+    telescope at every time of a grid are computed together with NumPy broadcasting, and checked against the horizon,
+    hour angle limits and zenith blind spot of each telescope. Targets are computed, turned into intervals and written
+    out a chunk at a time, so only one chunk of the visibility array and its intervals is held in memory.
+
+    Coordinates are taken as of the date of observation, and precession, nutation and refraction are ignored. That
+    is well within the sampling of a scheduling time grid, but not meant for pointing.
+'''
+import json
+from datetime import timezone
+
+import numpy as np
+from dateutil.parser import parse
+
+from configdb.hardware.models import Telescope
+
+
+TELESCOPE_LIMITS = ('lat', 'long', 'horizon', 'ha_limit_neg', 'ha_limit_pos', 'zenith_blind_spot')
+
+# Number of (target, telescope, time) cells computed at once. Targets are computed in chunks of this many cells to
+# bound the memory of the intermediate arrays, which take 8 bytes per cell each.
+VISIBILITY_CHUNK_CELLS = 2 ** 22
+
+# Largest time grid of a request to the visibility endpoint, a week at five minutes
+MAX_VISIBILITY_TIMES = 2016
+
+
+class VisibilityError(ValueError):
+    """ Raised for targets, times or telescopes that visibility cannot be computed for, with the errors by field
+        like a validation error
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(str(errors))
+
+
+def build_telescope_limits():
+    """ Builds arrays of the location and pointing limits of every active telescope, in the order of their paths """
+    telescopes = Telescope.objects.filter(
+        active=True, enclosure__active=True, enclosure__site__active=True
+    ).select_related('enclosure__site').order_by('enclosure__site__code', 'enclosure__code', 'code')
+    telescopes = list(telescopes)
+    return {
+        'telescopes': [str(telescope) for telescope in telescopes],
+        **{field: np.array([getattr(telescope, field) for telescope in telescopes], dtype=float)
+           for field in TELESCOPE_LIMITS}
+    }
+
+
+def select_telescopes(limits, paths):
+    """ Narrows the telescope limits down to the telescopes with the given paths, in the order they are given """
+    unknown = [path for path in paths if path not in limits['telescopes']]
+    if unknown:
+        raise VisibilityError({'telescopes': [f'Unknown or inactive telescope {path}' for path in unknown]})
+    indices = [limits['telescopes'].index(path) for path in paths]
+    return {'telescopes': list(paths), **{field: limits[field][indices] for field in TELESCOPE_LIMITS}}
+
+
+def time_grid(start, end, step):
+    """ Times from start to end inclusive, every step seconds, as an array of UTC datetime64 """
+    start, end = (np.datetime64(int(time.timestamp()), 's') for time in (start, end))
+    return np.arange(start, end + np.timedelta64(1, 's'), np.timedelta64(int(step), 's'))
+
+
+def greenwich_sidereal_time(times):
+    """ Greenwich mean sidereal time in degrees of an array of UTC datetime64 """
+    seconds = (np.asarray(times, dtype='datetime64[s]') - np.datetime64(0, 's')).astype(float)
+    days_since_j2000 = seconds / 86400.0 + 2440587.5 - 2451545.0
+    return np.mod(280.46061837 + 360.98564736629 * days_since_j2000, 360.0)
+
+
+def iter_visibility(ra, dec, times, limits):
+    """ Computes whether each target is visible from each telescope at each time, a chunk of targets at a time.
+        Targets are arrays of ra and dec in degrees, times are UTC datetime64 and the telescopes are given by their
+        limits. Yields boolean arrays of shape (targets in the chunk, telescopes, times), in the order of the targets.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.radians(np.asarray(dec, dtype=float))
+    # Telescope quantities are (telescope, time) or (telescope, 1) so they broadcast against a chunk of targets. The
+    # altitude and zenith limits are compared as sines of the altitude and the hour angle limits in degrees, so no
+    # inverse trigonometry is needed per cell.
+    local_sidereal_time = greenwich_sidereal_time(times)[None, :] + limits['long'][:, None]
+    cos_lst, sin_lst = np.cos(np.radians(local_sidereal_time)), np.sin(np.radians(local_sidereal_time))
+    latitude = np.radians(limits['lat'])[:, None]
+    sin_latitude, cos_latitude = np.sin(latitude), np.cos(latitude)
+    min_sin_altitude = np.sin(np.radians(limits['horizon']))[:, None]
+    max_sin_altitude = np.cos(np.radians(limits['zenith_blind_spot']))[:, None]
+    ha_limit_neg, ha_limit_pos = limits['ha_limit_neg'][:, None] * 15.0, limits['ha_limit_pos'][:, None] * 15.0
+    chunk_size = max(1, VISIBILITY_CHUNK_CELLS // max(1, local_sidereal_time.size))
+    for start in range(0, len(ra), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        target_ra = np.radians(ra[chunk])[:, None, None]
+        target_dec = dec[chunk, None, None]
+        # cos(lst - ra) expanded so the cosines are only taken per target and per (telescope, time)
+        cos_hour_angle = cos_lst * np.cos(target_ra) + sin_lst * np.sin(target_ra)
+        sin_altitude = np.sin(target_dec) * sin_latitude + np.cos(target_dec) * cos_latitude * cos_hour_angle
+        hour_angle = np.mod(local_sidereal_time - ra[chunk, None, None] + 180.0, 360.0) - 180.0
+        yield ((sin_altitude >= min_sin_altitude) & (sin_altitude <= max_sin_altitude)
+               & (hour_angle >= ha_limit_neg) & (hour_angle <= ha_limit_pos))
+
+
+def compute_visibility(ra, dec, times, limits):
+    """ Computes whether each target is visible from each telescope at each time, like iter_visibility but all at
+        once. Returns a boolean array of shape (targets, telescopes, times).
+    """
+    visible = np.zeros((len(ra), len(limits['telescopes']), len(times)), dtype=bool)
+    start = 0
+    for chunk in iter_visibility(ra, dec, times, limits):
+        visible[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return visible
+
+
+def visibility_intervals(visible, times, telescopes):
+    """ Converts a visibility array into, for each target, the intervals each telescope can see it as lists of the
+        first and last visible times of the grid. Telescopes that never see a target are left out.
+    """
+    padded = np.zeros((*visible.shape[:-1], visible.shape[-1] + 2), dtype=np.int8)
+    padded[..., 1:-1] = visible
+    changes = np.diff(padded, axis=-1)
+    # Both are in row major order, so the nth start and end belong to the same interval
+    starts = np.argwhere(changes == 1)
+    ends = np.argwhere(changes == -1)[:, -1] - 1
+    labels = np.datetime_as_string(times, unit='s', timezone='UTC')
+    results = [{} for _ in range(visible.shape[0])]
+    for (target, telescope, start), end in zip(starts.tolist(), ends.tolist()):
+        results[target].setdefault(telescopes[telescope], []).append([labels[start], labels[end]])
+    return results
+
+
+def _parse_time(value, field, errors):
+    try:
+        time = parse(value)
+    except (TypeError, ValueError, OverflowError):
+        errors[field] = ['Must be a timestamp']
+        return None
+    return time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+
+
+def parse_visibility_request(data, limits):
+    """ Reads the targets, time grid and telescopes of a visibility request. Raises a VisibilityError with every
+        error in the request.
+    """
+    if not isinstance(data, dict):
+        raise VisibilityError({'non_field_errors': ['The request body must be an object']})
+    errors = {}
+    targets = data.get('targets')
+    if not isinstance(targets, list) or not targets:
+        errors['targets'] = ['A list of targets with ra and dec is required']
+        targets = []
+    coordinates = np.zeros((len(targets), 2))
+    for index, target in enumerate(targets):
+        try:
+            coordinates[index] = float(target['ra']), float(target['dec'])
+        except (TypeError, KeyError, ValueError):
+            errors[f'targets[{index}]'] = ['Must be an object with a numeric ra and dec']
+            continue
+        if not (0 <= coordinates[index, 0] <= 360 and -90 <= coordinates[index, 1] <= 90):
+            errors[f'targets[{index}]'] = ['The ra must be between 0 and 360 degrees and the dec between -90 and 90']
+    start = _parse_time(data.get('start'), 'start', errors)
+    end = _parse_time(data.get('end'), 'end', errors)
+    step = data.get('step', 300)
+    if isinstance(step, bool) or not isinstance(step, int) or step < 1:
+        errors['step'] = ['Must be a whole number of seconds']
+    elif start and end:
+        if end < start:
+            errors['end'] = ['Must not be before the start']
+        elif (end - start).total_seconds() // step >= MAX_VISIBILITY_TIMES:
+            errors['step'] = [f'The time grid can have at most {MAX_VISIBILITY_TIMES} times']
+    telescopes = data.get('telescopes')
+    if telescopes is not None:
+        try:
+            limits = select_telescopes(limits, telescopes if isinstance(telescopes, list) else [telescopes])
+        except VisibilityError as e:
+            errors.update(e.errors)
+    if errors:
+        raise VisibilityError(errors)
+    return coordinates[:, 0], coordinates[:, 1], time_grid(start, end, step), limits
+
+
+def _stream_visibility(ra, dec, times, limits):
+    yield f'{{"telescopes": {json.dumps(limits["telescopes"])}, "times": {len(times)}, "results": ['
+    separator = ''
+    for visible in iter_visibility(ra, dec, times, limits):
+        for result in visibility_intervals(visible, times, limits['telescopes']):
+            yield separator + json.dumps(result)
+            separator = ','
+    yield ']}'
+
+
+def target_visibility(data, limits):
+    """ Computes the visibility of a request of targets, given as objects with an ra and dec in degrees, over a time
+        grid from start to end every step seconds, from every telescope of the limits or the telescopes given by
+        path. The request is checked up front, raising a VisibilityError, and the response is returned as pieces
+        of JSON text that are computed a chunk of targets at a time as they are written. The response has the
+        telescopes, the number of times and, for each target, its visibility intervals by telescope.
+    """
+    ra, dec, times, limits = parse_visibility_request(data, limits)
+    return _stream_visibility(ra, dec, times, limits)
@@ -120,6 +120,15 @@ DATABASES = {
     }
 }
 
+# Cache used for configuration snapshots. The default local memory cache is per-process, so
+# set this to a shared cache like memcached or redis when running multiple workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'configdb-cache'),
+    }
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -157,6 +166,17 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Serialize read requests with the fast serializers instead of the DRF serializers by default.
+# Either can also be chosen per request with the serializer=fast or serializer=standard query parameter
+FAST_SERIALIZATION = str2bool(os.getenv('FAST_SERIALIZATION', 'false'))
+
+# Change notifications check the configuration generation every CHANGES_POLL_INTERVAL seconds while they wait.
+# A long poll waits up to CHANGES_WAIT_TIMEOUT seconds, and an event stream sends a keepalive that often and is
+# closed after CHANGES_STREAM_DURATION seconds, after which clients reconnect with the last cursor they received
+CHANGES_POLL_INTERVAL = float(os.getenv('CHANGES_POLL_INTERVAL', 1))
+CHANGES_WAIT_TIMEOUT = float(os.getenv('CHANGES_WAIT_TIMEOUT', 30))
+CHANGES_STREAM_DURATION = float(os.getenv('CHANGES_STREAM_DURATION', 5 * 60))
+
 # To submit instrument capability updates to the SCIMMA Heroic service
 # You must first login to heroic and get your API token, and your account
 # must be listed as the admin account for an observatory
@@ -165,6 +185,11 @@ HEROIC_API_TOKEN = os.getenv('HEROIC_API_TOKEN', '')
 HEROIC_OBSERVATORY = os.getenv('HEROIC_OBSERVATORY', '')
 HEROIC_EXCLUDE_SITES = get_list_from_env('HEROIC_EXCLUDE_SITES', '')
 HEROIC_EXCLUDE_TELESCOPES = get_list_from_env('HEROIC_EXCLUDE_TELESCOPES', '')
+# Updates are queued in an outbox and delivered by the heroic_worker management command
+HEROIC_REQUEST_TIMEOUT = float(os.getenv('HEROIC_REQUEST_TIMEOUT', 10))
+HEROIC_MAX_ATTEMPTS = int(os.getenv('HEROIC_MAX_ATTEMPTS', 10))
+HEROIC_RETRY_DELAY = float(os.getenv('HEROIC_RETRY_DELAY', 30))
+HEROIC_MAX_RETRY_DELAY = float(os.getenv('HEROIC_MAX_RETRY_DELAY', 60 * 60))
 
 CORS_ORIGIN_ALLOW_ALL = True
 
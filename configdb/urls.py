@@ -9,7 +9,11 @@ from rest_framework import permissions
 
 from configdb.hardware import urls as hardware_urls
 from configdb.schema import ConfigDBSchemaGenerator
-from configdb.hardware.views import AvailabilityHistoryView
+from configdb.hardware.views import (
+    AvailabilityHistoryView, BulkAvailabilityHistoryView, ChangesView, CapabilitiesView, DiffView,
+    WaitForChangesView, ChangesStreamView, NetworkView, ValidateView,
+    SchemaView, DurationView, VisibilityView, SiteWindowsView
+)
 
 
 schema_view = get_schema_view(
@@ -23,6 +27,18 @@ urlpatterns = [
     re_path(r'^admin/', admin.site.urls),
     re_path(r'^', include(hardware_urls)),
     path('api/availability_history/', AvailabilityHistoryView.as_view(), name='availability'),
+    path('api/availability_history/bulk/', BulkAvailabilityHistoryView.as_view(), name='availability-bulk'),
+    path('api/changes/', ChangesView.as_view(), name='changes'),
+    path('api/changes/wait/', WaitForChangesView.as_view(), name='changes-wait'),
+    path('api/changes/stream/', ChangesStreamView.as_view(), name='changes-stream'),
+    path('api/capabilities/', CapabilitiesView.as_view(), name='capabilities'),
+    path('api/diff/', DiffView.as_view(), name='diff'),
+    path('api/network/', NetworkView.as_view(), name='network'),
+    path('api/validate/', ValidateView.as_view(), name='validate'),
+    path('api/schemas/', SchemaView.as_view(), name='schemas'),
+    path('api/durations/', DurationView.as_view(), name='durations'),
+    path('api/visibility/', VisibilityView.as_view(), name='visibility'),
+    path('api/site_windows/', SiteWindowsView.as_view(), name='site_windows'),
     path('openapi/', schema_view, name='openapi-schema'),
     path('redoc/', TemplateView.as_view(
         template_name='redoc.html',